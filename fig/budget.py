@@ -0,0 +1,220 @@
+import io
+from collections import namedtuple
+
+from PIL import Image
+
+from fig.composite import composite_frames
+from fig.encoder import GifWriter, DeltaEncoder, write_gif
+from fig.palette import Palette, MAX_COLORS, sample_indices
+
+# How a GIF is shrunk to fit a size budget.
+#   scale   factor for the width and height of every frame
+#   colors  size of the shared palette
+#   step    every step-th frame is kept, showing for the frames it replaces
+SizeSettings = namedtuple('SizeSettings', ['scale', 'colors', 'step'])
+
+# Settings from the best looking to the smallest GIF, every one gives up a
+# little more size, colors or frame rate than the one before it
+SIZE_STEPS = (
+    SizeSettings(1.0, 255, 1),
+    SizeSettings(1.0, 128, 1),
+    SizeSettings(0.85, 128, 1),
+    SizeSettings(0.85, 64, 1),
+    SizeSettings(0.7, 64, 1),
+    SizeSettings(0.7, 64, 2),
+    SizeSettings(0.55, 64, 2),
+    SizeSettings(0.55, 32, 2),
+    SizeSettings(0.4, 32, 2),
+    SizeSettings(0.4, 32, 3),
+    SizeSettings(0.3, 16, 3),
+    SizeSettings(0.25, 16, 4),
+)
+
+# Sizes are estimated from this many runs of consecutive frames
+ESTIMATE_RUNS = 8
+ESTIMATE_RUN_FRAMES = 4
+
+# Estimates are off by a few percent, settings must fit this share of the budget
+ESTIMATE_MARGIN = 0.92
+
+
+class _SizingWriter(GifWriter):
+    """GifWriter that records how many bytes the header and every frame took"""
+
+    def __init__(self, fp, size, loop=0, palette=None):
+        super().__init__(fp, size, loop, palette)
+        self.header_size = fp.tell()
+        self.frame_sizes = []
+
+    def write_frame(self, image, offset=(0, 0), duration=0, disposal=0, transparency=None):
+        start = self.fp.tell()
+        super().write_frame(image, offset, duration, disposal, transparency)
+        self.frame_sizes.append(self.fp.tell() - start)
+
+
+class _ScaledTransform:
+    """A Transform followed by a resize, picklable to the compositing workers"""
+
+    def __init__(self, transform, size):
+        self.transform = transform
+        self.size = size
+
+    # Whether frames already have the size is only known per frame
+    is_identity = False
+
+    def output_size(self, size):
+        return self.size
+
+    def apply(self, image, paint=None):
+        image = self.transform.apply(image, paint)
+        if image.size != self.size:
+            image = image.resize(self.size, Image.Resampling.LANCZOS)
+        return image
+
+
+class SizeFitter:
+    """
+    Finds the best SIZE_STEPS settings whose GIF fits a byte budget, and
+    writes it.
+
+    A GIF's size is estimated by encoding a few short runs of consecutive
+    frames spread over the export, with the same delta encoder and palette
+    the whole GIF gets: the first frame of a run costs what the GIF's first
+    frame costs, the others what one of its changed frames costs. Sampled
+    frames are kept composited, scaled and quantized between estimates, so
+    trying other settings only redoes the part they change and the search
+    costs a fraction of one full encode.
+
+    Arguments are those of composite_frames, with the durations, loop count
+    and optionally the source GIF's color table to keep at full quality.
+    """
+
+    def __init__(self, frames, durations, load, transform, paint=None,
+                 dither=False, table=None, loop=0, source=None):
+        self.frames = list(frames)
+        self.durations = list(durations)
+        self.load = load
+        self.transform = transform
+        self.paint = paint
+        self.dither = dither
+        self.table = table
+        self.loop = loop
+        self.source = source
+        self._composited = {}  # Frame index -> RGBA frame as edited
+        self._scaled = {}  # (index, scale) -> RGBA frame
+        self._indexed = {}  # (index, scale, colors) -> P frame on the palette
+        self._palettes = {}  # (scale, colors) -> Palette
+        self._estimates = {}  # SizeSettings -> bytes
+
+    def size(self, scale):
+        """Frame size of the GIF at a scale"""
+        width, height = self._image(0, 1.0).size
+        return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    def kept(self, step):
+        """(frame index, duration) of the frames kept with a step, each showing for those it drops"""
+        return [(i, sum(self.durations[i:i + step])) for i in range(0, len(self.frames), step)]
+
+    def estimate(self, settings):
+        """Estimated bytes of the GIF written with settings"""
+        if settings in self._estimates:
+            return self._estimates[settings]
+        scale, colors, step = settings
+        kept = self.kept(step)
+        size = self.size(scale)
+        palette = self._palette(scale, colors)
+
+        header = first = changed = changed_frames = 0
+        runs = self._runs(len(kept))
+        for run in runs:
+            writer = _SizingWriter(io.BytesIO(), size, self.loop, palette)
+            encoder = DeltaEncoder(writer)
+            for position in run:
+                i, duration = kept[position]
+                encoder.add(self._image(i, scale), duration, self._quantized(i, scale, colors))
+            encoder.close()
+            header = writer.header_size
+            # Repeated frames are merged into the one before, they cost nothing
+            first += writer.frame_sizes[0]
+            changed += sum(writer.frame_sizes[1:])
+            changed_frames += len(run) - 1
+
+        estimate = header + first / len(runs) + 1
+        if changed_frames:
+            estimate += changed / changed_frames * (len(kept) - 1)
+        self._estimates[settings] = int(estimate)
+        return self._estimates[settings]
+
+    def fit(self, budget, start=0):
+        """
+        Index in SIZE_STEPS of the first settings from start on whose
+        estimate fits budget bytes, the last index if none does.
+        Estimates shrink along SIZE_STEPS, so they are bisected.
+        """
+        low, high = start, len(SIZE_STEPS) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.estimate(SIZE_STEPS[middle]) <= budget * ESTIMATE_MARGIN:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def write(self, fp, settings, cancel=None, progress=None):
+        """Encode the whole GIF with settings to fp"""
+        scale, colors, step = settings
+        kept = self.kept(step)
+        size = self.size(scale)
+        palette = self._palette(scale, colors)
+
+        def frames_to_save():
+            # Frames are scaled by the compositing workers too
+            images = composite_frames([self.frames[i] for i, _ in kept], self.load,
+                                      _ScaledTransform(self.transform, size), self.paint,
+                                      cancel=cancel, source=self.source)
+            for done, image in enumerate(images, 1):
+                yield image
+                if progress is not None:
+                    progress(done, len(kept))
+
+        write_gif(fp, frames_to_save(), [duration for _, duration in kept], self.loop, palette)
+
+    def _runs(self, count):
+        """Runs of consecutive positions among count frames, spread evenly"""
+        length = min(ESTIMATE_RUN_FRAMES, count)
+        return [range(start, start + length)
+                for start in sample_indices(count - length + 1, ESTIMATE_RUNS)]
+
+    def _image(self, i, scale):
+        """Frame i composited and scaled, kept for later estimates"""
+        key = (i, scale)
+        if key not in self._scaled:
+            if i not in self._composited:
+                image = self.transform.apply(self.load(self.frames[i]), self.paint)
+                self._composited[i] = image if image.mode == 'RGBA' else image.convert('RGBA')
+            image = self._composited[i]
+            if scale != 1.0:
+                image = image.resize(self.size(scale), Image.Resampling.LANCZOS)
+            self._scaled[key] = image
+        return self._scaled[key]
+
+    def _quantized(self, i, scale, colors):
+        """Frame i mapped onto the palette of its settings, kept for later estimates"""
+        key = (i, scale, colors)
+        if key not in self._indexed:
+            palette = self._palette(scale, colors)
+            self._indexed[key] = palette.map(self._image(i, scale).convert('RGB'))
+        return self._indexed[key]
+
+    def _palette(self, scale, colors):
+        """Shared palette of the GIF at a scale and palette size"""
+        key = (scale, colors)
+        if key not in self._palettes:
+            palette = None
+            if self.table and scale == 1.0 and colors >= MAX_COLORS:
+                palette = Palette.from_table(self.table, self.dither)
+            if palette is None:
+                samples = [self._image(i, scale) for i in sample_indices(len(self.frames))]
+                palette = Palette.from_frames(samples, self.dither, colors)
+            self._palettes[key] = palette
+        return self._palettes[key]
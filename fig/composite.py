@@ -0,0 +1,372 @@
+import os
+import time
+import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+from PIL import Image, ImageDraw
+
+from fig.gifindex import FrameInfo, read_header
+from fig.decoder import FrameCursor, MIN_PARALLEL_FRAMES
+from fig.indexed import IndexedFrame
+
+# Upper bound for the pixels of one worker task, input and output together
+MAX_CHUNK_BYTES = 32 * 1024 * 1024
+# Frames composited in-process to measure whether workers would be faster
+PROBE_FRAMES = 8
+# Seconds a spawned worker takes to start and import this module and Pillow,
+# measured at 0.11-0.19s. Workers sharing a core start one after another.
+# The app runs as python -m fig, so workers never import the GTK modules.
+WORKER_START_SECONDS = 0.15
+# Moving a frame to a worker and back costs this many copies of its pixels
+IPC_COST_FACTOR = 3
+
+
+class OverlayPainter:
+    """
+    Draws the editor's strokes and texts onto oriented frames.
+
+    Holds plain values only, so it can be pickled to compositing workers.
+    lines are (points, color) in container coordinates, texts (x, y, text),
+    image_size is the oriented frame size the container centers.
+
+    The overlay is the same on every frame, so it is rasterized once into a
+    transparent layer and every frame only gets that layer composited on.
+    """
+
+    def __init__(self, lines, texts, text_rotation, container_size, image_size):
+        self.lines = lines
+        self.texts = texts
+        self.text_rotation = text_rotation
+        self.container_size = container_size
+        self.image_size = image_size
+        self._layers = {}  # Rasterized overlay per frame size
+
+    def __bool__(self):
+        return bool(self.lines or self.texts)
+
+    def __call__(self, frame):
+        """Composite the overlay onto an oriented frame"""
+        layer = self.layer(frame.size)
+        if frame.mode == 'RGBA':
+            frame.alpha_composite(layer)
+        else:
+            frame.paste(layer, (0, 0), layer)
+
+    def layer(self, size):
+        """The overlay as an RGBA image of the given size, built on first use"""
+        layer = self._layers.get(size)
+        if layer is None:
+            layer = self._layers[size] = self._rasterize(size)
+        return layer
+
+    def _rasterize(self, size):
+        """Draw strokes and text into a transparent image"""
+        orig_width, orig_height = self.image_size
+        container_size = self.container_size
+        layer = Image.new('RGBA', size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(layer)
+        long_side = max(orig_width, orig_height)
+
+        for points, color in self.lines:
+            if len(points) > 1:
+                # Convert coordinates to image space
+                scaled_points = []
+                for point in points:
+                    if isinstance(point, (list, tuple)) and len(point) >= 2:
+                        x, y = point[0], point[1]
+                        if long_side == orig_width:
+                            y = y - (container_size - orig_height)/2
+                        else:
+                            x = x - (container_size - orig_width)/2
+                        scaled_points.append((x, y))
+
+                for j in range(len(scaled_points) - 1):
+                    draw.line([scaled_points[j], scaled_points[j + 1]],
+                              fill=color or '#FFFFFF', width=2)
+
+        # Handle text with rotation
+        for x, y, text in self.texts:
+            try:
+                # Check if we need to apply rotation
+                if self.text_rotation != 0:
+                    # Estimate text size - you might want to use a font that supports size measurement
+                    # This is an approximation
+                    font_size = 24  # Increased font size for better visibility
+                    text_width = len(text) * font_size
+                    text_height = font_size * 1.5
+
+                    # Create transparent image large enough for the rotated text
+                    text_img = Image.new('RGBA',
+                                         (int(max(text_width, text_height) * 3),
+                                          int(max(text_width, text_height) * 3)),
+                                         (0, 0, 0, 0))
+
+                    # Draw text at the center of this new image
+                    text_draw = ImageDraw.Draw(text_img)
+                    text_draw.text((text_img.width//2, text_img.height//2),
+                                   text,
+                                   fill='white',
+                                   anchor='mm')  # Center alignment
+
+                    # Rotate the text image
+                    rotated_text = text_img.rotate(-self.text_rotation,
+                                                   resample=Image.BICUBIC,
+                                                   expand=True)
+
+                    # Calculate paste coordinates
+                    paste_x = x
+                    paste_y = y
+
+                    # Adjust for container padding
+                    if long_side == orig_width:
+                        paste_y -= (container_size - orig_height)//2
+                    else:
+                        paste_x -= (container_size - orig_width)//2
+
+                    # Adjust paste position to center the rotated text at the specified point
+                    paste_x -= rotated_text.width//2
+                    paste_y -= rotated_text.height//2
+
+                    _blend(layer, rotated_text, paste_x, paste_y)
+                else:
+                    if long_side == orig_width:
+                        y = y - (container_size - orig_height)//2
+                    else:
+                        x = x - (container_size - orig_width)//2
+                    # No rotation - draw text directly
+                    draw.text((x, y), text, fill='white')
+            except Exception as e:
+                print(f"Error drawing text: {e}")
+                traceback.print_exc()
+        return layer
+
+
+def _blend(layer, image, x, y):
+    """Alpha composite image onto layer at (x, y), clipped to the layer"""
+    left, top = max(0, -x), max(0, -y)
+    right = min(image.width, layer.width - x)
+    bottom = min(image.height, layer.height - y)
+    if left < right and top < bottom:
+        layer.alpha_composite(image, (x + left, y + top), (left, top, right, bottom))
+
+
+def _rgba(image):
+    if isinstance(image, IndexedFrame):
+        return image.to_rgba()
+    return image if image.mode == 'RGBA' else image.convert('RGBA')
+
+
+def _source(frame):
+    """A loaded frame as Transform.apply takes it, IndexedFrames stay packed"""
+    return frame if isinstance(frame, IndexedFrame) else _rgba(frame)
+
+
+def _composite_chunk(in_name, out_name, jobs, transform, paint):
+    """Worker task: composite frames from one shared memory block into another"""
+    source = shared_memory.SharedMemory(name=in_name)
+    target = shared_memory.SharedMemory(name=out_name)
+    try:
+        for in_offset, size, out_offset in jobs:
+            length = size[0] * size[1] * 4
+            view = source.buf[in_offset:in_offset + length]
+            image = Image.frombuffer('RGBA', size, view, 'raw', 'RGBA', 0, 1)
+            data = transform.apply(image, paint).tobytes()
+            target.buf[out_offset:out_offset + len(data)] = data
+            # Views must be gone before the blocks are closed
+            del image
+            view.release()
+    finally:
+        source.close()
+        target.close()
+
+
+def _decode_chunk(out_name, segment, jobs, transform, paint):
+    """Worker task: decode source frames from the GIF and composite them into a shared memory block"""
+    file_path, infos, methods, transparency, resume, canvas = segment
+    cursor = FrameCursor(file_path, infos, methods, resume, transparency, canvas)
+    target = shared_memory.SharedMemory(name=out_name)
+    try:
+        for index, out_offset in jobs:
+            cursor.seek(index)
+            image = cursor.image()
+            # A paletted canvas is oriented and cropped on its indices
+            frame = IndexedFrame(image) if image.mode == 'P' else image
+            data = transform.apply(frame, paint).tobytes()
+            target.buf[out_offset:out_offset + len(data)] = data
+    finally:
+        target.close()
+        cursor.close()
+
+
+def composite_frames(frames, load, transform, paint=None, max_workers=None, cancel=None,
+                     source=None):
+    """
+    Yield transform.apply(load(frame), paint) as RGBA for every frame, in order.
+
+    Frames are composited in a process pool when that pays off. Exports
+    without edits run in-process, and so do those whose edits cost less
+    than starting the workers and moving the frames to them, measured on
+    the first PROBE_FRAMES frames. With a FrameStore as source, workers
+    decode runs of its source frames from the GIF themselves, other frames
+    are loaded here. Pixels travel through shared memory blocks, one or
+    two per chunk of frames, so no image is pickled. About two chunks per
+    worker are in flight while finished ones are read back in order.
+    A cancel event stops the generator between frames.
+    """
+    frames = list(frames)
+    workers = max_workers or os.cpu_count() or 1
+
+    def in_process(frames):
+        for frame in frames:
+            if cancel is not None and cancel.is_set():
+                return
+            yield transform.apply(_source(load(frame)), paint)
+
+    if (workers == 1 or len(frames) < MIN_PARALLEL_FRAMES
+            or (transform.is_identity and paint is None)):
+        yield from in_process(frames)
+        return
+
+    # The first frames are composited here, timing the edits and a copy of the result
+    work = copy = 0
+    for frame in frames[:PROBE_FRAMES]:
+        if cancel is not None and cancel.is_set():
+            return
+        started = time.perf_counter()
+        image = transform.apply(_source(load(frame)), paint)
+        work += time.perf_counter() - started
+        started = time.perf_counter()
+        image.tobytes()
+        copy += time.perf_counter() - started
+        yield image
+    frames = frames[PROBE_FRAMES:]
+    work /= PROBE_FRAMES
+    copy /= PROBE_FRAMES
+    # Workers beyond the number of cores only take turns
+    cores = min(workers, os.cpu_count() or 1)
+    start = WORKER_START_SECONDS * -(-workers // cores)
+    pooled = start + len(frames) * (copy * IPC_COST_FACTOR + work / cores)
+    if pooled >= len(frames) * work:
+        yield from in_process(frames)
+        return
+
+    canvas_size = None
+    if source is not None:
+        header = read_header(source.file_path)[0]
+        canvas_size = (header.width, header.height)
+
+    def decodable(frame):
+        return source is not None and isinstance(frame, FrameInfo)
+
+    def chunks():
+        """
+        Next (segment, frames) for a worker, sized for MAX_CHUNK_BYTES.
+        Runs of source frames in decoding order come with the FrameCursor
+        segment to decode them from, others are loaded here.
+        """
+        position = 0
+        per_chunk = max(1, -(-len(frames) // (workers * 4)))
+        while position < len(frames):
+            if decodable(frames[position]):
+                run = []
+                nbytes = 0
+                out_width, out_height = transform.output_size(canvas_size)
+                while (position < len(frames) and len(run) < per_chunk and nbytes < MAX_CHUNK_BYTES
+                       and decodable(frames[position])
+                       and (not run or frames[position].index >= run[-1].index)):
+                    run.append(frames[position])
+                    nbytes += out_width * out_height * 4
+                    position += 1
+                segment = source.segment(run[0].index, run[-1].index + 1)
+                if segment is not None:
+                    yield segment, run
+                else:
+                    yield None, [_rgba(load(frame)) for frame in run]
+                continue
+            images = []
+            nbytes = 0
+            while (position < len(frames) and len(images) < per_chunk and nbytes < MAX_CHUNK_BYTES
+                   and not decodable(frames[position])):
+                image = _rgba(load(frames[position]))
+                images.append(image)
+                size = transform.output_size(image.size)
+                nbytes += (image.size[0] * image.size[1] + size[0] * size[1]) * 4
+                position += 1
+            yield None, images
+
+    # Spawn rather than fork, the parent is a GTK process with threads running
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        remaining = chunks()
+
+        def submit_next():
+            for segment, items in remaining:
+                if segment is not None:
+                    sizes = [transform.output_size(canvas_size)] * len(items)
+                else:
+                    sizes = [transform.output_size(image.size) for image in items]
+                out_size = sum(width * height * 4 for width, height in sizes)
+                target = shared_memory.SharedMemory(create=True, size=max(1, out_size))
+                jobs = []
+                out_offset = 0
+                if segment is not None:
+                    for info, (width, height) in zip(items, sizes):
+                        jobs.append((info.index, out_offset))
+                        out_offset += width * height * 4
+                    future = executor.submit(_decode_chunk, target.name, segment,
+                                             jobs, transform, paint)
+                    pending.append((future, None, target, sizes))
+                    return
+
+                in_size = sum(image.size[0] * image.size[1] * 4 for image in items)
+                source_block = shared_memory.SharedMemory(create=True, size=max(1, in_size))
+                in_offset = 0
+                for image, (width, height) in zip(items, sizes):
+                    data = image.tobytes()
+                    source_block.buf[in_offset:in_offset + len(data)] = data
+                    jobs.append((in_offset, image.size, out_offset))
+                    in_offset += len(data)
+                    out_offset += width * height * 4
+                future = executor.submit(_composite_chunk, source_block.name, target.name,
+                                         jobs, transform, paint)
+                pending.append((future, source_block, target, sizes))
+                return
+
+        for _ in range(workers * 2):
+            submit_next()
+
+        try:
+            while pending:
+                future, source_block, target, sizes = pending[0]
+                future.result()
+                pending.popleft()
+                if source_block is not None:
+                    source_block.close()
+                    source_block.unlink()
+                submit_next()
+                try:
+                    offset = 0
+                    for size in sizes:
+                        length = size[0] * size[1] * 4
+                        image = Image.frombytes('RGBA', size, bytes(target.buf[offset:offset + length]))
+                        offset += length
+                        if cancel is not None and cancel.is_set():
+                            return
+                        yield image
+                finally:
+                    target.close()
+                    target.unlink()
+        finally:
+            for future, _, _, _ in pending:
+                future.cancel()
+            # Blocks are unlinked only once no worker has them open
+            wait([future for future, _, _, _ in pending])
+            for _, source_block, target, _ in pending:
+                for block in (source_block, target):
+                    if block is not None:
+                        block.close()
+                        block.unlink()
@@ -0,0 +1,451 @@
+import io
+import os
+import mmap
+import struct
+import threading
+import multiprocessing
+from bisect import bisect_left, insort
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from fig.gifindex import parse_header, read_header, disposal_methods
+from fig.indexed import IndexedFrame, pack, frame_nbytes
+
+# GIFs shorter than this are decoded in-process, a worker pool costs more to start
+MIN_PARALLEL_FRAMES = 64
+# Upper bound for the decoded pixels a single worker task sends back
+MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+# A decoded canvas is pinned every this many frames, so GIFs without
+# keyframes still have places to resume decoding from
+CHECKPOINT_INTERVAL = 32
+
+
+# Frames without any color table are shown as grayscale, like Pillow does
+GRAYSCALE = bytes(value for value in range(256) for _ in range(3))
+
+
+def read_frame(buf, info, global_palette):
+    """Decode the pixels of a single frame into a P image of its sub-rectangle"""
+    if info.palette:
+        palette = buf[info.palette:info.palette + info.palette_size]
+    else:
+        palette = global_palette or GRAYSCALE
+    bits = max(1, (len(palette) // 3 - 1).bit_length())
+
+    # Wrap the frame's LZW data into a minimal one-frame GIF for Pillow to decode
+    stream = bytearray(b'GIF89a')
+    stream += struct.pack('<HHBBB', info.width, info.height, 0x80 | (bits - 1), 0, 0)
+    stream += palette.ljust(3 << bits, b'\0')
+    stream += struct.pack('<BHHHHB', 0x2C, 0, 0, info.width, info.height, 0x40 if info.interlaced else 0)
+    stream += buf[info.data:info.end]
+    stream += b';'
+    with Image.open(io.BytesIO(bytes(stream))) as image:
+        image.load()
+        frame = image.copy()
+    if info.transparency is not None:
+        frame.info['transparency'] = info.transparency
+    return frame, palette
+
+
+def _color(palette, index):
+    """RGB of a palette index, index 0 when it is out of range"""
+    if index * 3 + 3 > len(palette):
+        index = 0
+    return tuple(palette[index * 3:index * 3 + 3])
+
+
+class FrameCursor:
+    """
+    Forward-only compositor over source frames, starting at a checkpoint.
+
+    Frames are decoded one by one from the block index and composited
+    following the same disposal rules as Pillow, so the output matches
+    walking the file with Image.seek(). A cursor starts at a keyframe, or
+    right after a frame whose composite is known (canvas) when that frame's
+    disposal does not need the canvas before it. A keyframe that follows a
+    frame clearing the whole canvas starts on that cleared canvas.
+
+    While frames draw with the global color table and agree on the
+    transparent index, the canvas stays a P image over that table; the
+    first frame that does not switches it to RGBA for good.
+
+    infos is a run of FrameInfo records covering the frames the cursor
+    visits, plus the frame before start when resuming from a canvas or
+    from a keyframe after a cleared canvas.
+    methods are the disposal methods in effect for the same run, as
+    returned by disposal_methods(), and transparency is the transparent
+    index of frame 0.
+    """
+
+    def __init__(self, file_path, infos, methods, start, transparency, canvas=None):
+        self._file = open(file_path, 'rb')
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = parse_header(self._buf[:13])
+        self._global_palette = self._buf[13:13 + header.palette_size]
+        self._background = header.background if header.palette_size else 0
+        self.size = (header.width, header.height)
+
+        self._infos = infos
+        self._methods = methods
+        self._base = infos[0].index
+        self._transparency = transparency
+        self._alpha = transparency is not None  # Pillow keeps an alpha channel after frame 0
+        self._dispose = None
+        self._canvas = None
+        self._paletted = bool(self._global_palette)
+        self._position = start - 1
+        if canvas is None:
+            if start > self._base:
+                # What the frame before the keyframe leaves is all that shows through
+                self._canvas = self._new_canvas(0)
+                self._resume_after(self._infos[start - 1 - self._base])
+            self.seek(start)
+        else:
+            if not (self._paletted and canvas.mode == 'P'
+                    and bytes(canvas.getpalette()[:len(self._global_palette)]) == self._global_palette):
+                self._paletted = False
+                canvas = canvas.convert('RGBA')
+            self._canvas = canvas.copy()
+            self._resume_after(self._infos[start - 1 - self._base])
+
+    @property
+    def position(self):
+        """Source index of the frame the cursor is on"""
+        return self._position
+
+    def seek(self, index):
+        while self._position < index:
+            self._render(self._infos[self._position + 1 - self._base])
+
+    def image(self):
+        """Copy of the current frame, a P image while the canvas is paletted, else RGBA"""
+        return self._canvas.copy()
+
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+    def _fits_palette(self, info):
+        """Whether a frame can be composited on indices of the global color table"""
+        if info.palette:
+            return False
+        return not self._alpha or info.transparency == self._transparency
+
+    def _new_canvas(self, fill, size=None):
+        """Canvas in the current mode, fill being a palette index"""
+        size = size or self.size
+        if self._paletted:
+            canvas = Image.new('P', size, fill)
+            canvas.putpalette(self._global_palette)
+            if self._alpha:
+                canvas.info['transparency'] = self._transparency
+            return canvas
+        color = _color(self._global_palette or GRAYSCALE, fill)
+        return Image.new('RGBA', size, color + (0 if fill == self._transparency else 255,))
+
+    def _resume_after(self, info):
+        """Prepare the disposal of the frame before the start, as if it was rendered"""
+        # Decoding it would have left paletted mode, its disposal color
+        # may only be in its own color table
+        if self._paletted and not self._fits_palette(info):
+            self._to_rgba()
+        self._set_dispose(info, None)
+
+    def _to_rgba(self):
+        """Leave paletted mode, converting the canvas and the pending disposal"""
+        self._paletted = False
+        if self._canvas is not None:
+            self._canvas = self._canvas.convert('RGBA')
+        if self._dispose is not None:
+            image, rect = self._dispose
+            self._dispose = (image.convert('RGBA'), rect)
+
+    def _render(self, info):
+        if self._paletted and not self._fits_palette(info):
+            self._to_rgba()
+        frame, palette = read_frame(self._buf, info, self._global_palette)
+        box = (info.left, info.top)
+        previous = None
+        if info.index == 0:
+            # Frame 0 is drawn on a canvas filled with its transparent index, or index 0
+            fill = info.transparency if info.transparency is not None else 0
+            if self._paletted:
+                self._canvas = self._new_canvas(fill)
+                self._canvas.paste(frame, box)
+            else:
+                canvas = Image.new('P', self.size, fill)
+                canvas.putpalette(palette)
+                canvas.paste(frame, box)
+                canvas.info.update(frame.info)
+                self._canvas = canvas.convert('RGBA')
+        else:
+            if self._canvas is None:
+                self._canvas = self._new_canvas(0)  # Starting at a keyframe
+            elif self._dispose is not None:
+                self._canvas.paste(*self._dispose)
+            if self._methods[info.index - self._base] == 3:
+                previous = self._canvas.copy()
+            if self._paletted:
+                mask = None
+                if info.transparency is not None:
+                    lut = [255] * 256
+                    lut[info.transparency] = 0
+                    mask = frame.point(lut, 'L')
+                self._canvas.paste(frame, box, mask)
+            elif info.transparency is not None:
+                rgba = frame.convert('RGBA')
+                self._canvas.paste(rgba, box, rgba)
+            else:
+                self._canvas.paste(frame.convert('RGB'), box)
+        self._position = info.index
+        self._set_dispose(info, previous)
+
+    def _set_dispose(self, info, previous):
+        """Prepare what the next frame restores of this frame's sub-rectangle"""
+        self._dispose = None
+        method = self._methods[info.index - self._base]
+        rect = (info.left, info.top, info.left + info.width, info.top + info.height)
+        size = (info.width, info.height)
+        if info.palette:
+            palette = self._buf[info.palette:info.palette + info.palette_size]
+        else:
+            palette = self._global_palette or GRAYSCALE
+
+        if method == 2:
+            # Restore to background, like Pillow the transparent index is preferred.
+            # It only turns see-through when the canvas has an alpha channel.
+            if info.transparency is not None:
+                index, see_through = info.transparency, self._alpha
+            else:
+                index, see_through = self._background, False
+            if index * 3 + 3 > len(palette):
+                index = 0
+            if self._paletted:
+                fill = self._transparency if see_through else index
+                self._dispose = (self._new_canvas(fill, size), rect)
+            else:
+                color = _color(palette, index) + (0 if see_through else 255,)
+                self._dispose = (Image.new('RGBA', size, color), rect)
+        elif method == 3:
+            # Restore to previous
+            if previous is not None:
+                self._dispose = (previous.crop(rect), rect)
+            elif info.index == 0 and info.transparency is not None:
+                if self._paletted:
+                    self._dispose = (self._new_canvas(info.transparency, size), rect)
+                else:
+                    color = _color(palette, info.transparency) + (0,)
+                    self._dispose = (Image.new('RGBA', size, color), rect)
+
+
+class Checkpoints:
+    """
+    Decoded canvases pinned at every interval-th source frame.
+
+    Unlike cached frames they are never evicted one by one, so decoding can
+    always resume from the last one before a frame, found by bisect. They
+    are packed like cached frames, and once they take more than max_bytes
+    the interval doubles and every other one is dropped. Safe to use from
+    the loader thread and the UI at once.
+    """
+
+    def __init__(self, interval=CHECKPOINT_INTERVAL, max_bytes=None):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._indices = []  # Sorted source indices of the pinned canvases
+        self._frames = {}  # source index -> (packed canvas, nbytes)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __contains__(self, index):
+        return index in self._frames
+
+    def due(self, index):
+        """Whether the canvas after source frame index should be pinned"""
+        return not (index + 1) % self.interval and index not in self._frames
+
+    def add(self, index, canvas):
+        """Pin the canvas after source frame index if the index is due for one"""
+        if not self.due(index):
+            return
+        frame = pack(canvas)
+        with self._lock:
+            if index in self._frames:
+                return
+            insort(self._indices, index)
+            nbytes = frame_nbytes(frame)
+            self._frames[index] = (frame, nbytes)
+            self._size += nbytes
+            while self.max_bytes is not None and self._size > self.max_bytes and len(self._indices) > 1:
+                self.interval *= 2
+                kept = []
+                for pinned in self._indices:
+                    if (pinned + 1) % self.interval:
+                        self._size -= self._frames.pop(pinned)[1]
+                    else:
+                        kept.append(pinned)
+                self._indices = kept
+
+    def canvas(self, index):
+        """Canvas pinned after source frame index, or None"""
+        with self._lock:
+            pinned = self._frames.get(index)
+        if pinned is None:
+            return None
+        frame = pinned[0]
+        return frame.image if isinstance(frame, IndexedFrame) else frame
+
+    def before(self, index):
+        """Source index of the last canvas pinned before frame index, or -1"""
+        with self._lock:
+            position = bisect_left(self._indices, index)
+            return self._indices[position - 1] if position else -1
+
+    def clear(self):
+        with self._lock:
+            self._indices = []
+            self._frames.clear()
+            self._size = 0
+
+
+def _decode_segment(file_path, infos, methods, transparency, resume, canvas, start, stop):
+    """Worker task: decode source frames [start, stop) as raw image data"""
+    cursor = FrameCursor(file_path, infos, methods, resume, transparency, canvas)
+    try:
+        frames = []
+        for index in range(start, stop):
+            cursor.seek(index)
+            image = cursor.image()
+            palette = image.getpalette() if image.mode == 'P' else None
+            frames.append((image.mode, image.size, image.tobytes(), palette, image.info))
+        return frames
+    finally:
+        cursor.close()
+
+
+def _rebuild(mode, size, data, palette, info):
+    """Image from the raw data a worker sent back"""
+    image = Image.frombytes(mode, size, data)
+    if palette is not None:
+        image.putpalette(palette)
+    image.info.update(info)
+    return image
+
+
+def plan_segments(infos, start, stop, frame_bytes, workers, checkpoints=None):
+    """
+    Split source frames [start, stop) into (resume, start, stop) segments.
+
+    Segments begin where decoding can resume without the frames before
+    them, at keyframes or right after a pinned checkpoint canvas, so they
+    can be decoded independently. Runs between those are merged until a
+    segment holds a fair share of the work, without exceeding
+    MAX_SEGMENT_BYTES unless a single run is longer.
+    """
+    def resumable(index):
+        return infos[index].keyframe or (checkpoints is not None and index - 1 in checkpoints)
+
+    target = max(1, (stop - start) // (workers * 4))
+    limit = max(1, MAX_SEGMENT_BYTES // max(1, frame_bytes))
+    resume = start
+    while resume > 0 and not resumable(resume):
+        resume -= 1
+
+    segments = []
+    seg_start = start
+    for index in range(start + 1, stop):
+        if not resumable(index):
+            continue
+        length = index - seg_start
+        if length >= target or length >= limit:
+            segments.append((resume, seg_start, index))
+            resume = seg_start = index
+    segments.append((resume, seg_start, stop))
+    return segments
+
+
+def decode_frames(file_path, infos, start=0, stop=None, max_workers=None, cancel=None,
+                  checkpoints=None):
+    """
+    Decode source frames [start, stop) and yield (index, image) in order.
+
+    Segments starting at keyframes or Checkpoints are decoded in a process
+    pool and streamed back as they finish, keeping only about one segment
+    per worker in flight. Decoded canvases are pinned to checkpoints on the
+    way, so a GIF without keyframes decodes in order once and in parallel
+    from then on. A cancel event stops the generator between frames.
+    """
+    stop = len(infos) if stop is None else stop
+    if start >= stop:
+        return
+
+    workers = max_workers or os.cpu_count() or 1
+    header = read_header(file_path)[0]
+    frame_bytes = header.width * header.height * 4
+    segments = plan_segments(infos, start, stop, frame_bytes, workers, checkpoints)
+    methods = disposal_methods(infos)
+    transparency = infos[0].transparency
+
+    def resume_canvas(resume):
+        """Canvas to resume from, None when resuming at a keyframe"""
+        if infos[resume].keyframe or checkpoints is None:
+            return None
+        return checkpoints.canvas(resume - 1)
+
+    def pin(index, image):
+        # Restoring to previous after the frame would need the canvas before it
+        if checkpoints is not None and methods[index] != 3:
+            checkpoints.add(index, image)
+
+    if workers == 1 or len(segments) == 1 or stop - start < MIN_PARALLEL_FRAMES:
+        resume = segments[0][0]
+        cursor = FrameCursor(file_path, infos, methods, resume, transparency, resume_canvas(resume))
+        try:
+            for index in range(start, stop):
+                if cancel is not None and cancel.is_set():
+                    return
+                cursor.seek(index)
+                image = cursor.image()
+                pin(index, image)
+                yield index, image
+        finally:
+            cursor.close()
+        return
+
+    # Spawn rather than fork, the parent is a GTK process with threads running
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        remaining = iter(segments)
+
+        def submit_next():
+            for resume, seg_start, seg_stop in remaining:
+                # The frame before the segment tells the cursor what it left on the canvas
+                first = max(0, resume - 1)
+                pending.append((seg_start, executor.submit(
+                    _decode_segment, file_path, infos[first:seg_stop], methods[first:seg_stop],
+                    transparency, resume, resume_canvas(resume), seg_start, seg_stop)))
+                return
+
+        for _ in range(workers):
+            submit_next()
+
+        try:
+            while pending:
+                seg_start, future = pending.popleft()
+                frames = future.result()
+                submit_next()
+                for index, frame in enumerate(frames, seg_start):
+                    if cancel is not None and cancel.is_set():
+                        return
+                    image = _rebuild(*frame)
+                    pin(index, image)
+                    yield index, image
+        finally:
+            for _, future in pending:
+                future.cancel()
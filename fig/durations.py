@@ -0,0 +1,126 @@
+# Like browsers, playback shows frames delayed 10 ms or less for 100 ms,
+# a GIF with no delays would otherwise end at once
+MIN_PLAYBACK_DELAY = 20
+CLAMPED_DELAY = 100
+
+
+def playback_duration(duration):
+    """Milliseconds a frame with the given delay is shown for in playback"""
+    return CLAMPED_DELAY if duration < MIN_PLAYBACK_DELAY else duration
+
+
+class DurationIndex:
+    """
+    Prefix sums over frame durations for range statistics and seeking.
+
+    Two Fenwick trees hold, per frame, its duration and whether it is kept.
+    Removed frames count as zero frames of zero length, so the number of
+    frames and the total time of any range, and the frame shown at a given
+    time, are found in O(log n). Changing one frame is O(log n) as well,
+    inserting frames needs a new index.
+    """
+
+    def __init__(self, durations, is_removed=None):
+        n = len(durations)
+        self._times = [0] * n
+        self._kept = [0] * n
+        for i, duration in enumerate(durations):
+            if is_removed is None or not is_removed(i):
+                self._times[i] = duration
+                self._kept[i] = 1
+        self._time_tree = self._build(self._times)
+        self._count_tree = self._build(self._kept)
+
+    @staticmethod
+    def _build(values):
+        """Fenwick tree of values in O(n), 1-based"""
+        tree = [0] + list(values)
+        n = len(values)
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        return tree
+
+    @staticmethod
+    def _add(tree, index, delta):
+        i = index + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    @staticmethod
+    def _sum(tree, stop):
+        """Sum of the first stop values"""
+        total = 0
+        i = stop
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def __len__(self):
+        return len(self._times)
+
+    def update(self, index, duration, removed=False):
+        """Set the duration and removed state of one frame"""
+        time = 0 if removed else duration
+        kept = 0 if removed else 1
+        self._add(self._time_tree, index, time - self._times[index])
+        self._add(self._count_tree, index, kept - self._kept[index])
+        self._times[index] = time
+        self._kept[index] = kept
+
+    def range_stats(self, start, end):
+        """Number of kept frames and their total milliseconds in start..end, inclusive"""
+        if start > end:
+            start, end = end, start
+        start = max(0, start)
+        end = min(len(self) - 1, end)
+        if start > end:
+            return 0, 0
+        count = self._sum(self._count_tree, end + 1) - self._sum(self._count_tree, start)
+        time = self._sum(self._time_tree, end + 1) - self._sum(self._time_tree, start)
+        return count, time
+
+    def time_at(self, index):
+        """Milliseconds from the first frame until frame index is shown"""
+        return self._sum(self._time_tree, max(0, min(index, len(self))))
+
+    def seek(self, ms, start=0):
+        """
+        Index of the kept frame on screen ms milliseconds after frame start
+        is shown, or -1 when that is past the last frame.
+        """
+        target = self.time_at(start) + ms
+        if ms < 0 or target >= self._sum(self._time_tree, len(self)):
+            return -1
+        # Walk down the tree for the longest prefix that ends at or before target
+        position = 0
+        step = 1 << len(self).bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= len(self) and self._time_tree[next_position] <= target:
+                position = next_position
+                target -= self._time_tree[next_position]
+            step >>= 1
+        return position
+
+    def seek_back(self, ms, start):
+        """
+        Index of the kept frame on screen ms milliseconds after frame start
+        is shown when playing backwards, or -1 when that is past frame 0.
+        """
+        target = self.time_at(start + 1) - ms
+        if ms < 0 or target <= 0:
+            return -1
+        # Walk down the tree for the longest prefix that ends before target
+        position = 0
+        step = 1 << len(self).bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= len(self) and self._time_tree[next_position] < target:
+                position = next_position
+                target -= self._time_tree[next_position]
+            step >>= 1
+        return position
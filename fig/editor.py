@@ -1,4 +1,7 @@
 import os
+import time
+import tempfile
+import threading
 
 from PIL import Image, ImageDraw
 import gi
@@ -11,6 +14,20 @@ from gi.repository import Gtk, GLib, Gio, GdkPixbuf, Adw
 from fig.utils import clear_css, load_css
 from fig.frameline import FrameLine
 from fig.overlay import CropTextOverlay
+from fig.framestore import FrameStore, DEFAULT_CACHE_BYTES, DEFAULT_SPILL_BYTES, cache_dir
+from fig.framecache import FrameCache, file_hash
+from fig.gifindex import FrameInfo, probe, disposal_methods
+from fig.timeline import Timeline
+from fig.transform import Transform
+from fig.indexed import unpack
+from fig.durations import DurationIndex, playback_duration
+from fig.history import History
+from fig.project import save_project, load_project
+from fig.decoder import decode_frames
+from fig.composite import OverlayPainter, composite_frames
+from fig.encoder import write_gif, copy_start, copy_frames
+from fig.palette import Palette, sample_indices
+from fig.budget import SizeFitter, SIZE_STEPS
 
 class EditorBox(Gtk.Box):
     def __init__(self):
@@ -95,6 +112,7 @@ class EditorBox(Gtk.Box):
         self.controls_box.set_vexpand(False)
         load_css(self.controls_box, ["controls-box-dark"])  # Initial dark theme
 
+        self.timeline = Timeline()  # Frame order, durations, speeds and removed frames
         self.frameline = FrameLine(self)
         self.frameline.set_hexpand(True)
         self.frameline.connect('frames-changed', self.on_frames_changed)
@@ -117,11 +135,22 @@ class EditorBox(Gtk.Box):
         self.append(self.controls_box)
 
         self.frames = []
+        self.frame_cache_bytes = DEFAULT_CACHE_BYTES  # Memory budget for decoded frames
+        self.frame_spill_bytes = DEFAULT_SPILL_BYTES  # Disk budget for frames evicted from memory
+        self.frame_cache = None  # FrameCache of GIFs opened before, see set_frame_cache
+        self.PROGRESS_INTERVAL = 0.1  # Seconds between loading progress updates
+        self.shared_palette = False  # Save with one palette for all frames instead of one per frame
+        self.dither = False  # Dither colors missing from the shared palette
+        self.size_limit = 8 * 1024 * 1024  # Bytes last asked for by Save Within Size
+        self.load_generation = 0  # Bumped for every load, tags its idle callbacks
+        self._load_cancel = None
+        self.loop_count = None  # Loop count of the source GIF, None when it plays once
         self.current_frame_index = 0
         self.playhead_frame_index = 0
         self.is_playing = False
         self.play_timeout_id = None
         self.playback_finished = False
+        self.play_started = 0  # Monotonic time the selected range started playing at
 
         self.crop_mode = False
         self.text_mode = False
@@ -134,6 +163,10 @@ class EditorBox(Gtk.Box):
         self.flipped = False
         self.is_dark = True
         self.rotated = False
+        self.transform = Transform()  # Flip and rotation of all frames, applied when shown
+        self.duration_index = None  # Prefix sums of the playback durations, rebuilt lazily after edits but speed changes
+        self._duration_key = None
+        self.history = History()  # Undo/redo snapshots of frames, ranges and overlays
 
         self.update_theme(is_dark=True)
 
@@ -200,114 +233,161 @@ class EditorBox(Gtk.Box):
         self.original_height = image_height
 
     def load_gif(self, file_path):
-        """Load a GIF file using PIL for frame info and GdkPixbuf for display"""
+        """Load a GIF file, reading frame metadata up front and decoding pixels on demand"""
         try:
+            self.cancel_loading()
+            self.close_frames()
             self.frames = []
-            self.frame_durations = []
-            self.original_frame_durations = []
+            self.timeline = Timeline()
             self.current_frame_index = 0
             self.playhead_frame_index = 0
             self.overlay.reset_crop_rect()
 
-            # Get dimensions from the first frame
-            with Image.open(file_path) as gif:
-                # Store the original dimensions
-                self.image_display_width, self.image_display_height = gif.size
-                self.calculate_image_scale(self.image_display_width, self.image_display_height)
-                
-                # Set all containers to the fixed square size
-                self.image_container.set_size_request(
-                    self.container_size,
-                    self.container_size)
-                self.overlay.drawing_area.set_size_request(
-                    self.container_size,
-                    self.container_size)
-                self.overlay.set_size_request(
-                    self.container_size,
-                    self.container_size)
-                
-                frame_count = gif.n_frames
-
-            def load_frames_thread(batch_size=10):
-                frames = []
-                durations = []
-                total_duration = 0
-                update_batch = []
-
-                with Image.open(file_path) as gif:
-                    self.original_file_path = file_path
-                    for frame in range(frame_count):
-                        gif.seek(frame)
-                        duration = gif.info.get('duration', 100) / 1000.0
-                        total_duration += duration
-
-                        # Convert to RGBA only if needed
-                        if gif.mode != 'RGBA':
-                            frame_image = gif.convert('RGBA')
-                        else:
-                            frame_image = gif
+            # Frame count, durations and size come from the block headers alone
+            gif = probe(file_path)
+            if not gif.frame_count:
+                raise ValueError("GIF has no frames")
+            self.original_file_path = file_path
+
+            # Store the original dimensions
+            self.image_display_width, self.image_display_height = gif.width, gif.height
+            self.calculate_image_scale(self.image_display_width, self.image_display_height)
+
+            # Set all containers to the fixed square size
+            self.image_container.set_size_request(
+                self.container_size,
+                self.container_size)
+            self.overlay.drawing_area.set_size_request(
+                self.container_size,
+                self.container_size)
+            self.overlay.set_size_request(
+                self.container_size,
+                self.container_size)
+
+            frames = FrameStore(file_path, self._pil_to_pixbuf,
+                                self.frame_cache_bytes, self.frame_spill_bytes, self.timeline)
+            # Every frame is in the store before the UI reads it, the loader
+            # thread below only warms the cache, so nothing is handed over
+            frames.insert_frames(0, gif.frames, gif.durations, source=[(file_path, gif.frame_count)])
+            self.frames = frames
+            self.loop_count = gif.loop
+            self.loaded_duration = gif.duration / 1000.0
 
-                        pixbuf = self._pil_to_pixbuf(frame_image)
-                        frames.append(pixbuf)
-                        durations.append(duration * 1000)
+            # Update frameline with 1-based frame range
+            self.frameline.min_value = 1
+            self.frameline.max_value = gif.frame_count
+            self.frameline.left_value = 1
+            self.frameline.right_value = gif.frame_count
+            self.frameline.queue_draw()
 
-                        if len(update_batch) < batch_size and frame < frame_count - 1:
-                            update_batch.append(frame)
+            self.display_frame(0)
+            self.overlay.drawing_area.queue_resize()
+            self.overlay.drawing_area.queue_draw()
+            self.info_label.set_text(
+                f"{gif.frame_count} Frames • {self.loaded_duration:.2f} Seconds"
+            )
+            self.history.reset(self.snapshot())
+
+            self.load_generation += 1
+            generation = self.load_generation
+            cancel = threading.Event()
+            self._load_cancel = cancel
+            frame_size = (self.image_display_width, self.image_display_height)
+
+            frame_cache = self.frame_cache
+
+            def stale():
+                """Another GIF was loaded since, the store must be left alone"""
+                return cancel.is_set() or generation != self.load_generation
+
+            def load_frames_thread():
+                if stale():
+                    return
+                # A GIF opened before is mapped from the frame cache, nothing to decode
+                cached = frame_cache.open(file_path) if frame_cache else None
+                if cached is not None and len(cached) == gif.frame_count and not stale():
+                    frames.attach_cache(cached)
+                    GLib.idle_add(self.update_decoding_progress, generation, 0, 0)
+                    return
+                if cached is not None:
+                    cached.close()
+                if stale():
+                    return
+
+                # Decode the frames that fit in the cache ahead of time, in parallel.
+                # With a frame cache every frame is decoded once and stored for next time.
+                infos = gif.frames
+                warm = min(len(infos), frames.cache_capacity(frame_size))
+                writer = frame_cache.writer(file_path, infos, frame_size) if frame_cache else None
+                stop = len(infos) if writer else warm
+                last_progress = time.monotonic()
+                try:
+                    decoded = decode_frames(file_path, infos, 0, stop, cancel=cancel,
+                                            checkpoints=frames.checkpoints)
+                    for index, image in decoded:
+                        if stale() or index >= stop:
+                            break
+                        if index < warm:
+                            frames.prime(index, image)
+                        if writer and not writer.add(image):
+                            writer = None  # Larger than the cache allows, only warm the store
+                            stop = warm
+
+                        now = time.monotonic()
+                        if now - last_progress >= self.PROGRESS_INTERVAL:
+                            last_progress = now
+                            GLib.idle_add(self.update_decoding_progress, generation, index + 1, stop)
+                    if writer:
+                        if stale():
+                            writer.abort()
                         else:
-                            GLib.idle_add(
-                                self.update_loading_progress,
-                                frame + 1,
-                                frame_count,
-                                frames[:],
-                                durations[:],
-                                total_duration if frame == frame_count - 1 else None
-                            )
-                            update_batch = []
-
-            self.info_label.set_text(f"Loading frames 0/{frame_count}")
-            import threading
-            thread = threading.Thread(target=load_frames_thread, args=(self.compute_batch_size(frame_count),))
+                            writer.commit()
+                        writer = None
+                except Exception as e:
+                    print(f"Error decoding frames: {e}")
+                finally:
+                    if writer:
+                        writer.abort()
+                    GLib.idle_add(self.update_decoding_progress, generation, stop, stop)
+
+            thread = threading.Thread(target=load_frames_thread)
             thread.daemon = True
             thread.start()
 
         except Exception as e:
             print(f"Error loading GIF: {e}")
             self.frames = []
-            self.frame_durations = []
-            self.original_frame_durations = []
+            self.timeline = Timeline()
             self.current_frame_index = 0
             self.playhead_frame_index = 0
 
-    def compute_batch_size(self, frame_count):
-        return frame_count // 4
-
-    def update_loading_progress(self, current_frame, total_frames, frames, durations, total_duration=None):
-        """Update loading progress from background thread"""
-        self.frames = frames
-        self.frame_durations = durations
-        self.original_frame_durations = durations.copy()
-
-        self.info_label.set_text(f"Loading frames {current_frame}/{total_frames}")
-
-        # If this is the final update
-        if total_duration is not None:
-            # Update frameline with 1-based frame range
-            self.frameline.min_value = 1
-            self.frameline.max_value = total_frames
-            self.frameline.left_value = 1
-            self.frameline.right_value = total_frames
-            self.frameline.queue_draw()
-
-            self.info_label.set_text(
-                f"{total_frames} Frames • {total_duration:.2f} Seconds"
-            )
-
-            if self.frames:
-                self.display_frame(0)
-                self.overlay.drawing_area.queue_resize()
-                self.overlay.drawing_area.queue_draw()
-
-        return False  # Required for GLib.idle_add
+    def set_frame_cache(self, enabled):
+        """Keep decoded frames on disk so GIFs open again without decoding"""
+        self.frame_cache = FrameCache(cache_dir()) if enabled else None
+
+    def cancel_loading(self):
+        """Stop the running load, its pending idle callbacks become stale"""
+        if self._load_cancel is not None:
+            self._load_cancel.set()
+            self._load_cancel = None
+        self.load_generation += 1
+
+    def close_frames(self):
+        """Release the decoded frame cache and source file of the current GIF"""
+        if isinstance(self.frames, FrameStore):
+            self.frames.close()
+
+    def update_decoding_progress(self, generation, decoded, total):
+        """Report how far the background decoder got through the cached frames"""
+        if generation != self.load_generation:
+            return False  # Stale callback of a cancelled load
+
+        if decoded < total:
+            self.info_label.set_text(f"Decoding frames {decoded}/{total}")
+        else:
+            self._load_cancel = None
+            self.update_info_label()
+        return False
 
     def display_frame(self, frame_index):
         """Display a specific frame in the image display"""
@@ -317,7 +397,10 @@ class EditorBox(Gtk.Box):
 
         try:
             self.current_frame_index = frame_index
-            frame = self.frames[frame_index]
+            if self.transform.method is None:
+                frame = self.frames[frame_index]
+            else:
+                frame = self.edited_image(frame_index)
 
             if isinstance(frame, Image.Image):
                 pixbuf = self._pil_to_pixbuf(frame)
@@ -347,68 +430,43 @@ class EditorBox(Gtk.Box):
             self.playback_finished = False  # Reset the finished flag when starting playback
             self.update_play_button_icon(True)
 
-            # Get current frame range
-            start = int(round(self.frameline.left_value)) - 1
-            end = int(round(self.frameline.right_value)) - 1
-
             # Always start from the left handle when starting new playback
+            start = int(round(self.frameline.left_value)) - 1
             if not self.frameline.playhead_visible or self.playback_finished:
                 self.current_frame_index = start
                 self.playhead_frame_index = start
 
-            self.display_frame(self.current_frame_index)
+            # The clock starts where the current frame starts, so playback resumes at it
+            self.play_started = time.monotonic() - self.time_in_range(self.playhead_frame_index) / 1000
             self.show_playhead()
-            self.frameline.set_playhead_pos(self.current_frame_index)
             self.play_next_frame()
 
     def play_next_frame(self):
-        """Play the next frame in the sequence, with loop support."""
+        """Show the frame due on the playback clock, with loop support, and wait for the next one"""
         if not self.is_playing:
             return False
+        self.play_timeout_id = None
 
         start = int(round(self.frameline.left_value)) - 1
         end = int(round(self.frameline.right_value)) - 1
-        is_reversed = start > end
-        direction = -1 if is_reversed else 1
+        total = self.durations().range_stats(start, end)[1]
+        elapsed = (time.monotonic() - self.play_started) * 1000
 
-        # Get next valid frame, skipping removed ranges
-        next_frame = self.frameline.get_next_valid_frame(
-            self.current_frame_index,
-            direction
-        )
+        if total > 0 and elapsed >= total and self.loop_playback:
+            # Loop to the start, frames that were due are skipped instead of played late
+            self.play_started += elapsed // total * total / 1000
+            elapsed %= total
 
-        # Check if we've reached the end
-        if next_frame == -1 or (direction > 0 and next_frame > end) or (direction < 0 and next_frame < end):
-            if self.loop_playback:
-                # Loop to the start
-                self.current_frame_index = start
-                self.playhead_frame_index = start
-                self.display_frame(self.current_frame_index)
-                self.show_playhead()
-                self.frameline.set_playhead_pos(self.current_frame_index + 1)
-                current_duration = self.frame_durations[self.current_frame_index]
-                self.play_timeout_id = GLib.timeout_add(
-                    current_duration, self.play_next_frame)
-                return False
-            else:
-                self.is_playing = False
-                self.update_play_button_icon(False)
-                self.hide_playhead()
-                self.frameline.playhead_visible = False
-                if self.play_timeout_id:
-                    GLib.source_remove(self.play_timeout_id)
-                    self.play_timeout_id = None
-                return False
-
-        self.display_frame(next_frame)
-        self.current_frame_index = next_frame
-        self.playhead_frame_index = next_frame
-        self.frameline.set_playhead_pos(self.playhead_frame_index)
-
-        # Schedule next frame
-        current_duration = self.frame_durations[next_frame]
-        self.play_timeout_id = GLib.timeout_add(
-            current_duration, self.play_next_frame)
+        if total <= 0 or not self.seek_to_time(elapsed):
+            self.is_playing = False
+            self.update_play_button_icon(False)
+            self.hide_playhead()
+            self.frameline.playhead_visible = False
+            return False
+
+        # Wake up once the frame on screen has been shown for its duration
+        remaining = self.time_in_range(self.playhead_frame_index, end=True) - elapsed
+        self.play_timeout_id = GLib.timeout_add(max(1, int(remaining + 0.999)), self.play_next_frame)
         return False
 
 
@@ -418,8 +476,8 @@ class EditorBox(Gtk.Box):
     def hide_playhead(self):
         self.frameline.hide_playhead()
 
-    def save_frames(self, button):
-        """Save the selected frame range as a new GIF"""
+    def save_frames(self, button, size_limit=None):
+        """Save the selected frame range as a new GIF, of at most size_limit bytes if given"""
         # Convert to 0-based index
         start_idx = int(round(self.frameline.left_value)) - 1
         end_idx = int(round(self.frameline.right_value)) - 1
@@ -448,7 +506,7 @@ class EditorBox(Gtk.Box):
                         if not save_path.lower().endswith('.gif'):
                             save_path += '.gif'
 
-                        self._save_gif(save_path, start_idx, end_idx)
+                        self.save_gif_in_background(save_path, start_idx, end_idx, size_limit)
 
                 except GLib.Error as e:
                     # Only show error dialog if it's not a user dismissal
@@ -467,155 +525,225 @@ class EditorBox(Gtk.Box):
 
     def _handle_overwrite_response(self, dialog, response, save_path, start_idx, end_idx):
         if response == Gtk.ResponseType.YES:
-            self._save_gif(save_path, start_idx, end_idx)
+            self.save_gif_in_background(save_path, start_idx, end_idx)
         dialog.destroy()
 
-    def _save_gif(self, save_path, start_idx, end_idx):
+    def _save_gif(self, save_path, start_idx, end_idx, cancel=None, progress=None, size_limit=None):
         """Save GIF including inserted frames, drawings, and excluding removed ranges"""
-        import traceback
-        from PIL import Image, ImageDraw, ImageFont  # Move imports to the top of the method
-        
+        write = self._prepare_save(start_idx, end_idx, size_limit)
+        if write:
+            write(save_path, cancel, progress)
+
+    def _prepare_save(self, start_idx, end_idx, size_limit=None):
+        """
+        Read everything a save needs from the editor and return a function
+        write(save_path, cancel=None, progress=None) that composites and
+        writes the GIF from those copies. write touches no widgets, so it can
+        run on a worker thread while the editor keeps being used.
+        With a size_limit in bytes the GIF is scaled, given fewer colors and
+        frames as far as needed to fit it.
+        Returns None when there is nothing to save.
+        """
         is_reversed = start_idx > end_idx
         if is_reversed:
             start_idx, end_idx = end_idx, start_idx
 
-        frames_to_save = []
-        durations = []
-
-        # Get reference dimensions from the first non-removed frame
-        ref_frame = None
-        for frame in self.frames:
-            if frame:
-                ref_frame = self._pixbuf_to_pil(frame)
-                break
+        # Get reference dimensions from the first frame
+        if not len(self.frames):
+            return None  # No valid frames to save
+        ref_frame = self.frame_image(0)
 
-        if not ref_frame:
-            return  # No valid frames to save
+        # Frames of another size (inserted ones) are resized to the GIF's before orienting
+        transform = self.transform.resized(ref_frame.size)
+        orig_width, orig_height = transform.orient(ref_frame).size
 
         # Calculate crop box in absolute pixels
         crop_rect = self.overlay.crop_rect
-        orig_width, orig_height = ref_frame.size
         left = int(crop_rect[0] * orig_width)
         top = int(crop_rect[1] * orig_height)
         right = int((crop_rect[0] + crop_rect[2]) * orig_width)
         bottom = int((crop_rect[1] + crop_rect[3]) * orig_height)
-        crop_box = (left, top, right, bottom)
+        transform = transform.cropped((left, top, right, bottom))
 
-        for i in range(start_idx, end_idx + 1):
+        # Overlays as plain values, the widgets stay on the main thread
+        lines = [(list(line['points']), line.get('color')) for line in self.drawings[0]] if self.drawings else []
+        texts = [(int(entry['x']), int(entry['y']), entry['entry'].get_text())
+                 for entry in self.overlay.text_entries]
+        text_rotation = getattr(self, 'text_rotation', 0)
+
+        # Frames to write as immutable entries, later edits do not change them.
+        # A reversed range is walked backwards
+        frames = []
+        durations = []
+        start_idx, end_idx = max(0, start_idx), min(end_idx, len(self.frames) - 1)
+        indices = range(end_idx, start_idx - 1, -1) if is_reversed else range(start_idx, end_idx + 1)
+        for i in indices:
             if self.frameline.is_frame_removed(i):
                 continue
-            if i < 0 or i >= len(self.frames):
-                continue
-            if not self.frames[i]:
-                continue
-            # Get the frame and its duration
-            frame = self._pixbuf_to_pil(self.frames[i])
-            duration = self.frame_durations[i]
-            is_inserted = any(start <= i <= end for start, end in self.frameline.inserted_ranges)
-
-            # For inserted frames, resize to match original size before cropping
-            if is_inserted and frame.size != (orig_width, orig_height):
-                frame = frame.resize((orig_width, orig_height), Image.Resampling.LANCZOS)
-
-            draw = ImageDraw.Draw(frame)
-            long_side = max(orig_width, orig_height)
-
-            if self.drawings and self.drawings[0]:
-                for line in self.drawings[0]:
-                    if len(line['points']) > 1:
-                        # Convert coordinates to image space
-                        scaled_points = []
-                        for point in line['points']:
-                            if isinstance(point, (list, tuple)) and len(point) >= 2:
-                                x, y = point[0], point[1]
-                                if long_side == orig_width:
-                                    y = y - (self.container_size - orig_height)/2
-                                else:
-                                    x = x - (self.container_size - orig_width)/2
-                                scaled_points.append((x, y))
-
-                        color = line.get('color', '#FFFFFF')
-                        for j in range(len(scaled_points) - 1):  # Changed i to j to avoid variable shadowing
-                            draw.line([scaled_points[j], scaled_points[j + 1]],
-                                    fill=color, width=2)
-
-            # Handle text with rotation
-            for text_entry in self.overlay.text_entries:
+            frames.append(self.timeline[i] if isinstance(self.frames, FrameStore) else self.frames[i])
+            durations.append(self.timeline.duration(i))
+        load = self.frames.entry_frame if isinstance(self.frames, FrameStore) else self._pixbuf_to_pil
+        # Compositing workers decode source frames from the GIF themselves
+        source = self.frames if isinstance(self.frames, FrameStore) else None
+        loop = self.loop_count or 0
+
+        paint = OverlayPainter(lines, texts, text_rotation, self.container_size,
+                               (orig_width, orig_height)) or None
+
+        source_frames = isinstance(self.frames, FrameStore) and all(
+            isinstance(entry, FrameInfo) for entry in frames)
+        source_path = self.frames.file_path if source_frames else None
+
+        # Frames of the source GIF that are only trimmed, removed or sped up
+        # are copied without decoding them, but for the few before the first
+        # one that shows as in the source
+        copy_methods = None
+        if (source_frames and size_limit is None and paint is None and transform.method is None
+                and transform.crop == (0, 0) + ref_frame.size):
+            methods = disposal_methods(self.frames.sources)
+            copy_from = copy_start(frames, methods, ref_frame.size)
+            if copy_from is not None:
+                copy_methods = methods
+
+        # The source GIF's colors are kept as they are when no edit added new ones
+        shared_palette, dither = self.shared_palette or size_limit is not None, self.dither
+        source_table = None
+        if shared_palette and source_frames and paint is None:
+            source_table = self.frames.global_palette()
+
+        def write(save_path, cancel=None, progress=None):
+            if not frames:
+                return
+
+            if copy_methods is not None:
+                def encode(f):
+                    images = (source.entry_image(entry) for entry in frames[:copy_from])
+                    copy_frames(f, source_path, frames, durations, copy_methods, loop, images)
+                    if progress is not None:
+                        progress(len(frames), len(frames))
+            elif size_limit is not None:
+                fitter = SizeFitter(frames, durations, load, transform, paint, dither, source_table, loop,
+                                    source)
+
+                def encode(f):
+                    # Settings are picked from sampled estimates and checked against
+                    # the written size, an estimate that was too low is tried again
+                    # smaller, with the budget cut by how far it missed
+                    budget = size_limit
+                    index = fitter.fit(budget)
+                    while True:
+                        f.seek(0)
+                        f.truncate()
+                        fitter.write(f, SIZE_STEPS[index], cancel, progress)
+                        if f.tell() <= size_limit or (cancel is not None and cancel.is_set()):
+                            return
+                        if index == len(SIZE_STEPS) - 1:
+                            raise Exception(f"The GIF takes {f.tell()} bytes even at the smallest "
+                                            f"settings, over the limit of {size_limit}.")
+                        budget = budget * size_limit / f.tell()
+                        index = fitter.fit(budget, index + 1)
+            else:
+                palette = None
+                if shared_palette:
+                    if source_table:
+                        palette = Palette.from_table(source_table, dither)
+                    if palette is None:
+                        palette = Palette.from_frames([transform.apply(load(frames[i]), paint)
+                                                       for i in sample_indices(len(frames))], dither)
+
+                def frames_to_save():
+                    """Composited frames, each one encoded and dropped before the next is needed"""
+                    # Edits are applied to every frame in one pass, frames are composited in parallel
+                    images = composite_frames(frames, load, transform, paint, cancel=cancel,
+                                              source=source)
+                    for done, image in enumerate(images, 1):
+                        yield image
+                        if progress is not None:
+                            progress(done, len(frames))
+
+                def encode(f):
+                    # Only what changed between frames is encoded
+                    write_gif(f, frames_to_save(), durations, loop, palette)
+
+            # Write next to the target and rename, so a failed or cancelled save
+            # never leaves a partial GIF behind
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(save_path)),
+                                             suffix='.gif')
+            os.close(fd)
+            try:
+                with open(temp_path, 'wb') as f:
+                    encode(f)
+                if cancel is not None and cancel.is_set():
+                    raise Exception("Save cancelled by user.")
+                # mkstemp files are private, keep the permissions a plain save would have
                 try:
-                    x = int(text_entry['x'])
-                    y = int(text_entry['y'])
-                    text = text_entry['entry'].get_text()
-                    
-                    # Check if we need to apply rotation
-                    if hasattr(self, 'text_rotation') and self.text_rotation != 0:
-                        # Estimate text size - you might want to use a font that supports size measurement
-                        # This is an approximation
-                        font_size = 24  # Increased font size for better visibility
-                        text_width = len(text) * font_size
-                        text_height = font_size * 1.5
-                        
-                        # Create transparent image large enough for the rotated text
-                        text_img = Image.new('RGBA', 
-                                            (int(max(text_width, text_height) * 3), 
-                                             int(max(text_width, text_height) * 3)), 
-                                            (0, 0, 0, 0))
-                        
-                        # Draw text at the center of this new image
-                        text_draw = ImageDraw.Draw(text_img)
-                        text_draw.text((text_img.width//2, text_img.height//2), 
-                                       text, 
-                                       fill='white',
-                                       anchor='mm')  # Center alignment
-                        
-                        # Rotate the text image
-                        rotated_text = text_img.rotate(-self.text_rotation, 
-                                                      resample=Image.BICUBIC, 
-                                                      expand=True)
-                        
-                        # Calculate paste coordinates
-                        paste_x = x
-                        paste_y = y
-                        
-                        # Adjust for container padding
-                        if long_side == orig_width:
-                            paste_y -= (self.container_size - orig_height)//2
-                        else:
-                            paste_x -= (self.container_size - orig_width)//2
-                        
-                        # Adjust paste position to center the rotated text at the specified point
-                        paste_x -= rotated_text.width//2
-                        paste_y -= rotated_text.height//2
-                        
-                        # Paste using the alpha channel as mask
-                        frame.paste(rotated_text, (paste_x, paste_y), rotated_text)
-                    else:
-                        if long_side == orig_width:
-                            y = y - (self.container_size - orig_height)//2
-                        else:
-                            x = x - (self.container_size - orig_width)//2
-                        # No rotation - draw text directly
-                        draw.text((x, y), text, fill='white')
-                except Exception as e:
-                    print(f"Error drawing text: {e}")
-                    traceback.print_exc()
+                    mode = os.stat(save_path).st_mode & 0o777
+                except OSError:
+                    mode = 0o644
+                os.chmod(temp_path, mode)
+                os.replace(temp_path, save_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        return write
+
+    def save_gif_in_background(self, save_path, start_idx, end_idx, size_limit=None):
+        """Save on a worker thread with a progress dialog that can cancel it"""
+        try:
+            write = self._prepare_save(start_idx, end_idx, size_limit)
+        except Exception as e:
+            print(f"Error preparing save: {e}")
+            write = None
+        if write is None:
+            return
+
+        cancel_event = threading.Event()
+        finished = threading.Event()
+        progress_dialog = Adw.AlertDialog.new("Saving GIF...", save_path)
+        progress_dialog.add_response("cancel", "Cancel")
+        progress_dialog.set_default_response("cancel")
+        progress_dialog.set_close_response("cancel")
+
+        def on_response(dialog, response_id):
+            if response_id == "cancel" and not finished.is_set():
+                cancel_event.set()
+                dialog.set_heading("Cancelling...")
+                dialog.set_body("Please wait while the save is being cancelled.")
+
+        progress_dialog.connect("response", on_response)
+        progress_dialog.present(self.get_root())
+
+        last_update = [0.0]
+
+        def report(done, total):
+            now = time.monotonic()
+            if now - last_update[0] >= self.PROGRESS_INTERVAL or done == total:
+                last_update[0] = now
+                GLib.idle_add(progress_dialog.set_body, f"Saving frames {done}/{total}")
+
+        def finish(heading, body):
+            progress_dialog.set_heading(heading)
+            progress_dialog.set_body(body)
+            progress_dialog.add_response("ok", "OK")
+            progress_dialog.set_default_response("ok")
+            progress_dialog.set_close_response("ok")
+            progress_dialog.remove_response("cancel")
+            return False
 
-            frame = frame.crop(crop_box)
-            frames_to_save.append(frame)
-            durations.append(duration)
+        def save_thread():
+            try:
+                write(save_path, cancel_event, report)
+                finished.set()
+                GLib.idle_add(finish, "GIF Saved", save_path)
+            except Exception as e:
+                finished.set()
+                print(f"Error saving GIF: {e}")
+                GLib.idle_add(finish, "Save Failed", str(e))
 
-        if is_reversed:
-            frames_to_save.reverse()
-            durations.reverse()
-
-        if frames_to_save:
-            frames_to_save[0].save(
-                save_path,
-                save_all=True,
-                append_images=frames_to_save[1:],
-                duration=durations,
-                loop=0,
-                format='GIF'
-            )
+        thread = threading.Thread(target=save_thread)
+        thread.daemon = True
+        thread.start()
 
     def on_frames_changed(self, frameline, start, end):
         """Handle frame range changes from the frameline"""
@@ -678,13 +806,10 @@ class EditorBox(Gtk.Box):
         if not self.frames:
             return
         try:
-            for i, frame in enumerate(self.frames):
-                if frame:
-                    pil_image = self._pixbuf_to_pil(frame)
-                    flipped = pil_image.transpose(Image.FLIP_LEFT_RIGHT)
-                    self.frames[i] = self._pil_to_pixbuf(flipped)
+            self.transform = self.transform.flip()
 
             self.display_frame(self.current_frame_index)
+            self.record_edit()
 
         except Exception as e:
             print(f"Error flipping frames: {e}")
@@ -722,12 +847,8 @@ class EditorBox(Gtk.Box):
             # Swap dimensions (logical dimensions only, container stays the same)
             self.image_display_width, self.image_display_height = self.image_display_height, self.image_display_width
             
-            # Rotate the frames' content
-            for i, frame in enumerate(self.frames):
-                if frame:
-                    pil_image = self._pixbuf_to_pil(frame)
-                    rotated = pil_image.transpose(Image.ROTATE_270)
-                    self.frames[i] = self._pil_to_pixbuf(rotated)
+            # Rotate the frames' content, only recorded until a frame is shown
+            self.transform = self.transform.rotate()
             
             # Rotate all drawings if they exist
             if hasattr(self, 'drawings'):
@@ -766,32 +887,12 @@ class EditorBox(Gtk.Box):
                         entry_widget = text_entry['entry']
                         entry_widget.set_margin_start(int(final_x))
                         entry_widget.set_margin_top(int(final_y))
-                        
-                        # Apply rotation transform via CSS
-                        css_provider = Gtk.CssProvider()
-                        css_data = f"""
-                            entry {{
-                                transform: rotate({self.text_rotation}deg);
-                                transform-origin: 0 0;
-                            }}
-                        """
-                        css_provider.load_from_data(css_data.encode('utf-8'))
-                        
-                        style_context = entry_widget.get_style_context()
-                        
-                        if hasattr(entry_widget, 'rotation_provider'):
-                            style_context.remove_provider(entry_widget.rotation_provider)
-                        
-                        style_context.add_provider(
-                            css_provider,
-                            Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
-                        )
-                        entry_widget.rotation_provider = css_provider
-                        entry_widget.rotation_angle = self.text_rotation
+                        self._rotate_text_entry(entry_widget)
             
             # Update display
             self.display_frame(self.current_frame_index)
             self.overlay.drawing_area.queue_draw()
+            self.record_edit()
             
         except Exception as e:
             print(f"Error rotating frames: {e}")
@@ -910,89 +1011,55 @@ class EditorBox(Gtk.Box):
             self.frameline.playhead_visible = False
             self.hide_playhead()
 
+    def _read_frames(self, file_paths):
+        """Frames, durations and (path, frame count) source of image files to insert"""
+        new_frames = []
+        new_durations = []
+        source = []
+
+        for path in file_paths:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"File not found: {path}")
+
+            count = len(new_frames)
+            with Image.open(path) as img:
+                if getattr(img, 'is_animated', False):
+                    # Handle animated GIFs
+                    for frame in range(img.n_frames):
+                        img.seek(frame)
+                        new_frames.append(self._to_frame(img.convert('RGBA')))
+                        new_durations.append(img.info.get('duration', 100))
+                else:
+                    # Handle static images
+                    new_frames.append(self._to_frame(img.convert('RGBA')))
+                    new_durations.append(100)  # Default 100ms duration
+            source.append((path, len(new_frames) - count))
+
+        return new_frames, new_durations, source
+
     def on_insert_frames(self, frameline, position, file_paths):
         try:
-            new_frames = []
-            new_durations = []
-
-            for path in file_paths:
-                if not os.path.exists(path):
-                    raise FileNotFoundError(f"File not found: {path}")
-
-                with Image.open(path) as img:
-                    if getattr(img, 'is_animated', False):
-                        # Handle animated GIFs
-                        for frame in range(img.n_frames):
-                            img.seek(frame)
-                            pixbuf = self._pil_to_pixbuf(img.convert('RGBA'))
-                            new_frames.append(pixbuf)
-                            new_durations.append(img.info.get('duration', 100))
-                    else:
-                        # Handle static images
-                        pixbuf = self._pil_to_pixbuf(img.convert('RGBA'))
-                        new_frames.append(pixbuf)
-                        new_durations.append(100)  # Default 100ms duration
+            new_frames, new_durations, source = self._read_frames(file_paths)
 
             if new_frames:
                 insert_idx = max(0, position - 1)
                 num_new_frames = len(new_frames)
 
-                # Adjust speed ranges before inserting new frames
-                updated_speed_ranges = []
-                for start, end, speed in self.frameline.speed_ranges:
-                    if insert_idx <= start:
-                        # Speed range is after insertion point - shift it
-                        updated_speed_ranges.append((start + num_new_frames, end + num_new_frames, speed))
-                    elif insert_idx > end:
-                        # Speed range is before insertion point - keep it unchanged
-                        updated_speed_ranges.append((start, end, speed))
-                    else:
-                        # Speed range contains insertion point - split it into two parts
-                        if start < insert_idx:
-                            # Keep the part before insertion
-                            updated_speed_ranges.append((start, insert_idx - 1, speed))
-                        # Keep the part after insertion (shifted by the number of new frames)
-                        updated_speed_ranges.append((insert_idx + num_new_frames, end + num_new_frames, speed))
-
-                self.frameline.speed_ranges = updated_speed_ranges
-                self.frames[insert_idx:insert_idx] = new_frames
-                self.frame_durations[insert_idx:insert_idx] = new_durations
+                # Ranges after the insertion point follow from the timeline
+                self.frames.insert_frames(insert_idx, new_frames, new_durations,
+                                          inserted=True, source=source)
                 new_max = len(self.frames)
                 self.frameline.max_value = new_max
 
                 # If inserting at left handle, adjust right handle position
                 if self.frameline.active_handle == 'left':
-                    new_right = self.frameline.right_value + len(new_frames)
+                    new_right = self.frameline.right_value + num_new_frames
                     self.frameline.right_value = min(new_right, new_max)
 
-                # --- Update inserted_ranges (shift ranges after insertion) ---
-                updated_inserted_ranges = []
-                for start, end in self.frameline.inserted_ranges:
-                    if start > insert_idx:
-                        # Range is after insertion point - shift it
-                        updated_inserted_ranges.append((start + num_new_frames, end + num_new_frames))
-                    elif end < insert_idx:
-                        # Range is before insertion point - keep it unchanged
-                        updated_inserted_ranges.append((start, end))
-                    else:
-                        # Range overlaps insertion point - split or shift as needed
-                        # For simplicity, shift the part after insertion
-                        if start < insert_idx:
-                            updated_inserted_ranges.append((start, insert_idx - 1))
-                        updated_inserted_ranges.append((insert_idx + num_new_frames, end + num_new_frames))
-
-                self.frameline.inserted_ranges = updated_inserted_ranges
-                # Append the new inserted range
-                self.frameline.inserted_ranges.append((position, position + len(new_frames) - 1))
-                
-                for i, r in enumerate(self.frameline.removed_ranges):
-                    # Shift removed ranges after insertion point
-                    if r[0] >= insert_idx:
-                        self.frameline.removed_ranges[i] = (r[0] + num_new_frames, r[1] + num_new_frames)
-
                 self.frameline.queue_draw()
                 self.display_frame(insert_idx)
                 self.update_info_label()
+                self.record_edit()
 
         except Exception as e:
             print(f"Error inserting frames: {e}")
@@ -1012,33 +1079,23 @@ class EditorBox(Gtk.Box):
             start_idx = max(0, min(start_idx, len(self.frames) - 1))
             end_idx = max(0, min(end_idx, len(self.frames) - 1))
 
-            # Initialize original_frame_durations if not already set
-            if not hasattr(self, 'original_frame_durations'):
-                self.original_frame_durations = self.frame_durations.copy()
-            elif len(self.original_frame_durations) != len(self.frames):
-                # Extend original_frame_durations for inserted frames
-                inserted_count = len(self.frames) - len(self.original_frame_durations)
-                self.original_frame_durations.extend(self.frame_durations[-inserted_count:])
-
             # Verify we have valid frames and durations
-            if not self.frames or not self.frame_durations:
+            if not self.frames or not len(self.timeline):
                 print("Invalid frame data state")
                 return
 
-            # Adjust frame durations for the selected range
-            for i in range(start_idx, end_idx + 1):
-                if i < len(self.original_frame_durations):
-                    self.frame_durations[i] = int(self.original_frame_durations[i] / speed_factor)
+            # Set the speed of the selected range, the last speed given wins
+            previous = self.timeline.pieces
+            version = self.timeline.version
+            self.timeline.set_speed(start_idx, end_idx, speed_factor)
+            self.update_durations(start_idx, end_idx, version)
 
             # Warn if any frame duration in the affected range is < 10ms
-            min_duration = min(self.frame_durations[start_idx:end_idx+1]) if self.frame_durations[start_idx:end_idx+1] else 1000
+            min_duration = min(self.timeline.duration(i) for i in range(start_idx, end_idx + 1))
             if min_duration < 10:
                 # Compute the maximum applicable speedup for this range
-                if hasattr(self, 'original_frame_durations') and self.original_frame_durations:
-                    min_orig = min(self.original_frame_durations[i] for i in range(start_idx, end_idx+1))
-                    max_speedup = round(min_orig / 10.0, 2)
-                else:
-                    max_speedup = 'N/A'
+                min_orig = min(self.timeline.original_duration(i) for i in range(start_idx, end_idx + 1))
+                max_speedup = round(min_orig / 10.0, 2)
                 alert = Adw.AlertDialog()
                 alert.set_heading("Warning: GIF May Lag")
                 alert.set_body(
@@ -1052,42 +1109,16 @@ class EditorBox(Gtk.Box):
                 alert.set_close_response("cancel")
                 def on_response(dialog, response_id):
                     if response_id == "cancel":
-                        # Revert the frame durations in the affected range
-                        for i in range(start_idx, end_idx + 1):
-                            if i < len(self.original_frame_durations):
-                                self.frame_durations[i] = self.original_frame_durations[i]
-                        # Remove the speed range for the affected region
-                        self.frameline.speed_ranges = [
-                            (s, e, spd) for s, e, spd in self.frameline.speed_ranges
-                            if not (s == start_idx and e == end_idx)
-                        ]
+                        # Go back to the speeds from before the change
+                        self.timeline.restore(previous)
                         self.update_info_label()
                         self.frameline.queue_draw()
+                    self.record_edit()
                 alert.connect("response", on_response)
                 alert.present(self.get_root())
             else:
-                # Remove speed range if speed factor is 1.0
-                if speed_factor == 1.0:
-                    self.frameline.speed_ranges = [
-                        (s, e, spd) for s, e, spd in self.frameline.speed_ranges
-                        if not (s == start_idx and e == end_idx)
-                    ]
-                else:
-                    self.frameline.add_speed_range(start_idx, end_idx, speed_factor)
-
-                # Sort ranges by start index
-                self.frameline.speed_ranges.sort()
-
-                # Merge only adjacent (not overlapping) ranges with same speed
-                merged = []
-                for range_start, range_end, speed in self.frameline.speed_ranges:
-                    if not merged or merged[-1][1] + 1 < range_start or merged[-1][2] != speed:
-                        merged.append([range_start, range_end, speed])
-                    elif merged[-1][2] == speed:  # Only merge if speeds match
-                        merged[-1][1] = max(merged[-1][1], range_end)
-
-                self.frameline.speed_ranges = [tuple(x) for x in merged]
                 self.update_info_label()
+                self.record_edit()
 
                 # If currently playing, restart playback to apply new speeds immediately
                 if self.is_playing:
@@ -1112,9 +1143,11 @@ class EditorBox(Gtk.Box):
 
     def reset(self):
         """Reset editor state"""
+        self.cancel_loading()
+        self.close_frames()
         self.frames = []
-        self.frame_durations = []
-        self.original_frame_durations = []
+        self.timeline = Timeline()
+        self.loop_count = None
         self.current_frame_index = 0
         self.playhead_frame_index = 0
         self.is_playing = False
@@ -1141,6 +1174,7 @@ class EditorBox(Gtk.Box):
         # Reset transformations
         self.flipped = False
         self.rotated = False
+        self.transform = Transform()
         if hasattr(self, 'text_rotation'):
             self.text_rotation = 0
             
@@ -1153,6 +1187,7 @@ class EditorBox(Gtk.Box):
         
         # Reset frameline and display
         self.frameline.reset()
+        self.history.reset(self.snapshot())
         self.info_label.set_text("")
         self.image_display.set_pixbuf(None)
         self.image_display.queue_draw()
@@ -1181,6 +1216,25 @@ class EditorBox(Gtk.Box):
             rowstride
         )
 
+    def _to_frame(self, pil_image):
+        """Turn a PIL image into an entry for self.frames"""
+        if isinstance(self.frames, FrameStore):
+            return pil_image  # The store keeps it palette-indexed
+        return self._pil_to_pixbuf(pil_image)
+
+    def frame_image(self, index):
+        """Return frame index as an RGBA PIL image"""
+        if isinstance(self.frames, FrameStore):
+            return self.frames.image(index)
+        return self._pixbuf_to_pil(self.frames[index])
+
+    def edited_image(self, index):
+        """Return frame index as an RGBA PIL image, flipped and rotated as displayed"""
+        if isinstance(self.frames, FrameStore):
+            # Packed frames are turned on their 1-byte indices, then expanded
+            return unpack(self.transform.orient(self.frames.frame(index)))
+        return self.transform.orient(self.frame_image(index))
+
     def _pixbuf_to_pil(self, pixbuf):
         """Convert GdkPixbuf to PIL Image"""
         width, height = pixbuf.get_width(), pixbuf.get_height()
@@ -1197,6 +1251,229 @@ class EditorBox(Gtk.Box):
         image = Gtk.Image.new_from_gicon(icon)
         self.play_btn.set_child(image)
 
+    @property
+    def frame_durations(self):
+        """Duration of every frame with its speed applied, read from the timeline"""
+        return self.timeline.durations()
+
+    @property
+    def original_frame_durations(self):
+        return self.timeline.original_durations()
+
+    def durations(self):
+        """DurationIndex of the frame playback durations and removed frames"""
+        timeline = self.timeline
+        key = self._duration_key
+        if self.duration_index is None or key[0] is not timeline or key[1] != timeline.version:
+            self.duration_index = DurationIndex([playback_duration(d) for d in timeline.durations()],
+                                                timeline.removed_ranges.covers)
+            self._duration_key = (timeline, timeline.version)
+        return self.duration_index
+
+    def update_durations(self, start, end, version):
+        """
+        Update the DurationIndex for frames start..end whose duration changed
+        since timeline version, in O(log n) per frame instead of rebuilding it.
+        """
+        timeline = self.timeline
+        key = self._duration_key
+        if self.duration_index is None or key[0] is not timeline or key[1] != version:
+            return
+        for i in range(start, end + 1):
+            self.duration_index.update(i, playback_duration(timeline.duration(i)),
+                                       timeline.removed_ranges.covers(i))
+        self._duration_key = (timeline, timeline.version)
+
+    def frame_at_time(self, ms):
+        """Frame shown ms milliseconds into the selected range, or -1 past its end"""
+        start = int(round(self.frameline.left_value)) - 1
+        end = int(round(self.frameline.right_value)) - 1
+        if start > end:
+            # A reversed range plays from start down to end
+            index = self.durations().seek_back(ms, start)
+            return index if index >= end else -1
+        index = self.durations().seek(ms, start)
+        return index if index <= end else -1
+
+    def seek_to_time(self, ms):
+        """Show the frame at ms milliseconds into the selected range"""
+        index = self.frame_at_time(ms)
+        if index == -1:
+            return False
+        self.display_frame(index)
+        self.current_frame_index = index
+        self.playhead_frame_index = index
+        self.frameline.set_playhead_pos(index + 1)
+        return True
+
+    def seek_to_frame(self, index):
+        """Move the playhead to a frame of the selected range, playback goes on from there"""
+        start = int(round(self.frameline.left_value)) - 1
+        end = int(round(self.frameline.right_value)) - 1
+        if not min(start, end) <= index <= max(start, end):
+            return False
+        ms = self.time_in_range(index)
+        if self.is_playing:
+            if self.play_timeout_id:
+                GLib.source_remove(self.play_timeout_id)
+            self.play_started = time.monotonic() - ms / 1000
+            self.play_next_frame()
+            return True
+        if not self.seek_to_time(ms):
+            return False
+        self.show_playhead()
+        return True
+
+    def time_in_range(self, index, end=False):
+        """Milliseconds into the selected range at which frame index starts, or ends with end"""
+        start = int(round(self.frameline.left_value)) - 1
+        last = int(round(self.frameline.right_value)) - 1
+        durations = self.durations()
+        if start > last:
+            # Played backwards from start
+            return durations.time_at(start + 1) - durations.time_at(index if end else index + 1)
+        return durations.time_at(index + 1 if end else index) - durations.time_at(start)
+
+    def snapshot(self):
+        """Immutable copy of the editable state, sharing frames instead of copying them"""
+        return {
+            'timeline': self.timeline.pieces,
+            'transform': self.transform,
+            'flipped': self.flipped,
+            'rotated': self.rotated,
+            'display_size': (getattr(self, 'image_display_width', 0),
+                             getattr(self, 'image_display_height', 0)),
+            'text_rotation': getattr(self, 'text_rotation', 0),
+            'crop_rect': tuple(self.overlay.crop_rect),
+            'drawings': tuple(
+                tuple((tuple(line['points']), line.get('color')) for line in lines)
+                for lines in self.drawings),
+            'texts': tuple(
+                (entry['entry'], entry['x'], entry['y'], entry['entry'].get_text())
+                for entry in self.overlay.text_entries if entry.get('entry')),
+        }
+
+    def restore(self, state):
+        """Bring the editor back to a snapshot"""
+        self.stop_playback()
+        # Frames, durations and ranges all come back with the timeline pieces
+        self.timeline.restore(state['timeline'])
+        count = max(1, len(self.frames))
+        self.frameline.max_value = count
+        self.frameline.left_value = min(self.frameline.left_value, count)
+        self.frameline.right_value = min(self.frameline.right_value, count)
+
+        self.transform = state['transform']
+        self.flipped = state['flipped']
+        self.rotated = state['rotated']
+        self.image_display_width, self.image_display_height = state['display_size']
+        self.text_rotation = state['text_rotation']
+        self.update_action_bar_button(self.flipped, self.flip_button)
+        self.update_action_bar_button(self.rotated, self.rotate_button)
+
+        self.overlay.crop_rect = list(state['crop_rect'])
+        self.drawings = [
+            [{'points': list(points), 'color': color} for points, color in lines]
+            for lines in state['drawings']]
+
+        # Text entries are widgets, put back the ones the snapshot had
+        kept = {text[0] for text in state['texts']}
+        for entry in self.overlay.text_entries:
+            if entry.get('entry') and entry['entry'] not in kept:
+                self.overlay.remove_overlay(entry['entry'])
+        shown = {entry.get('entry') for entry in self.overlay.text_entries}
+        self.overlay.text_entries = []
+        for widget, x, y, text in state['texts']:
+            if widget not in shown:
+                self.overlay.add_overlay(widget)
+            widget.set_text(text)
+            widget.set_margin_start(int(x))
+            widget.set_margin_top(int(y))
+            self._rotate_text_entry(widget)
+            self.overlay.text_entries.append({'entry': widget, 'x': x, 'y': y})
+
+        self.display_frame(min(self.current_frame_index, len(self.frames) - 1))
+        self.frameline.queue_draw()
+        self.overlay.drawing_area.queue_draw()
+        self.update_info_label()
+
+    def save_project(self, path):
+        """Save the edit decisions to a .fig project that refers to the source files"""
+        state = self.snapshot()
+        state['texts'] = tuple((text, x, y) for _, x, y, text in state['texts'])
+        state['loop'] = self.loop_count
+        hash_of = self.frame_cache.key if self.frame_cache else file_hash
+        save_project(path, state, self.timeline.sources, hash_of)
+
+    def open_project(self, path):
+        """
+        Open a .fig project. The source GIF is probed and decoded on demand
+        like any GIF, then the recorded edits are put back without touching
+        pixels, so opening does not depend on the number of frames.
+        """
+        try:
+            hash_of = self.frame_cache.key if self.frame_cache else file_hash
+            state, sources = load_project(path, hash_of)
+            (gif_path, frame_count), = sources[0]
+            self.load_gif(gif_path)
+            if len(self.timeline) != frame_count:
+                raise ValueError(f"Could not load {gif_path}")
+
+            # Inserted frames are read again in the order their buffers were made
+            for source in sources[1:]:
+                frames, durations, _ = self._read_frames([file_path for file_path, _ in source])
+                self.frames.insert_frames(len(self.frames), frames, durations,
+                                          inserted=True, source=source)
+
+            self.loop_count = state['loop']
+            state['texts'] = tuple((self.overlay.create_text_entry(x, y), x, y, text)
+                                   for text, x, y in state['texts'])
+            self.restore(state)
+            self.frameline.left_value = self.frameline.min_value
+            self.frameline.right_value = self.frameline.max_value
+            self.history.reset(self.snapshot())
+            return True
+        except Exception as e:
+            print(f"Error opening project: {e}")
+            return False
+
+    def record_edit(self):
+        """Add the current state to the undo history after an edit"""
+        self.history.push(self.snapshot())
+
+    def undo(self):
+        state = self.history.undo()
+        if state is not None:
+            self.restore(state)
+
+    def redo(self):
+        state = self.history.redo()
+        if state is not None:
+            self.restore(state)
+
+    def _rotate_text_entry(self, entry_widget):
+        """Turn a text entry widget by text_rotation via CSS"""
+        css_provider = Gtk.CssProvider()
+        css_data = f"""
+            entry {{
+                transform: rotate({self.text_rotation}deg);
+                transform-origin: 0 0;
+            }}
+        """
+        css_provider.load_from_data(css_data.encode('utf-8'))
+
+        style_context = entry_widget.get_style_context()
+
+        if hasattr(entry_widget, 'rotation_provider'):
+            style_context.remove_provider(entry_widget.rotation_provider)
+
+        style_context.add_provider(
+            css_provider,
+            Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
+        )
+        entry_widget.rotation_provider = css_provider
+        entry_widget.rotation_angle = self.text_rotation
+
     def update_info_label(self):
         """Update info label with current frame count and total duration"""
         try:
@@ -1204,15 +1481,8 @@ class EditorBox(Gtk.Box):
             left_value = int(round(self.frameline.left_value)) - 1
             right_value = int(round(self.frameline.right_value)) - 1
 
-            valid_frame_count = sum(
-                not self.frameline.is_frame_removed(i) for i in range(left_value, right_value + 1)
-            )
-
-            # Calculate total duration from current frame durations
-            total_duration = sum(
-                self.frame_durations[i] for i in range(left_value, right_value + 1)
-                if not self.frameline.is_frame_removed(i)
-            ) / 1000.0  # Convert to seconds
+            valid_frame_count, total_duration = self.durations().range_stats(left_value, right_value)
+            total_duration /= 1000.0  # Convert to seconds
 
             self.info_label.set_text(
                 f"{valid_frame_count} Frames • {total_duration:.2f} Seconds"
@@ -1236,6 +1506,7 @@ class EditorBox(Gtk.Box):
         if self.crop_mode:
             self.crop_mode = False
             self.overlay.reset_crop_rect()
+            self.record_edit()
         else:
             self.crop_mode = True
             self.overlay.handles_visible = True
@@ -0,0 +1,309 @@
+import mmap
+import struct
+
+from PIL import Image, ImageChops, GifImagePlugin
+
+from fig.gifindex import parse_header
+
+# GIF disposal methods
+DISPOSE_NONE = 1  # Leave the frame in place, the next one is drawn over it
+DISPOSE_BACKGROUND = 2  # Clear the frame's area before the next one is drawn
+
+# GIF has no partial transparency, alpha below this is transparent
+ALPHA_THRESHOLD = 128
+_ALPHA_LUT = [0] * ALPHA_THRESHOLD + [255] * (256 - ALPHA_THRESHOLD)
+_CHANGED_LUT = [0] + [255] * 255
+
+
+class GifWriter:
+    """
+    Writes GIF blocks to a binary file as frames come in.
+
+    Frames are P mode images placed at an offset of the canvas. With a
+    Palette they index its global color table, without one every frame
+    brings its own color table. Pixel data is LZW encoded by Pillow.
+    Without header, frames are added after a header already written.
+    """
+
+    def __init__(self, fp, size, loop=0, palette=None, header=True):
+        self.fp = fp
+        self.size = size
+        self.palette = palette
+        if not header:
+            return
+        # Header and logical screen, with the global color table if there is one
+        flags, table = 0, b''
+        if palette is not None:
+            table = palette.table()
+            # Flag and size, the table holds 2 ** (n + 1) colors
+            flags = 0x80 | ((len(table) // 3).bit_length() - 2)
+        fp.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], flags, 0, 0) + table)
+        if loop is not None:
+            fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+    def write_frame(self, image, offset=(0, 0), duration=0, disposal=0, transparency=None):
+        """Write a P mode image at offset, shown for duration milliseconds"""
+        packed = disposal << 2 | (transparency is not None)
+        self.fp.write(b'!\xf9\x04' + struct.pack('<BHB', packed, round(duration / 10),
+                                                 transparency or 0) + b'\x00')
+        for data in GifImagePlugin.getdata(image, offset,
+                                           include_color_table=self.palette is None):
+            self.fp.write(data)
+
+    def close(self):
+        self.fp.write(b';')
+
+
+def _indexed(rgb, visible=None):
+    """
+    Quantize an RGB image to colors of its own for a GIF frame, returns
+    (image, transparency). Pixels outside the visible mask get the
+    transparent index.
+    """
+    image = rgb.quantize(255, method=Image.Quantize.FASTOCTREE)
+    # The octree always makes a full palette, keep the colors in use so the
+    # color table stays small
+    used = [index for index, count in enumerate(image.histogram()) if count]
+    if len(used) < 255:
+        image = image.remap_palette(used)
+    if visible is None:
+        return image, None
+    palette = image.getpalette()
+    transparency = min(len(palette) // 3, 255)
+    image.putpalette(palette[:transparency * 3] + [0, 0, 0])
+    image.paste(transparency, mask=ImageChops.invert(visible))
+    return image, transparency
+
+
+class _Frame:
+    """A frame held back until the next one decides its disposal"""
+
+    def __init__(self, rgb, alpha, duration, palette=None, indexed=None):
+        self.rgb = rgb
+        self.alpha = alpha
+        self.opaque = alpha.getextrema()[0] == 255
+        self.duration = duration
+        self.palette = palette
+        self.indexed = indexed  # The whole frame mapped onto the palette, made on first use
+        self.on_clear = False  # Drawn onto an empty canvas
+        self.image = None  # Encoded P image, None until encoded
+        self.offset = (0, 0)
+        self.transparency = None
+
+    def encode_full(self, transparent=False):
+        """
+        Everything visible of the frame, with a transparent index if it has
+        transparent pixels or when asked for one. On an empty canvas only
+        the box around the visible pixels is needed.
+        """
+        visible = None if self.opaque and not transparent else self.alpha
+        box = (0, 0) + self.rgb.size
+        if self.on_clear and not self.opaque:
+            box = self.alpha.getbbox() or (0, 0, 1, 1)
+            visible = visible.crop(box)
+        self._encode(box, visible)
+
+    def encode_delta(self, changed, box):
+        """Only the changed box, with unchanged pixels left transparent"""
+        visible = changed.crop(box).point(_CHANGED_LUT)
+        if visible.getextrema()[0] == 255:
+            visible = None  # Every pixel changed, no transparent index needed
+        self._encode(box, visible)
+
+    def _encode(self, box, visible):
+        """Quantize the box of the frame, pixels outside visible get the transparent index"""
+        self.offset = box[:2]
+        if self.palette is None:
+            self.image, self.transparency = _indexed(self.rgb.crop(box), visible)
+            return
+        # The whole frame is mapped once, so a pixel gets the same index
+        # (and dither pattern) whichever box it is written in
+        if self.indexed is None:
+            self.indexed = self.palette.map(self.rgb)
+        self.image = self.indexed.crop(box)
+        self.transparency = None
+        if visible is not None:
+            self.transparency = self.palette.transparency
+            self.image.paste(self.transparency, mask=ImageChops.invert(visible))
+
+
+class DeltaEncoder:
+    """
+    Turns full-canvas frames into GIF frames that only hold what changed.
+
+    Every opaque frame is compared with the previous one and only the
+    bounding box of changed pixels is written, with the pixels that did not
+    change mapped to the transparent index so the previous frame shows
+    through. Frames that repeat the previous one only extend its duration.
+
+    Frames with transparent pixels can not be drawn over what is below them,
+    so the frame before them is written whole with the background disposal
+    that clears it, and they are drawn onto the empty canvas. That choice is made when
+    the next frame arrives, which is why one frame is always held back.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._pending = None
+        self._first_opaque = True
+
+    def add(self, image, duration, indexed=None):
+        """
+        Encode the next full-canvas frame, shown for duration milliseconds.
+        indexed is the frame already mapped onto the writer's palette, if
+        the caller has it.
+        """
+        if image.size != self.writer.size:
+            raise ValueError(f"frame size {image.size} differs from the GIF's {self.writer.size}")
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        frame = _Frame(image.convert('RGB'), image.getchannel('A').point(_ALPHA_LUT), duration,
+                       self.writer.palette, indexed)
+
+        previous = self._pending
+        if previous is None:
+            self._first_opaque = frame.opaque
+            frame.on_clear = True
+            # Some decoders (Pillow among them) only keep later frames'
+            # transparency when the first frame declares a transparent index
+            frame.encode_full(transparent=True)
+            self._pending = frame
+            return
+
+        changed = self._changed(previous, frame)
+        box = changed.getbbox()
+        if box is None:
+            previous.duration += duration
+            return
+
+        if frame.opaque:
+            self._write(previous, DISPOSE_NONE)
+            frame.encode_delta(changed, box)
+        else:
+            self._write(previous, DISPOSE_BACKGROUND)
+            frame.on_clear = True
+            frame.encode_full()
+        self._pending = frame
+
+    def flush(self):
+        """Write the held back frame, leaving it on the canvas for frames written after it"""
+        if self._pending is not None:
+            self._write(self._pending, DISPOSE_NONE)
+            self._pending = None
+
+    def close(self):
+        """Write the held back frame and end the GIF"""
+        if self._pending is not None:
+            # A looping GIF starts over on the last frame, which must be
+            # cleared if the first one has transparent pixels
+            self._write(self._pending,
+                        DISPOSE_NONE if self._first_opaque else DISPOSE_BACKGROUND)
+            self._pending = None
+        self.writer.close()
+
+    def _write(self, frame, disposal):
+        if disposal == DISPOSE_BACKGROUND and not (frame.on_clear and frame.transparency is not None):
+            # Clearing only a changed box would leave older frames around it, and
+            # decoders that clear to a color rather than to transparent pick the
+            # frame's transparent index
+            frame.encode_full(transparent=True)
+        self.writer.write_frame(frame.image, frame.offset, frame.duration, disposal,
+                                frame.transparency)
+
+    @staticmethod
+    def _changed(previous, frame):
+        """Mask of pixels that differ in visible color or in transparency"""
+        bands = ImageChops.difference(previous.rgb, frame.rgb).split()
+        difference = ImageChops.lighter(ImageChops.lighter(bands[0], bands[1]), bands[2])
+        # Colors under transparent pixels do not matter
+        difference = ImageChops.multiply(difference, ImageChops.lighter(previous.alpha, frame.alpha))
+        return ImageChops.lighter(difference, ImageChops.difference(previous.alpha, frame.alpha))
+
+
+def write_gif(fp, frames, durations, loop=0, palette=None):
+    """
+    Encode RGBA frames of one size to fp as an inter-frame optimized GIF,
+    with a global Palette or with a palette for every frame.
+    """
+    encoder = None
+    for image, duration in zip(frames, durations):
+        if encoder is None:
+            encoder = DeltaEncoder(GifWriter(fp, image.size, loop, palette))
+        encoder.add(image, duration)
+    if encoder is not None:
+        encoder.close()
+
+
+def _independent(info, method, size):
+    """True when a source frame shows the same whatever was on the canvas before it"""
+    covers = (info.left, info.top, info.width, info.height) == (0, 0) + tuple(size)
+    # Restoring to previous after it would bring back what was before
+    return covers and info.transparency is None and method != 3
+
+
+def copy_start(frames, methods, size):
+    """
+    Number of leading frames to encode anew so the rest can be copied from
+    the source GIF and show exactly as there, or None when they can not.
+    A copied frame must follow the one it followed in the source, or paint
+    the whole canvas. Encoded frames end on the canvas the frame before the
+    first copied one showed, which is what the source left for it unless
+    that frame is disposed of. methods are the disposal_methods of the source.
+    """
+    start = None
+    previous = None
+    for position, info in enumerate(frames):
+        independent = _independent(info, methods[info.index], size)
+        if previous is None:
+            resumes = info.index == 0 or independent
+        elif info.index == previous.index + 1 or independent:
+            resumes = independent or methods[previous.index] in (0, DISPOSE_NONE)
+        else:
+            # A delta after another frame than in the source, copying starts after it
+            start = None
+            resumes = False
+        if start is None and resumes:
+            start = position
+        previous = info
+    return start
+
+
+def copy_frames(fp, source_path, frames, durations, methods, loop=0, images=()):
+    """
+    Write FrameInfo frames of a GIF file to fp without decoding them.
+
+    The header, color tables and LZW data are copied byte for byte, only the
+    Graphic Control Extensions are written anew with the given durations.
+    images are the first copy_start() frames as RGBA, they are encoded anew.
+    """
+    with open(source_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            header = parse_header(buf[:13])
+            fp.write(buf[:header.length])
+            if loop is not None:
+                fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+            # Encoded frames bring their own color tables, the source's global one stays for the rest
+            encoder = DeltaEncoder(GifWriter(fp, (header.width, header.height), header=False))
+            encoded = 0
+            for image, duration in zip(images, durations):
+                encoder.add(image, duration)
+                encoded += 1
+            encoder.flush()
+
+            inherited = DISPOSE_NONE if encoded else 0
+            for info, duration in zip(frames[encoded:], durations[encoded:]):
+                flags = transparency = 0
+                if buf[info.offset] == 0x21 and buf[info.offset + 1] == 0xF9:
+                    flags, transparency = buf[info.offset + 3], buf[info.offset + 6]
+                # A frame without a disposal keeps the one before it, which is
+                # another one when frames were left out before it
+                disposal = info.disposal
+                if not disposal and methods[info.index] != inherited:
+                    disposal = methods[info.index] or DISPOSE_NONE
+                inherited = disposal or inherited
+                flags = flags & ~0x1C | disposal << 2
+                fp.write(b'!\xf9\x04' + struct.pack('<BHB', flags, round(duration / 10), transparency)
+                         + b'\x00')
+                fp.write(buf[info.descriptor:info.end])
+            fp.write(b';')
@@ -0,0 +1,230 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import tempfile
+import threading
+
+from PIL import Image
+
+from fig.gifindex import FrameInfo
+from fig.indexed import IndexedFrame, pack
+
+# Default size cap for all cached GIFs together
+DEFAULT_FRAME_CACHE_BYTES = 1024 * 1024 * 1024
+
+MAGIC = b'FIGFRAMES2\n'
+FOOTER = struct.Struct('<Q')  # Offset of the JSON table at the end of the file
+
+
+def file_hash(file_path):
+    """Content hash of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FrameCache:
+    """
+    Decoded frames of GIFs opened before, kept under $XDG_CACHE_HOME/fig/frames.
+
+    Every GIF gets one file named after its content hash, holding the packed
+    frames followed by a JSON table with their metadata. Files are read back
+    through mmap, so reopening a GIF maps it instead of decoding it. A small
+    path index remembers the hash for a file's size and mtime to avoid
+    hashing it again. Least recently used files are removed once the cache
+    grows beyond max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_FRAME_CACHE_BYTES):
+        self.directory = os.path.join(directory, 'frames')
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(self.directory, 'index.json')
+        self._lock = threading.Lock()
+
+    def key(self, file_path):
+        """Cache key of a GIF, hashing it only when size or mtime changed"""
+        stat = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        with self._lock:
+            index = self._read_index()
+            known = index.get(path)
+            if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                return known[2]
+
+            key = file_hash(file_path)
+            index[path] = [stat.st_size, stat.st_mtime_ns, key]
+            self._write_index(index)
+            return key
+
+    def open(self, file_path):
+        """Return the CachedFrames of a GIF, or None when it is not cached"""
+        try:
+            path = self._entry_path(self.key(file_path))
+            cached = CachedFrames(path)
+            os.utime(path)  # Mark as recently used
+            return cached
+        except (OSError, ValueError):
+            return None
+
+    def writer(self, file_path, infos, frame_size):
+        """
+        Return a CacheWriter for a GIF, or None when it would not fit the
+        cache. One entry may take half of max_bytes.
+        """
+        max_bytes = self.max_bytes // 2
+        # Packed frames take one to four bytes per pixel, the writer stops
+        # once the frames it was given take more than an entry may
+        if len(infos) * frame_size[0] * frame_size[1] > max_bytes:
+            return None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            return CacheWriter(self, self._entry_path(self.key(file_path)), infos, max_bytes)
+        except OSError as e:
+            print(f"Error creating frame cache entry: {e}")
+            return None
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits max_bytes, except keep"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.frames'):
+                stat = os.stat(os.path.join(self.directory, name))
+                total += stat.st_size
+                if os.path.join(self.directory, name) != keep:
+                    entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + '.frames')
+
+    def _read_index(self):
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, self._index_path)
+
+
+class CacheWriter:
+    """
+    Streams decoded frames of one GIF into a cache entry.
+
+    Once the entry grows beyond max_bytes it is dropped, add() returns
+    False from then on and nothing is committed.
+    """
+
+    def __init__(self, cache, path, infos, max_bytes=None):
+        self._cache = cache
+        self._path = path
+        self._infos = infos
+        self.max_bytes = max_bytes
+        fd, self._temp_path = tempfile.mkstemp(dir=cache.directory, suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self._file.write(MAGIC)
+        self._records = []
+        self.aborted = False
+
+    def add(self, image):
+        """Append the next frame, in source order. False once the entry is dropped"""
+        if self.aborted:
+            return False
+        frame = pack(image)
+        image = frame.image if isinstance(frame, IndexedFrame) else frame
+        offset = self._file.tell()
+        self._file.write(image.tobytes())
+        record = {'mode': image.mode, 'size': image.size, 'offset': offset}
+        if image.mode == 'P':
+            palette = bytes(image.getpalette())
+            record['palette'] = [self._file.tell(), len(palette)]
+            self._file.write(palette)
+            record['transparency'] = image.info.get('transparency')
+        self._records.append(record)
+        if self.max_bytes is not None and self._file.tell() > self.max_bytes:
+            self.abort()
+            return False
+        return True
+
+    def commit(self):
+        """Publish the entry once every frame was added"""
+        if self.aborted:
+            return
+        table = {
+            'frames': [list(info) for info in self._infos],
+            'records': self._records,
+        }
+        table_offset = self._file.tell()
+        self._file.write(json.dumps(table).encode('utf-8'))
+        self._file.write(FOOTER.pack(table_offset))
+        self._file.close()
+        os.replace(self._temp_path, self._path)
+        # The entry just written is the most recently used, whatever its mtime says
+        self._cache.evict(keep=self._path)
+
+    def abort(self):
+        """Drop the partly written entry"""
+        self.aborted = True
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+
+class CachedFrames:
+    """Read-only mapped view of one cache entry"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC or len(self._map) < len(MAGIC) + FOOTER.size:
+            self._map.close()
+            raise ValueError("not a frame cache file")
+        table_offset, = FOOTER.unpack_from(self._map, len(self._map) - FOOTER.size)
+        table = json.loads(self._map[table_offset:len(self._map) - FOOTER.size])
+        self.infos = [FrameInfo(*frame) for frame in table['frames']]
+        self._records = table['records']
+        if len(self._records) != len(self.infos):
+            self._map.close()
+            raise ValueError("incomplete frame cache file")
+
+    def __len__(self):
+        return len(self._records)
+
+    def frame(self, index):
+        """Packed frame over the mapped pages, without copying its pixels"""
+        record = self._records[index]
+        mode = record['mode']
+        width, height = record['size']
+        length = width * height * Image.getmodebands(mode)
+        view = memoryview(self._map)[record['offset']:record['offset'] + length]
+        image = Image.frombuffer(mode, (width, height), view, 'raw', mode, 0, 1)
+        if mode != 'P':
+            return image
+        start, length = record['palette']
+        image.putpalette(self._map[start:start + length])
+        if record['transparency'] is not None:
+            image.info['transparency'] = record['transparency']
+        return IndexedFrame(image)
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # Still viewed by a frame, unmapped once that is gone
@@ -5,6 +5,9 @@ from gi.repository import Gtk, Gdk, GLib, Graphene, GObject, Gio
 import gi
 gi.require_version('Gtk', '4.0')
 
+from fig.timeline import Timeline
+from fig.ranges import RangeList
+
 
 class FrameLine(Gtk.Widget):
     __gtype_name__ = 'FrameLine'
@@ -164,10 +167,10 @@ class FrameLine(Gtk.Widget):
         self.popup_menu.set_child(menu_box)
         self.popup_menu.connect('closed', self.on_popup_closed)
 
-        # Modified 0-based Ranges (start, end)
-        self.removed_ranges = [] 
-        self.inserted_ranges = []
-        self.speed_ranges = []
+        # Removed, inserted and speed ranges are read from the editor's Timeline,
+        # a FrameLine of its own keeps them in a private one
+        self._timeline = Timeline()
+        self._inserted_ranges = (None, None, None)  # (timeline, version, 1-based RangeList)
         
         self.is_dark = False
 
@@ -298,28 +301,20 @@ class FrameLine(Gtk.Widget):
     def handle_within_insert_range(self, handle_x):
         # Convert handle_x screen position to frame value
         handle_value = self.position_to_value(handle_x, self.get_width())
-        for start, end in self.inserted_ranges:
-            # Compare using frame values (ranges are stored as 1-based indices)
-            if start <= handle_value <= end:
-                return True
-        return False
+        # Compare using frame values (ranges are stored as 1-based indices)
+        return self.inserted_ranges.covers(handle_value)
     
     def handle_within_speed_range(self, handle_x):
         # Convert handle_x screen position to frame value
         handle_value = self.position_to_value(handle_x, self.get_width())
-        for start, end, _ in self.speed_ranges:
-            # Add 1 to convert from 0-based to 1-based indices
-            if (start + 1) <= handle_value <= (end + 1):
-                return True
-        return False
+        # Subtract 1 to convert from 1-based to 0-based indices
+        return self.speed_ranges.covers(handle_value - 1)
     
     def get_playhead_color(self, position):
-        for range_start, range_end, _ in self.speed_ranges:
-            if range_start <= position <= range_end:
-                return (0x62/255, 0xa0/255, 0xea/255)  # Blue
-        for range_start, range_end in self.inserted_ranges:
-            if range_start <= position <= range_end:
-                return (0x57/255, 0xe3/255, 0x89/255)  # Green
+        if self.speed_ranges.covers(position):
+            return (0x62/255, 0xa0/255, 0xea/255)  # Blue
+        if self.inserted_ranges.covers(position):
+            return (0x57/255, 0xe3/255, 0x89/255)  # Green
         return self.playhead_color
 
     def draw_rounded_rectangle(self, cr, x, y, width, height, radius):
@@ -358,6 +353,9 @@ class FrameLine(Gtk.Widget):
             gesture.set_state(Gtk.EventSequenceState.CLAIMED)
             self.last_clicked_handle = 'right'
             self.grab_focus()
+        elif min(left_handle_x, right_handle_x) < x < max(left_handle_x, right_handle_x):
+            # A click between the handles moves the playhead to that frame
+            self.editor.seek_to_frame(int(round(self.position_to_value(x, width))) - 1)
 
         # Clear any existing menu state
         self.menu_active = False
@@ -559,7 +557,7 @@ class FrameLine(Gtk.Widget):
     
     def on_duplicate_range_clicked(self, button):
         """Duplicate the selected range of frames in the editor, inserting them after the current range.
-        Also updates speed_ranges and removed_ranges as needed."""
+        Speed, removed and inserted ranges follow from the timeline."""
         if not self.editor:
             return
         
@@ -573,76 +571,17 @@ class FrameLine(Gtk.Widget):
         start_idx = start - 1
         end_idx = end - 1
 
-        # Get the frames and durations to duplicate
-        frames_to_duplicate = self.editor.frames[start_idx:end_idx+1]
-        durations_to_duplicate = self.editor.frame_durations[start_idx:end_idx+1]
-        if not frames_to_duplicate:
-            return
-
-        num_new_frames = len(frames_to_duplicate)
+        # The copies refer to the same frames, are marked inserted and keep their speed,
+        # ranges after them move along with the timeline
         insert_idx = end_idx + 1
-
-        # --- Update speed_ranges (shift, and duplicate overlapping) ---
-        updated_speed_ranges = []
-        for s_start, s_end, speed in self.speed_ranges:
-            if insert_idx <= s_start:
-                # Speed range is after insertion point - shift it
-                updated_speed_ranges.append((s_start + num_new_frames, s_end + num_new_frames, speed))
-            elif insert_idx > s_end:
-                # Speed range is before insertion point - keep it unchanged
-                updated_speed_ranges.append((s_start, s_end, speed))
-            else:
-                # Speed range contains insertion point - split it into two parts
-                if s_start < insert_idx:
-                    # Keep the part before insertion
-                    updated_speed_ranges.append((s_start, insert_idx - 1, speed))
-                # Keep the part after insertion (shifted by the number of new frames)
-                updated_speed_ranges.append((insert_idx + num_new_frames, s_end + num_new_frames, speed))
-
-        # Duplicate speed ranges that overlap the duplicated range
-        for s_start, s_end, speed in self.speed_ranges:
-            overlap_start = max(s_start, start_idx)
-            overlap_end = min(s_end, end_idx)
-            if overlap_start <= overlap_end:
-                # The duplicated range overlaps this speed range
-                dup_start = insert_idx + (overlap_start - start_idx)
-                dup_end = insert_idx + (overlap_end - start_idx)
-                updated_speed_ranges.append((dup_start, dup_end, speed))
-
-        self.speed_ranges = updated_speed_ranges
-
-        # --- Update removed_ranges (shift ranges after insertion) ---
-        for i, r in enumerate(self.removed_ranges):
-            if r[0] >= insert_idx:
-                self.removed_ranges[i] = (r[0] + num_new_frames, r[1] + num_new_frames)
-
-        # --- Update inserted_ranges (shift ranges after insertion) ---
-        updated_inserted_ranges = []
-        for start, end in self.inserted_ranges:
-            if start > insert_idx:
-                # Range is after insertion point - shift it
-                updated_inserted_ranges.append((start + num_new_frames, end + num_new_frames))
-            elif end < insert_idx:
-                # Range is before insertion point - keep it unchanged
-                updated_inserted_ranges.append((start, end))
-            else:
-                # Range overlaps insertion point - split or shift as needed
-                # For simplicity, shift the part after insertion
-                if start < insert_idx:
-                    updated_inserted_ranges.append((start, insert_idx - 1))
-                updated_inserted_ranges.append((insert_idx + num_new_frames, end + num_new_frames))
-        self.inserted_ranges = updated_inserted_ranges
-        # Update inserted_ranges for visual feedback
-        self.inserted_ranges.append((insert_idx+1, insert_idx+len(frames_to_duplicate)))
-
-        # Insert duplicated frames immediately after the range
-        self.editor.frames[insert_idx:insert_idx] = [f.copy() for f in frames_to_duplicate]
-        self.editor.frame_durations[insert_idx:insert_idx] = durations_to_duplicate[:]
+        if not self.timeline.duplicate(start_idx, end_idx, insert_idx):
+            return
         self.max_value = len(self.editor.frames)
 
         self.queue_draw()
         self.editor.display_frame(insert_idx)
         self.editor.update_info_label()
+        self.editor.record_edit()
         self.popup_menu.popdown()
 
     def on_duplicate_frame_clicked(self, button):
@@ -654,56 +593,73 @@ class FrameLine(Gtk.Widget):
         start_idx = int(start) - 1
         end_idx = int(end) - 1
         
-        # Add to removed ranges
-        self.removed_ranges.append((start_idx, end_idx))
-        
-        # Sort and merge overlapping ranges
-        self.removed_ranges.sort()
-        merged = []
-        for range_start, range_end in self.removed_ranges:
-            if not merged or merged[-1][1] + 1 < range_start:
-                merged.append([range_start, range_end])
-            else:
-                merged[-1][1] = max(merged[-1][1], range_end)
-        self.removed_ranges = [tuple(x) for x in merged]
-        
-        # Update speed ranges to exclude removed frames
-        new_speed_ranges = []
-        for speed_start, speed_end, speed in self.speed_ranges:
-            # Keep ranges that don't overlap with removed range
-            if not (speed_start <= end_idx and speed_end >= start_idx):
-                new_speed_ranges.append((speed_start, speed_end, speed))
-            else:
-                # Split range if necessary
-                if speed_start < start_idx:
-                    new_speed_ranges.append((speed_start, start_idx - 1, speed))
-                if speed_end > end_idx:
-                    new_speed_ranges.append((end_idx + 1, speed_end, speed))
-        self.speed_ranges = new_speed_ranges
+        # Mark the frames removed, which also drops their speed change
+        self.timeline.remove(start_idx, end_idx)
         
         # Reset handles and emit signal
         self.left_value = self.min_value
         self.right_value = self.max_value
         self.emit('frames-changed', self.left_value, self.right_value)
+        if self.editor:
+            self.editor.record_edit()
         
         self.queue_draw()
 
     def is_frame_removed(self, frame_index):
         """Check if a frame index is within any removed range"""
-        frame_index = int(frame_index)
-        for start, end in self.removed_ranges:
-            if start <= frame_index <= end:
-                return True
-        return False
+        return self.removed_ranges.covers(int(frame_index))
 
     def get_next_valid_frame(self, current_frame, direction=1):
         """Get next valid frame index, skipping removed ranges
         direction: 1 for forward, -1 for reverse"""
-        next_frame = current_frame + direction
-        while 0 <= next_frame < self.max_value and self.is_frame_removed(next_frame):
-            next_frame += direction
+        next_frame = self.removed_ranges.next_uncovered(current_frame + direction, direction)
         return next_frame if 0 <= next_frame < self.max_value else -1
 
+    @property
+    def timeline(self):
+        return self.editor.timeline if self.editor is not None else self._timeline
+
+    @property
+    def removed_ranges(self):
+        """0-based (start, end) of removed frames"""
+        return self.timeline.removed_ranges
+
+    @removed_ranges.setter
+    def removed_ranges(self, ranges):
+        timeline = self.timeline
+        timeline.mark(0, len(timeline) - 1, removed=False)
+        for start, end in ranges:
+            timeline.remove(start, end)
+
+    @property
+    def inserted_ranges(self):
+        """1-based (start, end) of inserted frames, like the handle values"""
+        timeline = self.timeline
+        cached_timeline, version, ranges = self._inserted_ranges
+        if cached_timeline is not timeline or version != timeline.version:
+            ranges = RangeList((start + 1, end + 1) for start, end in timeline.inserted_ranges)
+            self._inserted_ranges = (timeline, timeline.version, ranges)
+        return ranges
+
+    @inserted_ranges.setter
+    def inserted_ranges(self, ranges):
+        timeline = self.timeline
+        timeline.mark(0, len(timeline) - 1, inserted=False)
+        for start, end in ranges:
+            timeline.mark(start - 1, end - 1, inserted=True)
+
+    @property
+    def speed_ranges(self):
+        """0-based (start, end, speed) of frames played at another speed"""
+        return self.timeline.speed_ranges
+
+    @speed_ranges.setter
+    def speed_ranges(self, ranges):
+        timeline = self.timeline
+        timeline.mark(0, len(timeline) - 1, speed=1.0)
+        for start, end, speed in ranges:
+            timeline.set_speed(start, end, speed)
+
 
     def on_insert_frames_clicked(self, button):
         """Handle insert frames button click"""
@@ -843,16 +799,6 @@ class FrameLine(Gtk.Widget):
                 # Mimic on_speed_selected logic
                 start = min(self.left_value, self.right_value)
                 end = max(self.left_value, self.right_value)
-                self.speed_ranges.append((int(start) - 1, int(end) - 1, value))
-                self.speed_ranges.sort()
-                merged = []
-                for range_start, range_end, speed in self.speed_ranges:
-                    if not merged or merged[-1][1] + 1 < range_start:
-                        merged.append([range_start, range_end, speed])
-                    else:
-                        merged[-1][1] = max(merged[-1][1], range_end)
-                        merged[-1][2] = speed
-                self.speed_ranges = [tuple(x) for x in merged]
                 self.emit('speed-changed', start, end, value)
                 # Close the popover
                 widget = entry
@@ -891,21 +837,7 @@ class FrameLine(Gtk.Widget):
         start = min(self.left_value, self.right_value)
         end = max(self.left_value, self.right_value)
         
-        # Add to speed ranges
-        self.speed_ranges.append((int(start) - 1, int(end) - 1, speed_factor))
-        
-        # Sort and merge overlapping ranges
-        self.speed_ranges.sort()
-        merged = []
-        for range_start, range_end, speed in self.speed_ranges:
-            if not merged or merged[-1][1] + 1 < range_start:
-                merged.append([range_start, range_end, speed])
-            else:
-                merged[-1][1] = max(merged[-1][1], range_end)
-                merged[-1][2] = speed  # Use the most recent speed for overlapping ranges
-        self.speed_ranges = [tuple(x) for x in merged]
-        
-        # Emit the speed-changed signal
+        # Emit the speed-changed signal, the editor sets the speed in the timeline
         self.emit('speed-changed', start, end, speed_factor)
         
         # Close the speed selection popover
@@ -944,8 +876,8 @@ class FrameLine(Gtk.Widget):
             cr.fill()
 
     def add_speed_range(self, start, end, speed):
-        """Add a speed range"""
-        self.speed_ranges.append((start, end, speed))
+        """Add a speed range, the latest speed wins where ranges overlap"""
+        self.timeline.set_speed(start, end, speed)
 
     def update_theme(self, is_dark):
         """Update theme colors"""
@@ -1042,13 +974,6 @@ class FrameLine(Gtk.Widget):
         normalized_pos = max(0, min(1, (position - self.HANDLE_RADIUS) / usable_width))
         return self.min_value + normalized_pos * (self.max_value - self.min_value)
 
-    def is_frame_removed(self, frame_index):
-        """Internal method to check if a frame is in a removed range"""
-        for start, end in self.removed_ranges:
-            if start <= frame_index <= end:
-                return True
-        return False
-
     def show_playhead(self):
         """Show the playhead"""
         self.playhead_visible = True
@@ -0,0 +1,376 @@
+import os
+import mmap
+import tempfile
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from PIL import Image
+
+from fig.gifindex import FrameInfo, read_header, disposal_method
+from fig.decoder import FrameCursor, Checkpoints
+from fig.indexed import IndexedFrame, pack, unpack, share, frame_nbytes
+from fig.timeline import Timeline
+
+# Default byte budget for decoded frames kept in memory
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+# Default limit for frames spilled to the scratch file on disk
+DEFAULT_SPILL_BYTES = 4 * 1024 * 1024 * 1024
+# The scratch file is mapped in chunks of this size
+SPILL_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def cache_dir():
+    """Directory for fig's cache files, following the XDG base directory spec"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'fig')
+
+
+class SpillFile:
+    """
+    Append-only scratch file holding frame pixels, read back through mmap.
+
+    The file is unlinked on creation, so nothing is left behind if the
+    editor dies. Views handed out share the mapped pages, which leaves it
+    to the OS page cache which frames stay resident.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_SPILL_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self._file = tempfile.TemporaryFile(prefix='spill-', dir=directory)
+        self._maps = []
+        self._used = 0  # Bytes used in the last chunk
+        self.size = 0  # Bytes mapped in total
+        self.max_bytes = max_bytes
+
+    def write(self, data):
+        """
+        Store bytes and return their location, or None once the file is full.
+        Raises OSError when the disk has no room for another chunk.
+        """
+        length = len(data)
+        if not self._maps or self._used + length > len(self._maps[-1]):
+            granularity = mmap.ALLOCATIONGRANULARITY
+            chunk = max(SPILL_CHUNK_BYTES, -(-length // granularity) * granularity)
+            if self.size + chunk > self.max_bytes:
+                return None
+            if hasattr(os, 'posix_fallocate'):
+                # Reserve the blocks up front, writing to pages of a sparse
+                # file on a full disk kills the process with SIGBUS
+                os.posix_fallocate(self._file.fileno(), self.size, chunk)
+            else:
+                self._file.truncate(self.size + chunk)
+            self._maps.append(mmap.mmap(self._file.fileno(), chunk, offset=self.size))
+            self.size += chunk
+            self._used = 0
+
+        start = self._used
+        self._maps[-1][start:start + length] = data
+        self._used += length
+        return len(self._maps) - 1, start, length
+
+    def view(self, location):
+        """Zero-copy memoryview of stored bytes"""
+        chunk, start, length = location
+        return memoryview(self._maps[chunk])[start:start + length]
+
+    def close(self):
+        for chunk in self._maps:
+            try:
+                chunk.close()
+            except BufferError:
+                pass  # Still viewed by a frame, unmapped once that is gone
+        self._maps = []
+        self._file.close()
+
+
+class FrameStore(Sequence):
+    """
+    Frame sequence of a GIF that decodes pixels on demand.
+
+    Entries are either FrameInfo records pointing into the source file or
+    already materialised frames (inserted images, edited frames). Source
+    frames are decoded when indexed and kept in an LRU cache bounded by
+    cache_bytes, so memory use does not grow with the length of the GIF.
+    Random access resumes decoding from the nearest keyframe, or from a
+    closer checkpoint: canvases pinned every few frames while decoding,
+    which eviction leaves alone, so seeking back in a GIF without keyframes
+    never starts over at its first frame.
+
+    Decoded and stored PIL images are kept palette-indexed whenever that is
+    lossless and only expanded to RGBA when a frame is read. Frames evicted
+    from the cache are spilled to a memory-mapped scratch file when
+    spill_bytes allows it, and read back from there without decoding.
+
+    The order of the entries is kept by a Timeline, which the editor edits
+    directly. Entries are immutable handles. Duplicating frames only adds
+    references to them, and images read from the store are copy-on-write
+    views, so pixels are copied only once a frame is actually edited.
+    """
+
+    def __init__(self, file_path, convert=None, cache_bytes=DEFAULT_CACHE_BYTES,
+                 spill_bytes=DEFAULT_SPILL_BYTES, timeline=None):
+        self.file_path = file_path
+        self.convert = convert  # Turns a decoded RGBA PIL image into a display frame
+        self.cache_bytes = cache_bytes
+        self.spill_bytes = spill_bytes
+
+        self.timeline = timeline if timeline is not None else Timeline()
+        self.sources = []  # FrameInfo of every source frame, by source index
+        self._keyframes = []
+        self._methods = []  # Disposal method in effect after every source frame
+        self._cache = OrderedDict()  # source index -> (frame, nbytes)
+        self._cache_size = 0
+        # Canvases to resume decoding from, a quarter of the memory budget at most
+        self.checkpoints = Checkpoints(max_bytes=cache_bytes // 4)
+        self._cursor = None
+        self._persistent = None  # CachedFrames of a GIF opened before
+        self._spill = None
+        self._spilled = {}  # source index -> (location, mode, size, palette, info)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.timeline)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        image = self.image(index)
+        if self.convert and isinstance(image, Image.Image):
+            return self.convert(image)
+        return image
+
+    def image(self, index):
+        """RGBA PIL image of a frame, without converting it for display"""
+        return self.entry_image(self.timeline[index])
+
+    def entry_image(self, entry):
+        """RGBA PIL image of a stored entry, safe to call from worker threads"""
+        if isinstance(entry, FrameInfo):
+            entry = self._get_source_frame(entry.index)
+        return unpack(entry)
+
+    def frame(self, index):
+        """Packed frame at a timeline position, see entry_frame"""
+        return self.entry_frame(self.timeline[index])
+
+    def entry_frame(self, entry):
+        """
+        Stored entry as an IndexedFrame or a read-only RGBA image, without
+        expanding it. Transform works on either.
+        """
+        if isinstance(entry, FrameInfo):
+            entry = self._get_source_frame(entry.index)
+        return entry if isinstance(entry, IndexedFrame) else share(entry)
+
+    def segment(self, index, stop):
+        """
+        FrameCursor arguments to decode source frames [index, stop) in
+        another process, resuming where the store would. None when the
+        frames are mapped from the frame cache, reading them is cheaper.
+        """
+        if self._persistent is not None:
+            return None
+        with self._lock:
+            resume, canvas = self._closest(*self._resume(index), index)
+        # The frame before the resume point tells the cursor what it left on the canvas
+        first = max(0, resume - 1)
+        return (self.file_path, self.sources[first:stop], self._methods[first:stop],
+                self.sources[0].transparency, resume, canvas)
+
+    def entries(self, start, stop):
+        """Stored entries of [start, stop), without decoding them"""
+        return self.timeline.entries(start, stop)
+
+    def insert_frames(self, index, entries, durations=None, inserted=False, source=None):
+        """Add frames to the timeline, by default with the durations of source frames"""
+        entries = [self._register(entry) for entry in entries]
+        if durations is None:
+            durations = [getattr(entry, 'duration', 0) for entry in entries]
+        self.timeline.insert(index, entries, durations, inserted, source)
+
+    def insert(self, index, value):
+        self.insert_frames(index, [value])
+
+    def append(self, value):
+        self.insert_frames(len(self), [value])
+
+    def extend(self, values):
+        self.insert_frames(len(self), values)
+
+    def _register(self, entry):
+        """Record source frames the first time they enter the store, pack images"""
+        if isinstance(entry, FrameInfo):
+            if entry.index == len(self.sources):
+                self.sources.append(entry)
+                previous = self._methods[-1] if self._methods else 0
+                self._methods.append(disposal_method(entry.disposal, entry.index, previous))
+                if entry.keyframe:
+                    self._keyframes.append(entry.index)
+        elif isinstance(entry, Image.Image) and not (entry.readonly and entry.mode == 'RGBA'):
+            # Stored images are never written to, so entering the store again
+            # (duplicating a range) only adds a reference
+            entry = pack(entry.convert('RGBA'))
+            if isinstance(entry, Image.Image):
+                entry.readonly = 1
+        return entry
+
+    def global_palette(self):
+        """Global color table of the GIF if every source frame uses it, else None"""
+        if not self.sources or any(info.palette for info in self.sources):
+            return None
+        _, palette = read_header(self.file_path)
+        return palette or None
+
+    def cache_capacity(self, frame_size):
+        """Number of frames of the given size that fit in the cache budget"""
+        return max(1, self.cache_bytes // (frame_size[0] * frame_size[1] * 4))
+
+    def prime(self, index, image):
+        """Put an already decoded source frame into the cache"""
+        with self._lock:
+            if index not in self._cache and index not in self._spilled:
+                self._put(index, image)
+
+    def attach_cache(self, cached):
+        """Serve source frames from a persistent cache entry instead of decoding them"""
+        with self._lock:
+            self._persistent = cached
+
+    def clear(self):
+        self.timeline.clear()
+        self.close()
+
+    def close(self):
+        """Drop cached frames and release the source file"""
+        with self._lock:
+            self._cache.clear()
+            self._cache_size = 0
+            self.checkpoints.clear()
+            self._spilled.clear()
+            if self._persistent is not None:
+                self._persistent.close()
+                self._persistent = None
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            if self._cursor is not None:
+                self._cursor.close()
+                self._cursor = None
+
+    def _get_source_frame(self, index):
+        with self._lock:
+            cached = self._cache.get(index)
+            if cached is not None:
+                self._cache.move_to_end(index)
+                return cached[0]
+            if index in self._spilled:
+                return self._load_spilled(index)
+            if self._persistent is not None and index < len(self._persistent):
+                return self._persistent.frame(index)
+            return self._decode(index)
+
+    def _decode(self, index):
+        """Decode a source frame, keeping the frames passed on the way nearby"""
+        start, canvas = self._resume(index)
+        cursor = self._cursor
+        # Cursors only move forward, going back or far ahead restarts at a checkpoint
+        if cursor is None or not start - 1 <= cursor.position <= index:
+            if cursor is not None:
+                cursor.close()
+            cursor = self._cursor = self._open_cursor(start, canvas, index)
+
+        frame_bytes = cursor.size[0] * cursor.size[1] * 4
+        keep_from = index - max(1, self.cache_bytes // (2 * frame_bytes))
+        while True:
+            current = cursor.position
+            # Restoring to previous after the frame would need the canvas before it
+            if self._methods[current] != 3 and self.checkpoints.due(current):
+                self.checkpoints.add(current, cursor.image())
+            if current == index:
+                return self._put(index, cursor.image())
+            if current >= keep_from and current not in self._cache and current not in self._spilled:
+                self._put(current, cursor.image())
+            cursor.seek(current + 1)
+
+    def _resume(self, index):
+        """Source index to start decoding frame index at, with the canvas left before it or None"""
+        keyframe = self._keyframes[bisect_right(self._keyframes, index) - 1]
+        checkpoint = self.checkpoints.before(index)
+        if checkpoint >= keyframe:
+            canvas = self.checkpoints.canvas(checkpoint)
+            if canvas is not None:  # Not thinned out in the meantime
+                return checkpoint + 1, canvas
+        return keyframe, None
+
+    def _open_cursor(self, start, canvas, index):
+        """Start decoding at the checkpoint closest before index"""
+        start, canvas = self._closest(start, canvas, index)
+        return FrameCursor(self.file_path, self.sources, self._methods, start,
+                           self.sources[0].transparency, canvas)
+
+    def _closest(self, start, canvas, index):
+        """Resume point closer to index than (start, canvas), when a frame on the way is stored"""
+        # A stored frame after the resume point is an even closer checkpoint,
+        # unless the next frame restores the canvas from before it
+        for checkpoint in range(index - 1, start - 1, -1):
+            if self._methods[checkpoint] == 3:
+                continue
+            if checkpoint in self._cache:
+                frame = self._cache[checkpoint][0]
+            elif checkpoint in self._spilled:
+                frame = self._load_spilled(checkpoint)
+            else:
+                continue
+            canvas = frame.image if isinstance(frame, IndexedFrame) else frame
+            start = checkpoint + 1
+            break
+        return start, canvas
+
+    def _put(self, index, image):
+        frame = pack(image)
+        nbytes = frame_nbytes(frame)
+        self._cache[index] = (frame, nbytes)
+        self._cache_size += nbytes
+        while self._cache_size > self.cache_bytes and len(self._cache) > 1:
+            evicted, (evicted_frame, evicted_bytes) = self._cache.popitem(last=False)
+            self._cache_size -= evicted_bytes
+            self._spill_frame(evicted, evicted_frame)
+        return frame
+
+    def _spill_frame(self, index, frame):
+        """Write an evicted frame to the scratch file so it need not be decoded again"""
+        if not self.spill_bytes or index in self._spilled:
+            return
+        if self._spill is None:
+            try:
+                self._spill = SpillFile(cache_dir(), self.spill_bytes)
+            except OSError as e:
+                print(f"Error creating frame spill file: {e}")
+                self.spill_bytes = 0
+                return
+
+        image = frame.image if isinstance(frame, IndexedFrame) else frame
+        try:
+            location = self._spill.write(image.tobytes())
+        except OSError as e:
+            # Out of disk space, frames evicted from now on are decoded again
+            print(f"Error spilling frame: {e}")
+            self.spill_bytes = 0
+            return
+        if location is None:
+            return  # Spill file is full, the frame will be decoded again
+        palette = image.getpalette() if image.mode == 'P' else None
+        self._spilled[index] = (location, image.mode, image.size, palette, dict(image.info))
+
+    def _load_spilled(self, index):
+        """Build a frame over the scratch file pages of a spilled frame"""
+        location, mode, size, palette, info = self._spilled[index]
+        image = Image.frombuffer(mode, size, self._spill.view(location), 'raw', mode, 0, 1)
+        if palette is not None:
+            image.putpalette(palette)
+            image.info.update(info)
+            return IndexedFrame(image)
+        return image
+
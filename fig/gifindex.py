@@ -0,0 +1,194 @@
+import os
+import mmap
+from collections import namedtuple
+
+# Block index of one frame, read without touching its pixels.
+#   duration      display time in milliseconds
+#   offset        first byte of the frame (its Graphic Control Extension, or
+#                 the image descriptor when there is none)
+#   keyframe      True when decoding can resume at the frame without the
+#                 frames before it: it paints every pixel of the canvas, or
+#                 the frame before it cleared the whole canvas
+#   descriptor    offset of the image descriptor
+#   data          offset of the LZW minimum code size byte
+#   end           offset just past the LZW data terminator
+#   left..height  sub-rectangle of the canvas the frame covers
+#   disposal      disposal method from the GCE (0 when there is none)
+#   transparency  transparent palette index, or None
+#   palette       offset of the local color table, or 0 for the global one
+#   palette_size  size in bytes of the local color table
+#   interlaced    True when rows are stored interlaced
+FrameInfo = namedtuple('FrameInfo', [
+    'index', 'duration', 'offset', 'keyframe',
+    'descriptor', 'data', 'end',
+    'left', 'top', 'width', 'height',
+    'disposal', 'transparency', 'palette', 'palette_size', 'interlaced',
+])
+
+# Logical screen of a GIF.
+#   length        bytes of header, logical screen descriptor and global color table
+#   palette_size  size in bytes of the global color table, 0 when there is none
+GifHeader = namedtuple('GifHeader', ['width', 'height', 'background', 'palette_size', 'length'])
+
+# Metadata of a whole GIF, gathered without decoding any pixels.
+#   durations     display time of every frame in milliseconds
+#   duration      total display time in milliseconds
+#   loop          NETSCAPE2.0 loop count, 0 loops forever, None when absent
+#   frames        FrameInfo of every frame
+GifProbe = namedtuple('GifProbe', ['width', 'height', 'frame_count', 'durations', 'duration',
+                                   'loop', 'frames'])
+
+DEFAULT_DURATION = 100
+
+
+def _skip_sub_blocks(buf, pos):
+    """Skip a chain of data sub-blocks and return the position after the terminator"""
+    while True:
+        size = buf[pos]
+        pos += 1
+        if size == 0:
+            return pos
+        pos += size
+
+
+def parse_header(data):
+    """Parse the first 13 bytes of a GIF into a GifHeader"""
+    if len(data) < 13 or data[:6] not in (b'GIF87a', b'GIF89a'):
+        raise ValueError("not a GIF file")
+    flags = data[10]
+    palette_size = 3 << ((flags & 7) + 1) if flags & 0x80 else 0
+    return GifHeader(
+        data[6] | (data[7] << 8),
+        data[8] | (data[9] << 8),
+        data[11],
+        palette_size,
+        13 + palette_size)
+
+
+def read_header(file_path):
+    """Return the GifHeader and the global color table of a GIF file"""
+    with open(file_path, 'rb') as f:
+        header = parse_header(f.read(13))
+        palette = f.read(header.palette_size)
+    return header, palette
+
+
+def iter_frames(file_path, meta=None):
+    """
+    Walk the GIF block structure and yield a FrameInfo for every frame.
+
+    Only block headers are read; LZW data is skipped by its sub-block lengths,
+    so this is cheap even for very long GIFs. A truncated file simply ends
+    the iteration, the same way Pillow tolerates it. When a meta dict is
+    given, the loop count is stored in it under 'loop' once it is read.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < 13:
+            raise ValueError("not a GIF file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            header = parse_header(buf[:13])
+            pos = header.length
+
+            index = 0
+            method = 0  # Disposal in effect, a frame without one keeps the previous
+            cleared = False  # The previous frame's disposal clears the whole canvas
+            duration = None
+            disposal = 0
+            transparency = None
+            frame_start = None
+            try:
+                while True:
+                    block = buf[pos]
+                    if block == 0x21:  # Extension
+                        label = buf[pos + 1]
+                        if label == 0xF9 and buf[pos + 2] >= 4:
+                            if frame_start is None:
+                                frame_start = pos
+                            # Graphic Control Extension, delay in 1/100 s
+                            flags = buf[pos + 3]
+                            duration = (buf[pos + 4] | (buf[pos + 5] << 8)) * 10
+                            disposal = (flags >> 2) & 7
+                            transparency = buf[pos + 6] if flags & 1 else None
+                        elif (label == 0xFF and meta is not None and buf[pos + 2] == 11
+                              and buf[pos + 3:pos + 14] == b'NETSCAPE2.0'
+                              and buf[pos + 14] >= 3 and buf[pos + 15] == 1):
+                            # Application extension with the loop count sub-block
+                            meta['loop'] = buf[pos + 16] | (buf[pos + 17] << 8)
+                        pos = _skip_sub_blocks(buf, pos + 2)
+                    elif block == 0x2C:  # Image descriptor
+                        if frame_start is None:
+                            frame_start = pos
+                        descriptor = pos
+                        left = buf[pos + 1] | (buf[pos + 2] << 8)
+                        top = buf[pos + 3] | (buf[pos + 4] << 8)
+                        width = buf[pos + 5] | (buf[pos + 6] << 8)
+                        height = buf[pos + 7] | (buf[pos + 8] << 8)
+                        flags = buf[pos + 9]
+                        pos += 10
+                        palette = palette_size = 0
+                        if flags & 0x80:
+                            palette = pos
+                            palette_size = 3 << ((flags & 7) + 1)
+                            pos += palette_size
+                        # LZW minimum code size, then the image data
+                        data = pos
+                        pos = _skip_sub_blocks(buf, pos + 1)
+
+                        # Restoring to previous after a frame needs the canvas before it,
+                        # so such a frame cannot be a keyframe either, unless that
+                        # canvas was cleared
+                        method = disposal_method(disposal, index, method)
+                        covers_canvas = (left, top, width, height) == (0, 0, header.width, header.height)
+                        keyframe = index == 0 or cleared or (
+                            covers_canvas and transparency is None and method != 3)
+                        cleared = covers_canvas and method == 2
+                        yield FrameInfo(
+                            index,
+                            duration if duration is not None else DEFAULT_DURATION,
+                            frame_start,
+                            keyframe,
+                            descriptor, data, pos,
+                            left, top, width, height,
+                            disposal, transparency, palette, palette_size,
+                            bool(flags & 0x40))
+                        index += 1
+                        duration = None
+                        disposal = 0
+                        transparency = None
+                        frame_start = None
+                    else:  # Trailer or garbage
+                        break
+            except IndexError:
+                pass
+
+
+def disposal_method(disposal, index, previous):
+    """
+    Disposal method in effect after frame index, given the one in effect
+    before it. Like Pillow, a frame without a disposal method keeps the one
+    of the frame before it, starting over at frame 0.
+    """
+    return disposal or (previous if index else 0)
+
+
+def disposal_methods(frames):
+    """Disposal method in effect after every FrameInfo of a GIF"""
+    methods = []
+    for info in frames:
+        methods.append(disposal_method(info.disposal, info.index, methods[-1] if methods else 0))
+    return methods
+
+
+def scan_frames(file_path):
+    """Return the FrameInfo list of a GIF file"""
+    return list(iter_frames(file_path))
+
+
+def probe(file_path):
+    """Return the GifProbe of a GIF file, reading only its block headers"""
+    header, _ = read_header(file_path)
+    meta = {'loop': None}
+    frames = list(iter_frames(file_path, meta))
+    durations = [info.duration for info in frames]
+    return GifProbe(header.width, header.height, len(frames), durations, sum(durations),
+                    meta['loop'], frames)
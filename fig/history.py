@@ -0,0 +1,89 @@
+import sys
+
+# Default memory cap for the metadata held by undo history
+DEFAULT_HISTORY_BYTES = 64 * 1024 * 1024
+
+
+def _nbytes(value):
+    """Approximate size of a snapshot field, without the frames it refers to"""
+    size = sys.getsizeof(value)
+    if isinstance(value, tuple):
+        size += sum(_nbytes(item) for item in value if isinstance(item, tuple))
+    return size
+
+
+class History:
+    """
+    Undo/redo stack of editor state snapshots.
+
+    A snapshot is a dict of immutable values (tuples, Transforms) that
+    only refer to frames, so recording one never copies pixels. Fields equal
+    to the ones in the snapshot before are replaced by that very object,
+    which makes every entry cost just the metadata its edit changed. The
+    oldest entries are dropped once their unshared fields exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_HISTORY_BYTES):
+        self.max_bytes = max_bytes
+        self._undo = []  # (snapshot, nbytes), the last one is the current state
+        self._redo = []
+        self._size = 0
+
+    def reset(self, snapshot):
+        """Forget all history and start from snapshot"""
+        self._undo = [(dict(snapshot), 0)]
+        self._redo = []
+        self._size = 0
+
+    def push(self, snapshot):
+        """Record the state after an edit, returns False when nothing changed"""
+        if not self._undo:
+            self.reset(snapshot)
+            return False
+        current = self._undo[-1][0]
+        shared = {}
+        nbytes = 0
+        for key, value in snapshot.items():
+            if key in current and current[key] == value:
+                shared[key] = current[key]
+            else:
+                shared[key] = value
+                nbytes += _nbytes(value)
+        if nbytes == 0:
+            return False
+
+        self._undo.append((shared, nbytes))
+        self._size += nbytes
+        self._redo = []
+        # Forget the oldest states, every snapshot is complete on its own.
+        # The current state and the one before it stay even when over the cap.
+        while self._size > self.max_bytes and len(self._undo) > 2:
+            _, dropped = self._undo.pop(0)
+            self._size -= dropped
+        return True
+
+    def undo(self):
+        """Step back, returns the snapshot to restore or None"""
+        if not self.can_undo:
+            return None
+        entry = self._undo.pop()
+        self._size -= entry[1]
+        self._redo.append(entry)
+        return self._undo[-1][0]
+
+    def redo(self):
+        """Step forward again, returns the snapshot to restore or None"""
+        if not self.can_redo:
+            return None
+        entry = self._redo.pop()
+        self._size += entry[1]
+        self._undo.append(entry)
+        return entry[0]
+
+    @property
+    def can_undo(self):
+        return len(self._undo) > 1
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
@@ -2,6 +2,7 @@ import os
 import gi
 gi.require_version('Gtk', '4.0')
 from gi.repository import Gtk, Gio, GLib, Adw
+from fig.project import PROJECT_EXTENSION
 
 
 class HomeBox(Gtk.Box):
@@ -50,12 +51,17 @@ class HomeBox(Gtk.Box):
             filter_gif.set_name("GIF files")
             filter_gif.add_mime_type("image/gif")
             
+            filter_fig = Gtk.FileFilter()
+            filter_fig.set_name("Fig projects")
+            filter_fig.add_pattern(f"*{PROJECT_EXTENSION}")
+
             filter_all = Gtk.FileFilter()
             filter_all.set_name("All files")
             filter_all.add_pattern("*")
             
             filters = Gio.ListStore.new(Gtk.FileFilter)
             filters.append(filter_gif)
+            filters.append(filter_fig)
             filters.append(filter_all)
             dialog.set_filters(filters)
             dialog.set_default_filter(filter_gif)
@@ -79,6 +85,9 @@ class HomeBox(Gtk.Box):
             if file:
                 file_path = file.get_path()
                 window = self.get_root()
+                if file_path.lower().endswith(PROJECT_EXTENSION):
+                    window.open_project(file_path)
+                    return
                 window.load_editor_ui()
                 window.editor_box.overlay.reset_crop_rect()
                 window.editor_box.load_gif(file_path)
@@ -0,0 +1,111 @@
+from PIL import Image, ImageChops
+
+
+class IndexedFrame:
+    """
+    Frame kept as 1-byte palette indices plus its palette.
+
+    GIF frames never show more than 256 colors at once and their alpha is
+    either fully opaque or fully transparent, so they fit a P-mode image
+    without losing anything. Expanding to RGBA only happens when the frame
+    is shown or composited, and geometric edits run on the index buffer.
+    """
+
+    __slots__ = ('image',)
+
+    def __init__(self, image):
+        self.image = image  # P-mode PIL image, transparency index in image.info
+
+    @classmethod
+    def from_image(cls, image):
+        """Losslessly pack an image, or return None when it does not fit a palette"""
+        if image.mode == 'P':
+            return cls(image.copy())
+
+        transparent = False
+        if image.mode == 'RGBA':
+            alpha = image.getchannel('A')
+            if alpha.getextrema()[0] != 255:
+                # Partial transparency has no palette equivalent
+                if {value for _, value in alpha.getcolors(256)} - {0, 255}:
+                    return None
+                transparent = True
+        rgb = image.convert('RGB')
+
+        # Reserve one slot for the transparent index
+        colors = rgb.getcolors(255 if transparent else 256)
+        if colors is None:
+            return None
+        palette = []
+        for _, color in colors:
+            palette.extend(color)
+        palette_image = Image.new('P', (1, 1))
+        palette_image.putpalette(palette)
+        indexed = rgb.quantize(palette=palette_image, dither=Image.Dither.NONE)
+        # Pillow looks colors up in a reduced precision cache, close colors can collide
+        if ImageChops.difference(indexed.convert('RGB'), rgb).getbbox():
+            return None
+
+        if transparent:
+            index = len(colors)
+            indexed.putpalette(palette + [0, 0, 0])
+            indexed.paste(index, mask=alpha.point(lambda a: 255 - a))
+            indexed.info['transparency'] = index
+        return cls(indexed)
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def nbytes(self):
+        width, height = self.image.size
+        return width * height + 768
+
+    def to_rgba(self):
+        """Expand to an RGBA image"""
+        return self.image.convert('RGBA')
+
+    def transpose(self, method):
+        """Flip or rotate the index buffer, keeping the palette"""
+        image = self.image.transpose(method)
+        image.info.update(self.image.info)
+        return IndexedFrame(image)
+
+    def crop(self, box):
+        image = self.image.crop(box)
+        image.info.update(self.image.info)
+        return IndexedFrame(image)
+
+
+def pack(image):
+    """Return the most compact lossless representation of an RGBA image"""
+    return IndexedFrame.from_image(image) or image
+
+
+def unpack(frame):
+    """Return the RGBA image of a packed frame, never the stored image itself"""
+    if isinstance(frame, IndexedFrame):
+        return frame.to_rgba()
+    return share(frame)
+
+
+def share(image):
+    """
+    New image object over the same pixels, copied on its first write.
+
+    Pillow copies a read-only image's pixels before drawing on it, so
+    handing out shared views keeps stored frames immutable for free.
+    """
+    image.load()
+    view = image._new(image.im)
+    view.readonly = 1
+    return view
+
+
+def frame_nbytes(frame):
+    """Resident size of a packed frame"""
+    if isinstance(frame, IndexedFrame):
+        return frame.nbytes
+    width, height = frame.size
+    return width * height * len(frame.getbands())
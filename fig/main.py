@@ -11,6 +11,7 @@ gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, Gio, GdkPixbuf, Gdk, GLib
 import fig.home, fig.editor
 from fig.utils import clear_css, load_css
+from fig.project import PROJECT_EXTENSION
 from moviepy.video.io.ImageSequenceClip import ImageSequenceClip
 
 class Fig(Adw.ApplicationWindow):
@@ -25,6 +26,17 @@ class Fig(Adw.ApplicationWindow):
         drop_target.connect('leave', self.on_drag_leave)
         drop_target.connect('motion', self.on_drag_motion)
         self.add_controller(drop_target)
+
+        # Save options of the editor, shown as checkboxes in its menu
+        for name, value in (("shared_palette", False), ("dither", False)):
+            option_action = Gio.SimpleAction.new_stateful(name, None, GLib.Variant.new_boolean(value))
+            option_action.connect("change-state", self.on_save_option_changed)
+            self.add_action(option_action)
+
+        # Decoded frames are only kept on disk when asked to
+        frame_cache_action = Gio.SimpleAction.new_stateful("frame_cache", None, GLib.Variant.new_boolean(False))
+        frame_cache_action.connect("change-state", self.on_frame_cache_changed)
+        self.add_action(frame_cache_action)
         
         main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         self.headerbar = Adw.HeaderBar()
@@ -90,6 +102,11 @@ class Fig(Adw.ApplicationWindow):
         self.menu_model.append("New Window", "app.new_window")
         self.menu_model.append("Extract Frames", "app.extract_frames")
         self.menu_model.append("Export to Video", "app.export_to_video")
+        self.menu_model.append("Save Project", "app.save_project")
+        self.menu_model.append("Save Within Size", "app.save_within_size")
+        self.menu_model.append("Shared Palette", "win.shared_palette")
+        self.menu_model.append("Dither Colors", "win.dither")
+        self.menu_model.append("Cache Decoded Frames", "win.frame_cache")
         self.menu_model.append("Help", "app.help")
         self.menu_model.append("About", "app.about")
 
@@ -115,6 +132,9 @@ class Fig(Adw.ApplicationWindow):
         self.remove_css_class('drag-and-drop')
         if isinstance(value, Gio.File):
             file_path = value.get_path()
+            if file_path.lower().endswith(PROJECT_EXTENSION):
+                self.open_project(file_path)
+                return True
             if file_path.lower().endswith('.gif'):
                 self.load_editor_ui()
                 self.editor_box.overlay.reset_crop_rect()
@@ -128,6 +148,26 @@ class Fig(Adw.ApplicationWindow):
             
         return False
 
+    def open_project(self, file_path):
+        """Show the editor with a .fig project"""
+        self.load_editor_ui()
+        if self.editor_box.open_project(file_path):
+            self.editor_box.original_file_name = os.path.basename(file_path)[:-len(PROJECT_EXTENSION)]
+        else:
+            error_dialog = Adw.AlertDialog.new("Error", f"Failed to open project: {file_path}")
+            error_dialog.add_response("ok", "OK")
+            error_dialog.present(self)
+
+    def on_save_option_changed(self, action, value):
+        """Toggle a save option of the editor, named like the action"""
+        action.set_state(value)
+        setattr(self.editor_box, action.get_name(), value.get_boolean())
+
+    def on_frame_cache_changed(self, action, value):
+        """Keep decoded frames of opened GIFs on disk, or stop doing so"""
+        action.set_state(value)
+        self.editor_box.set_frame_cache(value.get_boolean())
+
     def on_drag_enter(self, drop_target, x, y):
         load_css(self.get_display(), [])
         self.add_css_class('drag-and-drop')
@@ -163,6 +203,25 @@ class FigApplication(Adw.Application):
         export_to_video_action.connect("activate", self.on_export_to_video)
         self.add_action(export_to_video_action)
 
+        save_within_size_action = Gio.SimpleAction.new("save_within_size", None)
+        save_within_size_action.connect("activate", self.on_save_within_size)
+        self.add_action(save_within_size_action)
+
+        save_project_action = Gio.SimpleAction.new("save_project", None)
+        save_project_action.connect("activate", self.on_save_project)
+        self.add_action(save_project_action)
+        self.set_accels_for_action("app.save_project", ["<Control>s"])
+
+        undo_action = Gio.SimpleAction.new("undo", None)
+        undo_action.connect("activate", self.on_undo)
+        self.add_action(undo_action)
+        self.set_accels_for_action("app.undo", ["<Control>z"])
+
+        redo_action = Gio.SimpleAction.new("redo", None)
+        redo_action.connect("activate", self.on_redo)
+        self.add_action(redo_action)
+        self.set_accels_for_action("app.redo", ["<Control><Shift>z", "<Control>y"])
+
     def do_activate(self):
         win = Fig(self)
         win.present()
@@ -204,6 +263,28 @@ class FigApplication(Adw.Application):
         if window:
             fig.home.show_about_dialog(window)
 
+    def on_undo(self, action, parameter):
+        window = self.get_active_window()
+        if not window:
+            return
+        # The accelerators come before the focused widget, a text entry being
+        # typed in keeps its own undo
+        text = window.get_focus()
+        if isinstance(text, Gtk.Editable):
+            text.activate_action('text.undo', None)
+        elif hasattr(window, 'editor_box'):
+            window.editor_box.undo()
+
+    def on_redo(self, action, parameter):
+        window = self.get_active_window()
+        if not window:
+            return
+        text = window.get_focus()
+        if isinstance(text, Gtk.Editable):
+            text.activate_action('text.redo', None)
+        elif hasattr(window, 'editor_box'):
+            window.editor_box.redo()
+
     def on_extract_frames(self, action, parameter):
         # Prompt user to choose output folder instead of writing to read-only source location
         window = self.get_active_window()
@@ -239,21 +320,18 @@ class FigApplication(Adw.Application):
                         def extraction_thread():
                             try:
                                 extracted = 0
-                                def process_batch(batch_info):
+                                def process_batch(start_idx, batch_frames):
                                     nonlocal extracted
-                                    start_idx, end_idx = batch_info
-                                    for i in range(start_idx, end_idx):
-                                        if isinstance(frames[i], GdkPixbuf.Pixbuf):
-                                            pil_image = window.editor_box._pixbuf_to_pil(frames[i])
-                                            frame_name = f"{window.editor_box.original_file_name}-{str(i+1).zfill(3)}.png"
-                                            frame_path = os.path.join(output_dir, frame_name)
-                                            pil_image.save(frame_path, 'PNG')
+                                    for i, pil_image in enumerate(batch_frames, start_idx):
+                                        frame_name = f"{window.editor_box.original_file_name}-{str(i+1).zfill(3)}.png"
+                                        frame_path = os.path.join(output_dir, frame_name)
+                                        pil_image.save(frame_path, 'PNG')
                                         extracted += 1
                                     GLib.idle_add(
                                         progress_dialog.set_heading,
                                         f"{int((extracted / total_frames) * 100)}%"
                                     )
-                                    return end_idx
+                                    return start_idx + len(batch_frames)
 
                                 batches = [
                                     (i, min(i + BATCH_SIZE, total_frames))
@@ -262,8 +340,18 @@ class FigApplication(Adw.Application):
 
                                 import concurrent.futures
                                 with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                                    for batch in batches:
-                                        executor.submit(process_batch, batch)
+                                    pending = []
+                                    for start_idx, end_idx in batches:
+                                        # Frames are decoded on demand, fetch them in order so the
+                                        # source is walked once, and only keep a few batches alive
+                                        if len(pending) >= 4:
+                                            pending.pop(0).result()
+                                        batch_frames = [
+                                            window.editor_box.edited_image(i)
+                                            for i in range(start_idx, end_idx)
+                                        ]
+                                        pending.append(executor.submit(
+                                            process_batch, start_idx, batch_frames))
                                     executor.shutdown(wait=True)
                                 
                                 # Extraction complete
@@ -335,6 +423,68 @@ class FigApplication(Adw.Application):
                 error_dialog.add_response("ok", "OK")
                 error_dialog.present(window)
 
+    def on_save_within_size(self, action, parameter):
+        """Ask for a size limit, then save the selected frames as a GIF that fits it"""
+        window = self.get_active_window()
+        if not window or not hasattr(window.editor_box, 'original_file_path'):
+            return
+        editor_box = window.editor_box
+
+        dialog = Adw.AlertDialog.new("Save Within Size",
+                                     "Largest file size in megabytes. The GIF is scaled down "
+                                     "and loses colors and frames as far as needed to fit.")
+        size_entry = Gtk.SpinButton.new_with_range(0.1, 1000, 0.1)
+        size_entry.set_digits(1)
+        size_entry.set_value(editor_box.size_limit / (1024 * 1024))
+        dialog.set_extra_child(size_entry)
+        dialog.add_response("cancel", "Cancel")
+        dialog.add_response("save", "Save")
+        dialog.set_response_appearance("save", Adw.ResponseAppearance.SUGGESTED)
+        dialog.set_default_response("save")
+        dialog.set_close_response("cancel")
+
+        def on_response(dialog, response_id):
+            if response_id == "save":
+                editor_box.size_limit = int(size_entry.get_value() * 1024 * 1024)
+                editor_box.save_frames(None, editor_box.size_limit)
+
+        dialog.connect("response", on_response)
+        dialog.present(window)
+
+    def on_save_project(self, action, parameter):
+        """Save the edits as a .fig project next to the source GIF"""
+        window = self.get_active_window()
+        if not window or not hasattr(window.editor_box, 'original_file_path'):
+            return
+
+        dialog = Gtk.FileDialog.new()
+        dialog.set_title("Save Project")
+        original_dir = os.path.dirname(window.editor_box.original_file_path)
+        dialog.set_initial_folder(Gio.File.new_for_path(original_dir))
+        name = getattr(window.editor_box, 'original_file_name', 'project')
+        dialog.set_initial_name(f"{name}{PROJECT_EXTENSION}")
+
+        filter_fig = Gtk.FileFilter()
+        filter_fig.set_name("Fig projects")
+        filter_fig.add_pattern(f"*{PROJECT_EXTENSION}")
+        filters = Gio.ListStore.new(Gtk.FileFilter)
+        filters.append(filter_fig)
+        dialog.set_filters(filters)
+
+        def save_callback(dialog, result):
+            try:
+                file = dialog.save_finish(result)
+                if file:
+                    window.editor_box.save_project(file.get_path())
+            except GLib.Error as e:
+                print(f"Error in save dialog: {e}")
+            except (OSError, ValueError) as e:
+                error_dialog = Adw.AlertDialog.new("Error", f"Failed to save project: {str(e)}")
+                error_dialog.add_response("ok", "OK")
+                error_dialog.present(window)
+
+        dialog.save(window, None, save_callback)
+
     def _export_video(self, window, editor_box, output_path):
         """Handle the actual video export process with a progress dialog and cancellation support."""
         try:
@@ -363,12 +513,12 @@ class FigApplication(Adw.Application):
                         total_frames = len(editor_box.frames)
                         processed_frames = 0
 
-                        for i, frame in enumerate(editor_box.frames):
+                        for i in range(total_frames):
                             if cancel_event.is_set():
                                 raise Exception("Export cancelled by user.")
                             if not editor_box.frameline.is_frame_removed(i):
                                 frame_path = os.path.join(temp_dir, f"frame_{i}.png")
-                                pil_image = editor_box._pixbuf_to_pil(frame)
+                                pil_image = editor_box.edited_image(i)
                                 pil_image.save(frame_path, 'PNG')
                                 frame_paths.append(frame_path)
                             processed_frames += 1
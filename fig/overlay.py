@@ -175,6 +175,7 @@ class CropTextOverlay(Gtk.Overlay):
             self.editor.drawing = False
             self.editor.last_point = None
             self.drawing_area.queue_draw()
+            self.editor.record_edit()
             return True
             
         self.active_handle = None
@@ -259,6 +260,8 @@ class CropTextOverlay(Gtk.Overlay):
         self.active_handle = None
         self.start_crop_rect = None
         self.dragging_region = False
+        if self.editor.crop_mode:
+            self.editor.record_edit()  # Nothing is recorded when the rectangle did not move
 
     def draw_overlay(self, drawing_area, cr, width, height):
         # Get actual displayed image dimensions
@@ -425,6 +428,13 @@ class CropTextOverlay(Gtk.Overlay):
                 })
             self.remove_overlay(self.current_entry)
 
+        entry = self.create_text_entry(x, y)
+        self.add_overlay(entry)
+        entry.grab_focus()
+        self.current_entry = entry
+
+    def create_text_entry(self, x, y):
+        """Text entry widget at x, y, not added to the overlay yet"""
         entry = Gtk.Entry()
         entry.set_has_frame(False)
         
@@ -447,10 +457,7 @@ class CropTextOverlay(Gtk.Overlay):
         key_controller = Gtk.EventControllerKey()
         key_controller.connect('key-pressed', self._on_text_key_pressed, entry)
         entry.add_controller(key_controller)
-        
-        self.add_overlay(entry)
-        entry.grab_focus()
-        self.current_entry = entry
+        return entry
 
     def _on_entry_activated(self, entry: Gtk.Entry):
         """Handle Enter key press"""
@@ -467,6 +474,7 @@ class CropTextOverlay(Gtk.Overlay):
                 'y': entry.get_margin_top()
             }
             self.text_entries.append(text_entry)
+            self.editor.record_edit()
         self.current_entry = None
 
 
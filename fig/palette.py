@@ -0,0 +1,134 @@
+from PIL import Image, ImageChops
+
+# A global palette is built from this many frames, spread over the export,
+# each shrunk to about this many pixels
+PALETTE_SAMPLE_FRAMES = 32
+PALETTE_SAMPLE_PIXELS = 128 * 128
+
+# One index of a GIF color table is kept free for transparent pixels
+MAX_COLORS = 255
+
+
+def sample_indices(count, samples=PALETTE_SAMPLE_FRAMES):
+    """Indices of up to samples frames spread evenly over count frames"""
+    step = max(1, count / samples)
+    return [int(k * step) for k in range(min(count, samples))]
+
+
+def _color_mask(rgb, color):
+    """L mask of the pixels of an RGB image that have exactly color"""
+    r, g, b = (band.point([255 if v == c else 0 for v in range(256)])
+               for band, c in zip(rgb.split(), color))
+    return ImageChops.multiply(ImageChops.multiply(r, g), b)
+
+
+class Palette:
+    """
+    One color table shared by every frame of a GIF.
+
+    colors are RGB bytes of at most MAX_COLORS entries, the index after the
+    last color is the transparent one. Frames are mapped onto the palette by
+    Pillow, which looks colors up in a nearest-color cache in C, optionally
+    with Floyd-Steinberg dithering. The cache works at reduced precision, so
+    a palette from a GIF's color table also checks that colors of the table
+    keep their own index and fixes those that do not.
+    """
+
+    def __init__(self, colors, dither=False):
+        colors = bytes(colors)
+        if len(colors) % 3 or not 0 < len(colors) // 3 <= MAX_COLORS:
+            raise ValueError(f"a palette needs 1 to {MAX_COLORS} RGB colors")
+        self.colors = colors
+        self.dither = dither
+        self._image = Image.new('P', (1, 1))
+        self._image.putpalette(colors)
+        self._indices = None  # RGB -> index of colors that must map exactly
+
+    def __len__(self):
+        return len(self.colors) // 3
+
+    @property
+    def transparency(self):
+        return len(self)
+
+    def table(self):
+        """Color table bytes for a GIF, padded to a power of two with room for transparency"""
+        size = 2
+        while size < len(self) + 1:
+            size *= 2
+        return self.colors + bytes(3 * (size - len(self)))
+
+    def map(self, rgb):
+        """Convert an RGB image to a P image with this palette's indices"""
+        exact = self._indices is not None
+        dither = Image.Dither.FLOYDSTEINBERG if self.dither else Image.Dither.NONE
+        if exact and self.dither:
+            colors = rgb.getcolors(len(self))
+            if colors is not None and all(color in self._indices for _, color in colors):
+                dither = Image.Dither.NONE  # Nothing to dither, and no error to spread
+            else:
+                exact = False
+        indexed = rgb.quantize(palette=self._image, dither=dither)
+        if exact:
+            self._fix_exact(rgb, indexed)
+        return indexed
+
+    def _fix_exact(self, rgb, indexed):
+        """Give pixels with a color of the palette that color's index"""
+        difference = ImageChops.difference(indexed.convert('RGB'), rgb)
+        box = difference.getbbox()
+        if box is None:
+            return
+        red, green, blue = difference.crop(box).split()
+        wrong = ImageChops.lighter(ImageChops.lighter(red, green), blue).point(lambda v: 255 if v else 0)
+        region = rgb.crop(box)
+        marked = region.convert('RGBA')
+        marked.putalpha(wrong)
+        for _, (r, g, b, a) in marked.getcolors(region.width * region.height):
+            index = self._indices.get((r, g, b)) if a else None
+            if index is not None:
+                indexed.paste(index, box, _color_mask(region, (r, g, b)))
+
+    @classmethod
+    def from_table(cls, table, dither=False):
+        """Palette of a GIF color table, None when it has no free index left"""
+        colors = []
+        seen = set()
+        for i in range(0, len(table) - len(table) % 3, 3):
+            color = table[i:i + 3]
+            if color not in seen:
+                seen.add(color)
+                colors.append(color)
+        if not colors or len(colors) > MAX_COLORS:
+            return None
+        palette = cls(b''.join(colors), dither)
+        palette._indices = {tuple(color): i for i, color in enumerate(colors)}
+        return palette
+
+    @classmethod
+    def from_frames(cls, frames, dither=False, colors=MAX_COLORS):
+        """
+        Palette for a sequence of frames, from a histogram of sampled pixels.
+        Only the frames at sample_indices are read.
+        """
+        if not len(frames):
+            raise ValueError("no frames to build a palette from")
+        samples = []
+        for i in sample_indices(len(frames)):
+            frame = frames[i]
+            scale = min(1.0, (PALETTE_SAMPLE_PIXELS / (frame.width * frame.height)) ** 0.5)
+            size = (max(1, int(frame.width * scale)), max(1, int(frame.height * scale)))
+            # Nearest neighbour keeps pixel colors as they are, filters would blend them
+            samples.append(frame.convert('RGB').resize(size, Image.Resampling.NEAREST))
+
+        # One image of all samples, quantized once
+        mosaic = Image.new('RGB', (max(sample.width for sample in samples),
+                                   sum(sample.height for sample in samples)))
+        top = 0
+        for sample in samples:
+            mosaic.paste(sample, (0, top))
+            top += sample.height
+        quantized = mosaic.quantize(colors, method=Image.Quantize.MEDIANCUT)
+        palette = quantized.getpalette()
+        used = [i for i, count in enumerate(quantized.histogram()) if count]
+        return cls(b''.join(bytes(palette[i * 3:i * 3 + 3]) for i in used), dither)
@@ -0,0 +1,112 @@
+import os
+import json
+import tempfile
+
+from fig.framecache import file_hash
+from fig.timeline import Piece
+from fig.transform import Transform
+
+PROJECT_EXTENSION = '.fig'
+PROJECT_FORMAT = 'fig-project'
+PROJECT_VERSION = 1
+
+
+def _tuples(value):
+    """JSON lists back to the nested tuples of an editor snapshot"""
+    if isinstance(value, list):
+        return tuple(_tuples(item) for item in value)
+    return value
+
+
+def save_project(path, state, sources, hash_of=file_hash):
+    """
+    Write the edit decisions of an editor snapshot to a project file.
+
+    sources holds, for every timeline buffer, the (file path, frame count)
+    pairs its frames were read from. Files are referenced by a path relative
+    to the project and by content hash, no pixels are stored.
+    """
+    project_dir = os.path.dirname(os.path.abspath(path))
+    buffers = []
+    for source in sources:
+        if source is None:
+            raise ValueError("frames without a source file can not be saved in a project")
+        buffers.append([{
+            'path': os.path.relpath(file_path, project_dir),
+            'abspath': os.path.abspath(file_path),
+            'hash': hash_of(file_path),
+            'frames': count,
+        } for file_path, count in source])
+
+    transform = state['transform']
+    manifest = {
+        'format': PROJECT_FORMAT,
+        'version': PROJECT_VERSION,
+        'buffers': buffers,
+        'pieces': [list(piece) for piece in state['timeline']],
+        'transform': [transform.flipped, transform.turns, transform.size, transform.crop],
+        'flipped': state['flipped'],
+        'rotated': state['rotated'],
+        'display_size': state['display_size'],
+        'text_rotation': state['text_rotation'],
+        'crop_rect': state['crop_rect'],
+        'drawings': state['drawings'],
+        'texts': state['texts'],
+        'loop': state.get('loop'),
+    }
+
+    # Write next to the target and rename, an interrupted save keeps the old project
+    fd, temp_path = tempfile.mkstemp(dir=project_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _resolve(ref, project_dir, hash_of):
+    """Find a referenced file, relative to the project first, and check its content"""
+    for file_path in (os.path.join(project_dir, ref['path']), ref['abspath']):
+        if os.path.exists(file_path):
+            if hash_of(file_path) != ref['hash']:
+                raise ValueError(f"{file_path} changed since the project was saved")
+            return file_path
+    raise FileNotFoundError(f"Source file not found: {ref['path']}")
+
+
+def load_project(path, hash_of=file_hash):
+    """
+    Read a project file, returns (state, sources).
+
+    state has the fields of an editor snapshot, with texts as (text, x, y)
+    and the loop count under 'loop'. sources lists the resolved
+    (file path, frame count) pairs of every timeline buffer.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != PROJECT_FORMAT:
+        raise ValueError(f"{path} is not a fig project")
+    if manifest.get('version', 0) > PROJECT_VERSION:
+        raise ValueError(f"{path} was saved by a newer version of fig")
+
+    project_dir = os.path.dirname(os.path.abspath(path))
+    sources = [[(_resolve(ref, project_dir, hash_of), ref['frames']) for ref in buffer]
+               for buffer in manifest['buffers']]
+
+    flipped, turns, size, crop = manifest['transform']
+    state = {
+        'timeline': tuple(Piece(*piece) for piece in manifest['pieces']),
+        'transform': Transform(flipped, turns, _tuples(size), _tuples(crop)),
+        'flipped': manifest['flipped'],
+        'rotated': manifest['rotated'],
+        'display_size': _tuples(manifest['display_size']),
+        'text_rotation': manifest['text_rotation'],
+        'crop_rect': _tuples(manifest['crop_rect']),
+        'drawings': _tuples(manifest['drawings']),
+        'texts': _tuples(manifest['texts']),
+        'loop': manifest.get('loop'),
+    }
+    return state, sources
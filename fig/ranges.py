@@ -0,0 +1,98 @@
+from bisect import bisect_right, insort
+from collections.abc import MutableSequence
+
+
+class RangeList(MutableSequence):
+    """
+    Inclusive (start, end, ...) frame ranges kept sorted by start.
+
+    It reads like the plain list of tuples it replaces, but lookups by
+    frame index are binary searches instead of scans. Extra tuple fields
+    (like a speed factor) are carried along untouched. With merge=True,
+    overlapping and adjacent ranges are joined so the spans stay disjoint,
+    otherwise ranges are kept as added and may overlap.
+    """
+
+    def __init__(self, ranges=(), merge=False):
+        self.merge = merge
+        self.version = 0  # Bumped on every change
+        self._ranges = sorted(tuple(r) for r in ranges)
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuild the search keys after the ranges changed"""
+        self.version += 1
+        if self.merge:
+            merged = []
+            for r in self._ranges:
+                if merged and r[0] <= merged[-1][1] + 1:
+                    last = merged[-1]
+                    merged[-1] = (last[0], max(last[1], r[1])) + last[2:]
+                else:
+                    merged.append(r)
+            self._ranges = merged
+        self._starts = [r[0] for r in self._ranges]
+        # Largest end among the ranges up to each position, for overlapping ranges
+        self._max_ends = []
+        max_end = None
+        for r in self._ranges:
+            max_end = r[1] if max_end is None else max(max_end, r[1])
+            self._max_ends.append(max_end)
+
+    def __len__(self):
+        return len(self._ranges)
+
+    def __getitem__(self, index):
+        return self._ranges[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._ranges[index] = [tuple(r) for r in value]
+        else:
+            self._ranges[index] = tuple(value)
+        self._ranges.sort()
+        self._reindex()
+
+    def __delitem__(self, index):
+        del self._ranges[index]
+        self._reindex()
+
+    def __eq__(self, other):
+        return list(self._ranges) == list(other)
+
+    def __repr__(self):
+        return f"RangeList({self._ranges!r})"
+
+    def insert(self, index, value):
+        """Add a range, its position follows from its start"""
+        insort(self._ranges, tuple(value))
+        self._reindex()
+
+    def sort(self, key=None, reverse=False):
+        """Ranges are always sorted, kept for list compatibility"""
+
+    def add(self, start, end, *values):
+        self.append((start, end) + values)
+
+    def covers(self, index):
+        """Return True when any range contains the frame index"""
+        i = bisect_right(self._starts, index)
+        return i > 0 and self._max_ends[i - 1] >= index
+
+    def range_at(self, index):
+        """Return the last starting range containing the frame index, or None"""
+        i = bisect_right(self._starts, index)
+        if i == 0 or self._max_ends[i - 1] < index:
+            return None
+        for r in reversed(self._ranges[:i]):
+            if r[1] >= index:
+                return r
+
+    def next_uncovered(self, index, direction=1):
+        """First frame index from index on, stepping by direction, outside every range"""
+        while self.covers(index):
+            if direction > 0:
+                index = self._max_ends[bisect_right(self._starts, index) - 1] + 1
+            else:
+                index = self.range_at(index)[0] - 1
+        return index
@@ -0,0 +1,229 @@
+from bisect import bisect_right
+from collections import namedtuple
+
+from fig.ranges import RangeList
+
+# count frames of one buffer from index start on, stepping by step, that
+# all share the same speed and inserted/removed flags
+Piece = namedtuple('Piece', ['buffer', 'start', 'count', 'step', 'speed', 'inserted', 'removed'])
+
+
+class Timeline:
+    """
+    Frame order and per-frame edits of a GIF, as a piece table.
+
+    Every frame loaded or inserted is appended once to an append-only buffer
+    of entries and original durations. The timeline itself is a tuple of
+    pieces, runs of buffer frames with their speed factor and inserted and
+    removed flags. Inserting, removing, duplicating and changing speed only
+    split and rebuild pieces, which costs O(pieces) however many frames
+    there are, and never touches pixel data.
+
+    Buffers only grow and pieces are immutable, so the pieces tuple is a
+    complete snapshot of the timeline that restore() brings back.
+    """
+
+    def __init__(self, entries=(), durations=()):
+        self._entries = []  # Buffers of frame entries
+        self._durations = []  # Original durations, parallel to _entries
+        self.sources = []  # Where the frames of every buffer came from, or None
+        self.version = 0  # Bumped on every change
+        self._set(())
+        if entries:
+            self.insert(0, entries, durations, inserted=False)
+
+    @property
+    def pieces(self):
+        return self._pieces
+
+    def _set(self, pieces):
+        """Install new pieces, joining runs that continue each other"""
+        joined = []
+        for piece in pieces:
+            if not piece.count:
+                continue
+            if joined:
+                last = joined[-1]
+                if (last.buffer == piece.buffer and last.step == piece.step
+                        and last.start + last.count * last.step == piece.start
+                        and last[4:] == piece[4:]):
+                    joined[-1] = last._replace(count=last.count + piece.count)
+                    continue
+            joined.append(piece)
+        self._pieces = tuple(joined)
+
+        # Timeline position of the first frame of every piece
+        self._offsets = []
+        length = 0
+        for piece in self._pieces:
+            self._offsets.append(length)
+            length += piece.count
+        self._length = length
+        self._ranges = {}
+        self.version += 1
+
+    def _cut(self, start, stop):
+        """Pieces before start, within [start, stop) and from stop on, split where needed"""
+        before, middle, after = [], [], []
+        for position, piece in zip(self._offsets, self._pieces):
+            end = position + piece.count
+            for low, high, part in ((position, min(end, start), before),
+                                    (max(position, start), min(end, stop), middle),
+                                    (max(position, stop), end, after)):
+                if low < high:
+                    offset = low - position
+                    part.append(piece._replace(start=piece.start + offset * piece.step,
+                                               count=high - low))
+        return before, middle, after
+
+    def _locate(self, index):
+        """Piece and buffer index of a timeline position"""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("timeline index out of range")
+        i = bisect_right(self._offsets, index) - 1
+        piece = self._pieces[i]
+        return piece, piece.start + (index - self._offsets[i]) * piece.step
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step == 1:
+                return self.entries(start, stop)
+            return [self[i] for i in range(start, stop, step)]
+        piece, i = self._locate(index)
+        return self._entries[piece.buffer][i]
+
+    def entries(self, start=0, stop=None):
+        """Entries of [start, stop), without resolving them to pixels"""
+        stop = self._length if stop is None else min(stop, self._length)
+        _, middle, _ = self._cut(start, stop)
+        result = []
+        for piece in middle:
+            buffer = self._entries[piece.buffer]
+            last = piece.start + (piece.count - 1) * piece.step
+            if piece.step > 0:
+                result.extend(buffer[piece.start:last + 1])
+            else:
+                result.extend(buffer[last:piece.start + 1][::-1])
+        return result
+
+    def duration(self, index):
+        """Milliseconds frame index is shown, with its speed applied"""
+        piece, i = self._locate(index)
+        duration = self._durations[piece.buffer][i]
+        return duration if piece.speed == 1.0 else int(duration / piece.speed)
+
+    def original_duration(self, index):
+        piece, i = self._locate(index)
+        return self._durations[piece.buffer][i]
+
+    def durations(self):
+        """Durations of all frames with speeds applied"""
+        result = []
+        for piece in self._pieces:
+            originals = self._durations[piece.buffer]
+            for k in range(piece.count):
+                duration = originals[piece.start + k * piece.step]
+                result.append(duration if piece.speed == 1.0 else int(duration / piece.speed))
+        return result
+
+    def original_durations(self):
+        result = []
+        for piece in self._pieces:
+            originals = self._durations[piece.buffer]
+            result.extend(originals[piece.start + k * piece.step] for k in range(piece.count))
+        return result
+
+    def is_removed(self, index):
+        return self._locate(index)[0].removed
+
+    def insert(self, index, entries, durations, inserted=True, source=None):
+        """Add new frames before position index, source describes where they came from"""
+        entries = list(entries)
+        if not entries:
+            return
+        durations = list(durations)
+        if len(durations) != len(entries):
+            raise ValueError("every inserted frame needs a duration")
+        self._entries.append(entries)
+        self._durations.append(durations)
+        self.sources.append(source)
+        piece = Piece(len(self._entries) - 1, 0, len(entries), 1, 1.0, inserted, False)
+        before, _, after = self._cut(index, index)
+        self._set(before + [piece] + after)
+
+    def clear(self):
+        self._entries = []
+        self._durations = []
+        self.sources = []
+        self._set(())
+
+    def mark(self, start, end, **changes):
+        """Set piece fields (speed, inserted, removed) for frames start..end"""
+        before, middle, after = self._cut(start, end + 1)
+        self._set(before + [piece._replace(**changes) for piece in middle] + after)
+
+    def remove(self, start, end):
+        """Mark frames start..end removed, they play and export at normal speed if restored"""
+        self.mark(start, end, removed=True, speed=1.0)
+
+    def set_speed(self, start, end, speed):
+        """Play frames start..end speed times as fast, replacing their earlier speed"""
+        if speed <= 0:
+            raise ValueError(f"invalid speed factor: {speed}")
+        self.mark(start, end, speed=float(speed))
+
+    def duplicate(self, start, end, index=None):
+        """Repeat frames start..end at index, right after them by default"""
+        if index is None:
+            index = end + 1
+        _, middle, _ = self._cut(start, end + 1)
+        copies = [piece._replace(inserted=True, removed=False) for piece in middle]
+        before, _, after = self._cut(index, index)
+        self._set(before + copies + after)
+        return sum(piece.count for piece in copies)
+
+    def restore(self, pieces):
+        """Go back to a pieces tuple taken from this timeline"""
+        self._set(pieces)
+
+    def _runs(self, field):
+        """(start, end, value) for every run of frames with a set field"""
+        runs = []
+        for position, piece in zip(self._offsets, self._pieces):
+            value = getattr(piece, field)
+            if field == 'speed' and value == 1.0 or not value:
+                continue
+            end = position + piece.count - 1
+            if runs and runs[-1][1] == position - 1 and runs[-1][2] == value:
+                runs[-1] = (runs[-1][0], end, value)
+            else:
+                runs.append((position, end, value))
+        return runs
+
+    def _cached(self, field, build):
+        ranges = self._ranges.get(field)
+        if ranges is None:
+            ranges = self._ranges[field] = build(self._runs(field))
+        return ranges
+
+    @property
+    def removed_ranges(self):
+        """Removed frames as a RangeList of (start, end)"""
+        return self._cached('removed', lambda runs: RangeList(
+            ((start, end) for start, end, _ in runs), merge=True))
+
+    @property
+    def inserted_ranges(self):
+        return self._cached('inserted', lambda runs: RangeList(
+            (start, end) for start, end, _ in runs))
+
+    @property
+    def speed_ranges(self):
+        """Frames played at another speed as a RangeList of (start, end, speed)"""
+        return self._cached('speed', RangeList)
@@ -0,0 +1,103 @@
+from PIL import Image
+
+from fig.indexed import IndexedFrame, share, unpack
+
+# Pillow transpose for every orientation, by (flipped, clockwise quarter turns)
+_TRANSPOSES = {
+    (False, 0): None,
+    (False, 1): Image.ROTATE_270,
+    (False, 2): Image.ROTATE_180,
+    (False, 3): Image.ROTATE_90,
+    (True, 0): Image.FLIP_LEFT_RIGHT,
+    (True, 1): Image.TRANSVERSE,
+    (True, 2): Image.FLIP_TOP_BOTTOM,
+    (True, 3): Image.TRANSPOSE,
+}
+
+
+class Transform:
+    """
+    Geometric edits shared by all frames, recorded instead of applied.
+
+    The orientation is one of the 8 symmetries of a rectangle: an optional
+    horizontal flip followed by a number of clockwise quarter turns. Flips
+    and rotations compose into a new orientation without touching a pixel,
+    so the frames are only transformed when one is shown or exported, and
+    then with a single transpose. size is the frame size before orienting,
+    frames of another size are resized to it first, and crop is a box in
+    oriented coordinates cut out last.
+
+    Transforms are immutable, every edit returns a new one.
+    """
+
+    __slots__ = ('flipped', 'turns', 'size', 'crop')
+
+    def __init__(self, flipped=False, turns=0, size=None, crop=None):
+        self.flipped = flipped
+        self.turns = turns % 4
+        self.size = size
+        self.crop = crop
+
+    def flip(self):
+        """Mirror horizontally, after the current orientation"""
+        # Flipping after k clockwise turns equals flipping first, then turning back k times
+        return Transform(not self.flipped, -self.turns, self.size, self.crop)
+
+    def rotate(self):
+        """Turn 90 degrees clockwise, after the current orientation"""
+        return Transform(self.flipped, self.turns + 1, self.size, self.crop)
+
+    def resized(self, size):
+        return Transform(self.flipped, self.turns, size, self.crop)
+
+    def cropped(self, box):
+        return Transform(self.flipped, self.turns, self.size, box)
+
+    @property
+    def method(self):
+        """Pillow transpose method of the orientation, None for the identity"""
+        return _TRANSPOSES[(self.flipped, self.turns)]
+
+    @property
+    def is_identity(self):
+        return self.method is None and self.size is None and self.crop is None
+
+    def output_size(self, size):
+        """Size of what apply() makes of an image of the given size"""
+        width, height = self.size or size
+        if self.turns % 2:
+            width, height = height, width
+        if self.crop is not None:
+            left, top, right, bottom = self.crop
+            return right - left, bottom - top
+        return width, height
+
+    def orient(self, image):
+        """Apply only the orientation, to a PIL image or IndexedFrame"""
+        method = self.method
+        return image if method is None else image.transpose(method)
+
+    def apply(self, image, paint=None):
+        """
+        Resize, orient and crop an image in one pass.
+
+        paint is called with the oriented image before cropping, to draw
+        overlays given in display coordinates. An IndexedFrame is oriented
+        and cropped on its index buffer and only expanded to RGBA when it is
+        resized, painted or returned.
+        """
+        source = image
+        if self.size is not None and image.size != self.size:
+            image = unpack(image).resize(self.size, Image.Resampling.LANCZOS)
+        image = self.orient(image)
+        if paint is not None:
+            if isinstance(image, IndexedFrame):
+                image = image.to_rgba()
+            elif image is source:
+                image = share(image)  # Never draw on a stored frame
+            paint(image)
+        if self.crop is not None and self.crop != (0, 0) + image.size:
+            image = image.crop(self.crop)
+        if isinstance(image, IndexedFrame):
+            image = image.to_rgba()
+        return image
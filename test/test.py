@@ -6,8 +6,27 @@ from gi.repository import Gtk, GLib, GdkPixbuf
 from PIL import Image
 import io
 import os
+import random
+import shutil
+import threading
+import time
 from fig.editor import EditorBox
 from fig.frameline import FrameLine
+from fig.framestore import FrameStore
+from fig.framecache import FrameCache
+from fig.gifindex import scan_frames, probe, disposal_methods
+from fig.decoder import FrameCursor, decode_frames, plan_segments, read_frame, Checkpoints
+from fig.indexed import IndexedFrame
+from fig.transform import Transform
+from fig.ranges import RangeList
+from fig.durations import DurationIndex
+from fig.history import History
+from fig.timeline import Timeline
+from fig.project import save_project, load_project
+from fig.composite import OverlayPainter, composite_frames
+from fig.encoder import GifWriter, DISPOSE_BACKGROUND, write_gif, copy_start, copy_frames
+from fig.palette import Palette
+from fig.budget import SizeFitter, SizeSettings, SIZE_STEPS, ESTIMATE_MARGIN
 
 class TestGifEditor(unittest.TestCase):
     def setUp(self):
@@ -66,6 +85,68 @@ class TestGifEditor(unittest.TestCase):
         self.assertEqual(self.editor.frameline.min_value, 1)
         self.assertEqual(self.editor.frameline.max_value, 5)
 
+    def test_frames_primed_while_reading(self):
+        """Test that the loader thread fills the frame store while the UI reads frames"""
+        self.editor.load_gif('test.gif')
+        frames = self.editor.frames
+
+        # Reads race the loader thread, both go through the store
+        with Image.open('test.gif') as gif:
+            for i in (4, 0, 2):
+                gif.seek(i)
+                self.assertEqual(frames.image(i).convert('RGB').tobytes(), gif.convert('RGB').tobytes())
+
+        context = GLib.MainContext.default()
+        while self.editor._load_cancel is not None:
+            context.iteration(True)
+        self.assertEqual(sorted(frames._cache), [0, 1, 2, 3, 4])
+        self.assertEqual(self.editor.info_label.get_text(), "5 Frames • 0.50 Seconds")
+
+        # Progress is shown while decoding, stale reports change nothing
+        generation = self.editor.load_generation
+        self.assertFalse(self.editor.update_decoding_progress(generation, 2, 5))
+        self.assertEqual(self.editor.info_label.get_text(), "Decoding frames 2/5")
+        self.editor.update_decoding_progress(generation - 1, 5, 5)
+        self.assertEqual(self.editor.info_label.get_text(), "Decoding frames 2/5")
+        self.editor.update_decoding_progress(generation, 5, 5)
+        self.assertEqual(self.editor.info_label.get_text(), "5 Frames • 0.50 Seconds")
+
+    def test_load_cancellation(self):
+        """Test that a newer load cancels the running one and its callbacks turn stale"""
+        release = threading.Event()
+
+        def slow_decode(file_path, infos, start, stop, cancel=None, checkpoints=None):
+            release.wait(5)
+            with Image.open(file_path) as gif:
+                for i in range(start, stop):
+                    gif.seek(i)
+                    yield i, gif.convert('RGBA')
+
+        with patch('fig.editor.decode_frames', side_effect=slow_decode):
+            self.editor.load_gif('test.gif')
+            first = self.editor.frames
+            generation = self.editor.load_generation
+            cancel = self.editor._load_cancel
+            with patch.object(first, 'prime') as prime:
+                self.editor.load_gif('test.gif')
+                self.assertTrue(cancel.is_set())
+                self.assertNotEqual(self.editor.load_generation, generation)
+                self.assertIsNot(self.editor.frames, first)
+                release.set()
+                time.sleep(0.2)
+                # The cancelled load leaves its store alone
+                prime.assert_not_called()
+
+        # Progress of the cancelled load is ignored
+        current = self.editor._load_cancel
+        self.assertFalse(self.editor.update_decoding_progress(generation, 5, 5))
+        self.assertIs(self.editor._load_cancel, current)
+
+        context = GLib.MainContext.default()
+        while self.editor._load_cancel is not None:
+            context.iteration(True)
+        self.assertEqual(sorted(self.editor.frames._cache), [0, 1, 2, 3, 4])
+
     def test_frame_selection(self):
         """Test frame selection with frameline handles"""
         self.editor.load_gif('test.gif')
@@ -135,6 +216,57 @@ class TestGifEditor(unittest.TestCase):
         # Verify playback direction
         self.assertTrue(self.editor.frameline.left_value > self.editor.frameline.right_value)
 
+    def test_playback_follows_clock(self):
+        """Test that playback shows the frame due at the elapsed time, in both directions"""
+        self.editor.load_gif('test.gif')
+
+        context = GLib.MainContext.default()
+        while len(self.editor.frames) < 5:
+            context.iteration(True)
+
+        self.editor.frameline.set_left_value(2)
+        self.editor.frameline.set_right_value(5)
+        self.editor.play_edited_frames(None)
+        self.assertEqual(self.editor.playhead_frame_index, 1)
+        # 250ms in, frames 2 and 3 were shown and frame 4 is due
+        self.editor.play_started = time.monotonic() - 0.25
+        self.editor.play_next_frame()
+        self.assertEqual(self.editor.playhead_frame_index, 3)
+        self.assertEqual(self.editor.frameline.playhead_pos, 4)
+
+        # Seeking moves the playback clock along
+        self.assertTrue(self.editor.seek_to_frame(2))
+        self.assertAlmostEqual(time.monotonic() - self.editor.play_started, 0.1, delta=0.05)
+        self.assertFalse(self.editor.seek_to_frame(0))
+        self.editor.stop_playback()
+
+        self.editor.frameline.set_left_value(5)
+        self.editor.frameline.set_right_value(1)
+        self.editor.playback_finished = True
+        self.editor.play_edited_frames(None)
+        self.editor.play_started = time.monotonic() - 0.25
+        self.editor.play_next_frame()
+        self.assertEqual(self.editor.playhead_frame_index, 2)
+        self.editor.stop_playback()
+
+    def test_zero_delay_playback(self):
+        """Test that frames without a delay play for 100ms each, like in browsers"""
+        frames = [Image.new('RGB', (100, 100), (i * 60, 0, 0)) for i in range(5)]
+        frames[0].save('test.gif', save_all=True, append_images=frames[1:], duration=0, loop=0)
+        self.editor.load_gif('test.gif')
+
+        context = GLib.MainContext.default()
+        while len(self.editor.frames) < 5:
+            context.iteration(True)
+
+        self.editor.play_edited_frames(None)
+        self.assertTrue(self.editor.is_playing)
+        self.editor.play_started = time.monotonic() - 0.25
+        self.editor.play_next_frame()
+        self.assertTrue(self.editor.is_playing)
+        self.assertEqual(self.editor.playhead_frame_index, 2)
+        self.editor.stop_playback()
+
     def test_save_trimmed_gif(self):
         """Test saving trimmed GIF"""
         self.editor.load_gif('test.gif')
@@ -177,6 +309,59 @@ class TestGifEditor(unittest.TestCase):
         with Image.open('output.gif') as gif:
             self.assertEqual(gif.n_frames, 5)
 
+    def test_background_save_is_atomic(self):
+        """Test that saves write a temporary file, rename it over the target and clean up on failure"""
+        self.editor.load_gif('test.gif')
+
+        context = GLib.MainContext.default()
+        while len(self.editor.frames) < 5:
+            context.iteration(True)
+
+        os.makedirs('saves', exist_ok=True)
+        try:
+            target = os.path.join('saves', 'output.gif')
+            with open(target, 'wb') as f:
+                f.write(b'old')
+            os.chmod(target, 0o600)
+
+            # A cancelled save leaves the old file as it was
+            cancel = threading.Event()
+            cancel.set()
+            write = self.editor._prepare_save(0, 4)
+            self.assertRaises(Exception, write, target, cancel)
+            self.assertEqual(os.listdir('saves'), ['output.gif'])
+            with open(target, 'rb') as f:
+                self.assertEqual(f.read(), b'old')
+
+            # So does one that fails half way
+            with patch('fig.editor.write_gif', side_effect=OSError("disk full")), \
+                    patch('fig.editor.copy_frames', side_effect=OSError("disk full")):
+                self.assertRaises(OSError, self.editor._prepare_save(0, 4), target)
+            self.assertEqual(os.listdir('saves'), ['output.gif'])
+
+            # A finished save replaces the file in one rename, keeping its permissions
+            with patch('fig.editor.os.replace', wraps=os.replace) as replace:
+                self.editor._prepare_save(0, 4)(target)
+            temp_path, path = replace.call_args[0]
+            self.assertEqual(path, target)
+            self.assertEqual(os.path.dirname(os.path.abspath(temp_path)), os.path.abspath('saves'))
+            self.assertEqual(os.listdir('saves'), ['output.gif'])
+            self.assertEqual(os.stat(target).st_mode & 0o777, 0o600)
+            with Image.open(target) as gif:
+                self.assertEqual(gif.n_frames, 5)
+
+            # In the background, through the progress dialog
+            os.remove(target)
+            self.editor.save_gif_in_background(target, 0, 4)
+            deadline = time.monotonic() + 10
+            while not os.path.exists(target) and time.monotonic() < deadline:
+                context.iteration(False)
+                time.sleep(0.01)
+            with Image.open(target) as gif:
+                self.assertEqual(gif.n_frames, 5)
+        finally:
+            shutil.rmtree('saves', ignore_errors=True)
+
     def test_playhead_behavior(self):
         """Test playhead visibility and position"""
         self.editor.load_gif('test.gif')
@@ -831,6 +1016,22 @@ class TestGifEditor(unittest.TestCase):
         self.assertEqual(len(self.editor.frameline.speed_ranges), 1)
         self.assertEqual(self.editor.frameline.speed_ranges[0], (1, 2, 2.0))  # 0-based indices
 
+    def test_speed_change_updates_duration_index(self):
+        """Test that a speed change updates the duration index instead of rebuilding it"""
+        self.editor.load_gif('test.gif')
+
+        context = GLib.MainContext.default()
+        while len(self.editor.frames) < 5:
+            context.iteration(True)
+
+        index = self.editor.durations()
+        with patch('fig.editor.DurationIndex') as rebuilt:
+            self.editor.on_speed_changed(self.editor.frameline, 2, 3, 2.0)
+            self.assertIs(self.editor.durations(), index)
+        rebuilt.assert_not_called()
+        self.assertEqual(index.range_stats(0, 4), (5, 400))
+        self.assertEqual(index.seek(150), 2)
+
     def test_overlapping_speed_changes(self):
         """Test applying multiple speed changes to overlapping ranges"""
         self.editor.load_gif('test.gif')
@@ -853,10 +1054,10 @@ class TestGifEditor(unittest.TestCase):
         self.editor.frameline.right_value = 5
         self.editor.on_speed_changed(self.editor.frameline, 3, 4, 0.75)
         
-        # Verify frame 3 uses the most recent speed (0.5x)
-        # self.assertEqual(self.editor.frame_durations[2], self.editor.original_frame_durations[2] * 2)
-        # Verify merged ranges
-        self.assertEqual(len(self.editor.frameline.speed_ranges), 3)
+        # Verify frames 3-4 use the most recent speed (0.75x)
+        self.assertEqual(self.editor.frame_durations[2], int(self.editor.original_frame_durations[2] / 0.75))
+        # Verify ranges are split where the speed changes
+        self.assertEqual(list(self.editor.frameline.speed_ranges), [(1, 1, 2.0), (2, 3, 0.75)])
 
     def test_speed_change_with_removed_frames(self):
         """Test interaction between speed changes and frame removal"""
@@ -955,6 +1156,914 @@ class TestGifEditor(unittest.TestCase):
         self.editor.on_speed_changed(self.editor.frameline, 1, 1, 0)  # Should be ignored
         self.assertEqual(self.editor.frame_durations[0], original_duration)
 
+class TestFrameStore(unittest.TestCase):
+    def setUp(self):
+        frames = [Image.new('RGB', (100, 100), (i * 40, 0, 0)) for i in range(5)]
+        frames[0].save('store.gif', save_all=True, append_images=frames[1:],
+                       duration=[100, 200, 300, 400, 500], loop=0)
+
+    def tearDown(self):
+        if os.path.exists('store.gif'):
+            os.remove('store.gif')
+        shutil.rmtree('cache', ignore_errors=True)
+
+    def test_metadata_scan(self):
+        """Test that frame metadata is read without decoding"""
+        infos = scan_frames('store.gif')
+        self.assertEqual([info.index for info in infos], [0, 1, 2, 3, 4])
+        self.assertEqual([info.duration for info in infos], [100, 200, 300, 400, 500])
+
+    def test_probe(self):
+        """Test that the header probe reports size, timing and loop count"""
+        gif = probe('store.gif')
+        self.assertEqual((gif.width, gif.height), (100, 100))
+        self.assertEqual(gif.frame_count, 5)
+        self.assertEqual(gif.durations, [100, 200, 300, 400, 500])
+        self.assertEqual(gif.duration, 1500)
+        self.assertEqual(gif.loop, 0)
+
+        Image.new('RGB', (30, 20)).save('store.gif', save_all=True,
+                                         append_images=[Image.new('RGB', (30, 20))], loop=3)
+        self.assertEqual(probe('store.gif').loop, 3)
+        Image.new('RGB', (30, 20)).save('store.gif')
+        self.assertIsNone(probe('store.gif').loop)
+
+    def test_block_index_random_access(self):
+        """Test that partial frames with disposal and transparency decode in any order"""
+        frames = []
+        for i in range(6):
+            frame = Image.new('RGBA', (60, 40), (0, 0, 0, 0))
+            frame.paste((255, i * 40, 0, 255), (i * 8, 5, i * 8 + 12, 30))
+            frames.append(frame)
+        frames[0].save('store.gif', save_all=True, append_images=frames[1:],
+                       duration=50, disposal=[1, 2, 3, 1, 2, 3])
+
+        infos = scan_frames('store.gif')
+        self.assertEqual([info.disposal for info in infos], [1, 2, 3, 1, 2, 3])
+        self.assertTrue(all(info.data < info.end for info in infos))
+
+        expected = []
+        with Image.open('store.gif') as gif:
+            for i in range(6):
+                gif.seek(i)
+                expected.append(gif.convert('RGBA'))
+        store = FrameStore('store.gif', spill_bytes=0)
+        store.extend(infos)
+        for i in (5, 2, 4, 0, 3, 1):
+            mask = expected[i].getchannel('A')
+            self.assertEqual(store[i].getchannel('A').tobytes(), mask.tobytes())
+            self.assertEqual(store[i].convert('RGB').tobytes(),
+                             Image.composite(expected[i], store[i], mask).convert('RGB').tobytes())
+        store.close()
+
+    def write_local_palettes(self, count, every=3):
+        """Frames on a global table, every few ones bring their own and clear the canvas"""
+        palette = Palette(bytes([255, 0, 0, 0, 0, 255]))
+        with open('store.gif', 'wb') as f:
+            writer = GifWriter(f, (20, 10), 0, palette)
+            for i in range(count):
+                if i % every == 1:
+                    frame = Image.new('P', (20, 10), 0)
+                    frame.putpalette([255, i * 8 % 256, 0, 0, 255, 0])
+                    frame.paste(1, (0, 0, 4, 4))
+                    writer.palette = None  # Written with a local color table
+                    writer.write_frame(frame, (0, 0), 50, DISPOSE_BACKGROUND)
+                    writer.palette = palette
+                else:
+                    frame = Image.new('P', (6, 6), 1)
+                    frame.putpalette(palette.table())
+                    writer.write_frame(frame, (i % 14, 2), 50, i % 4)
+            writer.close()
+        expected = []
+        with Image.open('store.gif') as gif:
+            for i in range(count):
+                gif.seek(i)
+                expected.append(gif.convert('RGBA'))
+        return expected
+
+    def test_resume_after_local_palette(self):
+        """Test that resuming after a cleared frame fills with that frame's own colors"""
+        expected = self.write_local_palettes(12)
+        infos = scan_frames('store.gif')
+        self.assertTrue(all(info.keyframe for info in infos if info.index % 3 == 2))
+        for i in range(12):
+            store = FrameStore('store.gif', spill_bytes=0)
+            store.extend(infos)
+            store[0]
+            self.assertEqual(store[i].convert('RGBA').tobytes(), expected[i].tobytes(), i)
+            store.close()
+
+    def test_random_order_with_local_palettes(self):
+        """Test that frames read in any order match Pillow, also decoded from segments"""
+        expected = self.write_local_palettes(100, every=10)
+        infos = scan_frames('store.gif')
+        order = list(range(100))
+        random.Random(9).shuffle(order)
+        store = FrameStore('store.gif', cache_bytes=3 * 20 * 10 * 4, spill_bytes=0)
+        store.extend(infos)
+        for i in order:
+            self.assertEqual(store[i].convert('RGBA').tobytes(), expected[i].tobytes(), i)
+
+        # Workers decode runs of frames from where the store would resume
+        for i in order[:20]:
+            stop = min(100, i + 5)
+            file_path, sources, methods, transparency, resume, canvas = store.segment(i, stop)
+            cursor = FrameCursor(file_path, sources, methods, resume, transparency, canvas)
+            for index in range(i, stop):
+                cursor.seek(index)
+                self.assertEqual(cursor.image().convert('RGBA').tobytes(), expected[index].tobytes(), index)
+            cursor.close()
+        store.close()
+
+    def test_lazy_decode_with_bounded_cache(self):
+        """Test that frames decode on demand and the cache respects its budget"""
+        store = FrameStore('store.gif', cache_bytes=2 * 100 * 100 * 4)
+        for info in scan_frames('store.gif'):
+            store.append(info)
+
+        with Image.open('store.gif') as gif:
+            for i in (4, 0, 2, 3, 1):
+                gif.seek(i)
+                self.assertEqual(store[i].tobytes(), gif.convert('RGBA').tobytes())
+                self.assertLessEqual(store._cache_size, store.cache_bytes)
+        store.close()
+
+    def test_palette_indexed_frames(self):
+        """Test that frames are kept as palette indices and expand losslessly"""
+        store = FrameStore('store.gif')
+        store.extend(scan_frames('store.gif'))
+
+        with Image.open('store.gif') as gif:
+            gif.seek(3)
+            expected = gif.convert('RGBA')
+        self.assertEqual(store[3].tobytes(), expected.tobytes())
+        frame, nbytes = store._cache[3]
+        self.assertIsInstance(frame, IndexedFrame)
+        self.assertLess(nbytes, 100 * 100 * 4)
+        store.close()
+
+    def test_duplicated_frames_share_pixels(self):
+        """Test that duplicating stored frames adds references and writes copy"""
+        store = FrameStore('store.gif')
+        noise = Image.effect_noise((100, 100), 64).convert('RGBA')  # Too many colors for a palette
+        store.append(noise)
+        store.extend(store.entries(0, 1))
+        self.assertIs(store.entries(0, 1)[0], store.entries(1, 2)[0])
+
+        view = store.image(1)
+        view.paste((255, 0, 0, 255), (0, 0, 10, 10))
+        self.assertEqual(view.getpixel((0, 0)), (255, 0, 0, 255))
+        self.assertEqual(store.image(0).tobytes(), noise.tobytes())
+        self.assertEqual(store.image(1).tobytes(), noise.tobytes())
+        store.close()
+
+    @patch.dict(os.environ, {'XDG_CACHE_HOME': os.path.abspath('cache')})
+    def test_evicted_frames_spill_to_disk(self):
+        """Test that frames evicted from memory are read back from the spill file"""
+        store = FrameStore('store.gif', cache_bytes=100 * 100)
+        store.extend(scan_frames('store.gif'))
+
+        with Image.open('store.gif') as gif:
+            expected = []
+            for i in range(5):
+                gif.seek(i)
+                expected.append(gif.convert('RGBA').tobytes())
+        for i in range(5):
+            store[i]
+        self.assertEqual(sorted(store._spilled), [0, 1, 2, 3])
+
+        store._cursor.close()
+        store._cursor = None
+        self.assertEqual(store[1].tobytes(), expected[1])
+        self.assertIsNone(store._cursor)  # Served without decoding
+        store.close()
+
+    def test_full_disk_stops_spilling(self):
+        """Test that frames are decoded again when no disk space is left to spill them"""
+        store = FrameStore('store.gif', cache_bytes=100 * 100)
+        store.extend(scan_frames('store.gif'))
+        with patch('os.posix_fallocate', side_effect=OSError(28, 'No space left on device'),
+                   create=True):
+            for i in range(5):
+                store[i]
+        self.assertEqual(store._spilled, {})
+        self.assertEqual(store.spill_bytes, 0)
+        with Image.open('store.gif') as gif:
+            self.assertEqual(store[0].tobytes(), gif.convert('RGBA').tobytes())
+        store.close()
+
+    def test_seek_back_resumes_at_pinned_checkpoint(self):
+        """Test that seeking back in a GIF without keyframes does not start over"""
+        frames = []
+        for i in range(100):
+            frame = Image.new('RGBA', (40, 30), (20, 20, 20, 255))
+            frame.paste((0, 200, 0, 255), (0, i % 30, 10, i % 30 + 1))
+            frames.append(frame)
+        with open('store.gif', 'wb') as f:
+            write_gif(f, frames, [50] * 100)
+        infos = scan_frames('store.gif')
+        self.assertEqual(sum(info.keyframe for info in infos), 1)
+
+        # Frame 40 is long evicted when going back, and no spill file keeps it
+        store = FrameStore('store.gif', cache_bytes=24 * 1024, spill_bytes=0)
+        store.extend(infos)
+        store[99]
+        self.assertEqual(store.checkpoints.before(99), 95)
+        with patch('fig.decoder.read_frame', wraps=read_frame) as decoded:
+            with Image.open('store.gif') as gif:
+                gif.seek(40)
+                self.assertEqual(store[40].convert('RGB').tobytes(), gif.convert('RGB').tobytes())
+        self.assertLessEqual(decoded.call_count, 40 - 31)
+        store.close()
+
+    def test_persistent_frame_cache(self):
+        """Test that a cached GIF is served from the frame cache on reopen"""
+        cache = FrameCache('cache')
+        self.assertIsNone(cache.open('store.gif'))
+
+        infos = scan_frames('store.gif')
+        writer = cache.writer('store.gif', infos, (100, 100))
+        with Image.open('store.gif') as gif:
+            expected = []
+            for i in range(5):
+                gif.seek(i)
+                expected.append(gif.convert('RGBA'))
+                writer.add(expected[-1])
+        writer.commit()
+
+        cached = cache.open('store.gif')
+        self.assertEqual(cached.infos, infos)
+        store = FrameStore('store.gif')
+        store.attach_cache(cached)
+        store.extend(cached.infos)
+        for i in range(5):
+            self.assertEqual(store[i].tobytes(), expected[i].tobytes())
+        self.assertIsNone(store._cursor)
+        store.close()
+
+    def test_frame_cache_budget(self):
+        """Test that entries over budget are dropped and the newest entry survives eviction"""
+        infos = scan_frames('store.gif')
+        cache = FrameCache('cache', max_bytes=2 * 6 * 100 * 100)
+        # Frames with many colors pack to four bytes per pixel, more than the writer allows
+        writer = cache.writer('store.gif', infos, (100, 100))
+        noise = Image.frombytes('RGBA', (100, 100), os.urandom(100 * 100 * 4))
+        self.assertTrue(writer.add(noise))
+        self.assertFalse(writer.add(noise))
+        self.assertFalse(writer.add(noise))
+        self.assertIsNone(cache.open('store.gif'))
+        self.assertEqual([name for name in os.listdir(cache.directory) if name.endswith('.tmp')], [])
+
+        # An older entry is evicted, the one just written is kept even with an older mtime
+        old = os.path.join(cache.directory, 'old.frames')
+        with open(old, 'wb') as f:
+            f.write(bytes(cache.max_bytes))
+        writer = cache.writer('store.gif', infos, (100, 100))
+        with Image.open('store.gif') as gif:
+            for i in range(5):
+                gif.seek(i)
+                writer.add(gif.convert('RGBA'))
+        os.utime(old, (time.time() + 60, time.time() + 60))
+        writer.commit()
+        self.assertFalse(os.path.exists(old))
+        cached = cache.open('store.gif')
+        self.assertIsNotNone(cached)
+        cached.close()
+
+class TestDecoder(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists('decode.gif'):
+            os.remove('decode.gif')
+
+    def expected_frames(self):
+        with Image.open('decode.gif') as gif:
+            expected = []
+            for i in range(gif.n_frames):
+                gif.seek(i)
+                expected.append(gif.convert('RGBA'))
+        return expected
+
+    def assert_frames_equal(self, decoded, expected):
+        """Same visible pixels, whatever is under transparent ones"""
+        self.assertEqual([index for index, _ in decoded], list(range(len(expected))))
+        for (_, image), frame in zip(decoded, expected):
+            image = image.convert('RGBA')
+            mask = frame.getchannel('A')
+            self.assertEqual(image.getchannel('A').tobytes(), mask.tobytes())
+            self.assertEqual(Image.composite(image, frame, mask).tobytes(), frame.tobytes())
+
+    def test_cleared_canvas_frames_are_keyframes(self):
+        """Test that frames after a whole-canvas clear decode in parallel, in order"""
+        palette = Palette(bytes([255, 0, 0, 0, 0, 255]))
+        with open('decode.gif', 'wb') as f:
+            writer = GifWriter(f, (40, 30), 0, palette)
+            for i in range(80):
+                frame = Image.new('P', (40, 30), palette.transparency)
+                frame.putpalette(palette.table())
+                frame.paste(i % 2, (i % 30, 5, i % 30 + 10, 25))
+                writer.write_frame(frame, (0, 0), 50, DISPOSE_BACKGROUND, palette.transparency)
+            writer.close()
+
+        infos = scan_frames('decode.gif')
+        self.assertTrue(all(info.keyframe for info in infos))
+        self.assertGreater(len(plan_segments(infos, 0, 80, 40 * 30 * 4, 2)), 1)
+        decoded = list(decode_frames('decode.gif', infos, max_workers=2))
+        self.assert_frames_equal(decoded, self.expected_frames())
+
+    def test_checkpoints_split_gifs_without_keyframes(self):
+        """Test that canvases pinned on a first pass let the next one run in parallel"""
+        frames = []
+        for i in range(70):
+            frame = Image.new('RGBA', (40, 30), (20, 20, 20, 255))
+            frame.paste((0, 200, 0, 255), (0, 0, i % 40, 4))
+            frames.append(frame)
+        with open('decode.gif', 'wb') as f:
+            write_gif(f, frames, [50] * 70)
+
+        infos = scan_frames('decode.gif')
+        self.assertEqual([info.index for info in infos if info.keyframe], [0])
+        self.assertEqual(len(plan_segments(infos, 0, 70, 40 * 30 * 4, 2)), 1)
+
+        checkpoints = Checkpoints()
+        first = list(decode_frames('decode.gif', infos, max_workers=2, checkpoints=checkpoints))
+        self.assertEqual(checkpoints.before(70), 63)
+        self.assertEqual(checkpoints.before(63), 31)
+        segments = plan_segments(infos, 0, 70, 40 * 30 * 4, 2, checkpoints)
+        self.assertEqual([start for _, start, _ in segments], [0, 32, 64])
+
+        second = list(decode_frames('decode.gif', infos, max_workers=2, checkpoints=checkpoints))
+        expected = self.expected_frames()
+        self.assert_frames_equal(first, expected)
+        self.assert_frames_equal(second, expected)
+
+    def test_checkpoints_thin_out_over_budget(self):
+        """Test that checkpoints over their byte budget keep every other one"""
+        checkpoints = Checkpoints(interval=2, max_bytes=3 * 20 * 20 * 4)
+        for i in range(12):
+            checkpoints.add(i, Image.effect_noise((20, 20), 64).convert('RGBA'))
+        self.assertEqual(checkpoints.interval, 4)
+        self.assertEqual([checkpoints.before(i) for i in (4, 8, 12)], [3, 7, 11])
+        self.assertNotIn(5, checkpoints)
+        self.assertIsNone(checkpoints.canvas(5))
+
+
+class TestTransform(unittest.TestCase):
+    def setUp(self):
+        self.image = Image.new('RGBA', (6, 4))
+        self.image.putdata([(i * 10, 0, 0, 255) for i in range(24)])
+
+    def test_orientation_composes_without_touching_pixels(self):
+        """Test that any flip/rotate sequence collapses into one transpose"""
+        steps = ['rotate', 'flip', 'rotate', 'rotate', 'flip', 'rotate']
+        transform = Transform()
+        expected = self.image
+        for step in steps:
+            transform = getattr(transform, step)()
+            method = Image.FLIP_LEFT_RIGHT if step == 'flip' else Image.ROTATE_270
+            expected = expected.transpose(method)
+            self.assertEqual(transform.orient(self.image).tobytes(), expected.tobytes())
+
+        transform = Transform().flip().flip().rotate().rotate().rotate().rotate()
+        self.assertIsNone(transform.method)
+
+    def test_apply_resizes_orients_and_crops(self):
+        """Test that export applies all edits in one pass"""
+        transform = Transform().rotate().resized((6, 4)).cropped((1, 0, 3, 6))
+        small = self.image.resize((3, 2))
+        result = transform.apply(small)
+        self.assertEqual(result.size, (2, 6))
+        expected = small.resize((6, 4), Image.Resampling.LANCZOS).transpose(Image.ROTATE_270)
+        self.assertEqual(result.tobytes(), expected.crop((1, 0, 3, 6)).tobytes())
+
+        painted = Transform().apply(self.image, lambda image: image.putpixel((0, 0), (0, 0, 0, 0)))
+        self.assertEqual(painted.getpixel((0, 0)), (0, 0, 0, 0))
+        self.assertEqual(self.image.getpixel((0, 0)), (0, 0, 0, 255))
+
+    def test_indexed_frames_are_edited_packed(self):
+        """Test that packed frames are oriented and cropped on their indices"""
+        frame = IndexedFrame.from_image(self.image)
+        transform = Transform().flip().rotate().cropped((1, 1, 3, 5))
+        paint = lambda image: image.putpixel((0, 0), (0, 0, 0, 0))
+        with patch.object(IndexedFrame, 'to_rgba', autospec=True, side_effect=IndexedFrame.to_rgba) as expanded:
+            self.assertEqual(transform.apply(frame).tobytes(), transform.apply(self.image).tobytes())
+            # Only the cropped frame is expanded
+            self.assertEqual(expanded.call_count, 1)
+        self.assertIsInstance(transform.orient(frame), IndexedFrame)
+        self.assertEqual(transform.apply(frame, paint).tobytes(),
+                         transform.apply(self.image, paint).tobytes())
+        self.assertEqual(transform.resized((3, 2)).apply(frame).tobytes(),
+                         transform.resized((3, 2)).apply(self.image).tobytes())
+
+class TestRangeList(unittest.TestCase):
+    def test_merged_ranges(self):
+        """Test that merged ranges stay disjoint and answer lookups"""
+        ranges = RangeList(merge=True)
+        ranges.add(5, 7)
+        ranges.add(0, 1)
+        ranges.add(8, 9)
+        ranges.add(2, 2)
+        self.assertEqual(ranges, [(0, 2), (5, 9)])
+        self.assertTrue(ranges.covers(2))
+        self.assertFalse(ranges.covers(3))
+        self.assertTrue(ranges.covers(9))
+        self.assertFalse(ranges.covers(10))
+        self.assertEqual(ranges.next_uncovered(5, 1), 10)
+        self.assertEqual(ranges.next_uncovered(6, -1), 4)
+        self.assertEqual(ranges.next_uncovered(1, -1), -1)
+
+    def test_overlapping_ranges_keep_values(self):
+        """Test lookups of overlapping ranges with a value"""
+        ranges = RangeList([(4, 6, 0.5), (1, 2, 2.0), (1, 8, 0.75)])
+        self.assertEqual(ranges[0], (1, 2, 2.0))
+        self.assertTrue(ranges.covers(7))
+        self.assertEqual(ranges.range_at(7), (1, 8, 0.75))
+        self.assertEqual(ranges.range_at(5), (4, 6, 0.5))
+        self.assertFalse(ranges.covers(9))
+
+class TestDurationIndex(unittest.TestCase):
+    def test_range_stats_skip_removed_frames(self):
+        """Test that range statistics match a plain sum over kept frames"""
+        durations = [(i * 37) % 90 + 10 for i in range(50)]
+        removed = RangeList([(3, 7), (20, 20), (40, 45)], merge=True)
+        index = DurationIndex(durations, removed.covers)
+
+        for start, end in [(0, 49), (5, 30), (20, 20), (44, 2), (48, 60)]:
+            low, high = min(start, end), min(max(start, end), 49)
+            kept = [i for i in range(low, high + 1) if not removed.covers(i)]
+            self.assertEqual(index.range_stats(start, end),
+                             (len(kept), sum(durations[i] for i in kept)))
+
+        index.update(10, 500)
+        index.update(3, 40)
+        self.assertEqual(index.range_stats(3, 10), (4, 40 + durations[8] + durations[9] + 500))
+
+    def test_seek_to_timestamp(self):
+        """Test that a time maps to the frame on screen at that time"""
+        index = DurationIndex([100, 200, 300, 400], lambda i: i == 1)
+        self.assertEqual(index.seek(0), 0)
+        self.assertEqual(index.seek(99), 0)
+        self.assertEqual(index.seek(100), 2)
+        self.assertEqual(index.seek(399), 2)
+        self.assertEqual(index.seek(400), 3)
+        self.assertEqual(index.seek(799), 3)
+        self.assertEqual(index.seek(800), -1)
+        self.assertEqual(index.seek(50, start=2), 2)
+        self.assertEqual(index.seek(350, start=2), 3)
+
+        # Played backwards from frame 3
+        self.assertEqual(index.seek_back(0, 3), 3)
+        self.assertEqual(index.seek_back(399, 3), 3)
+        self.assertEqual(index.seek_back(400, 3), 2)
+        self.assertEqual(index.seek_back(699, 3), 2)
+        self.assertEqual(index.seek_back(700, 3), 0)
+        self.assertEqual(index.seek_back(800, 3), -1)
+        self.assertEqual(index.seek_back(50, 2), 2)
+
+class TestHistory(unittest.TestCase):
+    def test_undo_redo_shares_unchanged_fields(self):
+        """Test that snapshots share what an edit did not change"""
+        frames = tuple(Image.new('P', (4, 4)) for _ in range(3))
+        history = History()
+        history.reset({'frames': frames, 'removed_ranges': ()})
+        self.assertFalse(history.push({'frames': tuple(frames), 'removed_ranges': ()}))
+        self.assertTrue(history.push({'frames': tuple(frames), 'removed_ranges': ((0, 1),)}))
+        self.assertTrue(history.push({'frames': frames + frames[:1], 'removed_ranges': ((0, 1),)}))
+
+        state = history.undo()
+        self.assertIs(state['frames'], frames)
+        self.assertEqual(state['removed_ranges'], ((0, 1),))
+        self.assertEqual(history.undo()['removed_ranges'], ())
+        self.assertIsNone(history.undo())
+        self.assertEqual(len(history.redo()['removed_ranges']), 1)
+        self.assertEqual(len(history.redo()['frames']), 4)
+        self.assertFalse(history.can_redo)
+
+        history.undo()
+        history.push({'frames': frames, 'removed_ranges': ((2, 2),)})
+        self.assertFalse(history.can_redo)
+
+    def test_memory_cap_drops_oldest(self):
+        """Test that history stays within its byte budget"""
+        history = History(max_bytes=2000)
+        history.reset({'durations': ()})
+        for i in range(50):
+            history.push({'durations': tuple(range(i, i + 20))})
+        self.assertLessEqual(history._size, 2000)
+        steps = 0
+        while history.undo() is not None:
+            steps += 1
+        self.assertGreater(steps, 1)
+        self.assertLess(steps, 50)
+
+class TestTimeline(unittest.TestCase):
+    def setUp(self):
+        self.timeline = Timeline('abcde', [100, 200, 300, 400, 500])
+
+    def test_insert_and_duplicate_split_pieces(self):
+        """Test that edits rearrange runs of frames and ranges follow them"""
+        timeline = self.timeline
+        timeline.remove(0, 0)
+        timeline.insert(2, 'XY', [10, 20])
+        self.assertEqual(timeline.entries(), list('abXYcde'))
+        self.assertEqual(timeline.durations(), [100, 200, 10, 20, 300, 400, 500])
+        self.assertEqual(list(timeline.inserted_ranges), [(2, 3)])
+        self.assertEqual(list(timeline.removed_ranges), [(0, 0)])
+
+        self.assertEqual(timeline.duplicate(1, 3), 3)
+        self.assertEqual(timeline.entries(), list('abXYbXYcde'))
+        self.assertEqual(list(timeline.inserted_ranges), [(2, 6)])
+        self.assertEqual(len(timeline.pieces), 6)
+        self.assertEqual(timeline[-1], 'e')
+
+    def test_speed_and_removal(self):
+        """Test that the last speed wins and removed frames lose theirs"""
+        timeline = self.timeline
+        timeline.set_speed(1, 2, 2.0)
+        timeline.set_speed(2, 3, 0.5)
+        self.assertEqual(list(timeline.speed_ranges), [(1, 1, 2.0), (2, 3, 0.5)])
+        self.assertEqual(timeline.durations(), [100, 100, 600, 800, 500])
+        self.assertEqual(timeline.original_durations(), [100, 200, 300, 400, 500])
+
+        timeline.remove(2, 2)
+        self.assertEqual(list(timeline.speed_ranges), [(1, 1, 2.0), (3, 3, 0.5)])
+        self.assertTrue(timeline.is_removed(2))
+        timeline.set_speed(0, 4, 1.0)
+        self.assertEqual(list(timeline.speed_ranges), [])
+        self.assertRaises(ValueError, timeline.set_speed, 0, 0, 0)
+
+    def test_restore(self):
+        """Test that old pieces bring back the order"""
+        timeline = self.timeline
+        before = timeline.pieces
+        timeline.insert(3, 'X', [10])
+        timeline.duplicate(1, 4)
+        self.assertEqual(timeline.entries(), list('abcXdbcXde'))
+
+        timeline.restore(before)
+        self.assertEqual(timeline.entries(), list('abcde'))
+        self.assertEqual(len(timeline.pieces), 1)
+
+class TestProject(unittest.TestCase):
+    def setUp(self):
+        frames = [Image.new('RGB', (20, 10), (i * 60, 0, 0)) for i in range(4)]
+        frames[0].save('project.gif', save_all=True, append_images=frames[1:], duration=80)
+        Image.new('RGB', (20, 10), 'blue').save('project.png')
+
+    def tearDown(self):
+        for name in ('project.gif', 'project.png', 'test.fig'):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def test_round_trip(self):
+        """Test that a project stores edits and source references, not pixels"""
+        timeline = Timeline()
+        timeline.insert(0, range(4), [80] * 4, inserted=False, source=[('project.gif', 4)])
+        timeline.insert(2, ['png'], [100], source=[('project.png', 1)])
+        timeline.set_speed(0, 1, 2.0)
+        timeline.remove(4, 4)
+        state = {
+            'timeline': timeline.pieces,
+            'transform': Transform().rotate().cropped((0, 0, 10, 20)),
+            'flipped': False,
+            'rotated': True,
+            'display_size': (20, 10),
+            'text_rotation': 90,
+            'crop_rect': (0.1, 0.2, 0.5, 0.5),
+            'drawings': ((((1, 2), (3, 4)), '#FFFFFF'),),
+            'texts': (('hello', 5, 6),),
+            'loop': 0,
+        }
+        save_project('test.fig', state, timeline.sources)
+        self.assertLess(os.path.getsize('test.fig'), 2000)
+
+        loaded, sources = load_project('test.fig')
+        self.assertEqual(loaded['timeline'], timeline.pieces)
+        self.assertEqual(loaded['transform'].method, state['transform'].method)
+        self.assertEqual(loaded['transform'].crop, (0, 0, 10, 20))
+        for key in ('display_size', 'crop_rect', 'drawings', 'texts', 'loop', 'text_rotation'):
+            self.assertEqual(loaded[key], state[key])
+        self.assertEqual([[(os.path.basename(path), count) for path, count in source]
+                          for source in sources], [[('project.gif', 4)], [('project.png', 1)]])
+
+        # A source that changed no longer matches the recorded edits
+        Image.new('RGB', (20, 10), 'red').save('project.png')
+        self.assertRaises(ValueError, load_project, 'test.fig')
+
+class TestComposite(unittest.TestCase):
+    def setUp(self):
+        self.frames = [Image.new('RGB', (30, 20), (i * 2, 100, 200 - i * 2)) for i in range(70)]
+        self.transform = Transform().rotate().cropped((2, 4, 18, 26))
+        self.paint = OverlayPainter([([(10, 10), (20, 25)], '#FF0000')], [(12, 14, 'hi')],
+                                    0, 40, (20, 30))
+
+    def test_output_size(self):
+        """Test that the output size follows rotation and crop"""
+        self.assertEqual(Transform().rotate().output_size((30, 20)), (20, 30))
+        self.assertEqual(self.transform.output_size((30, 20)), (16, 22))
+        self.assertEqual(Transform().resized((15, 10)).output_size((30, 20)), (15, 10))
+
+    def test_parallel_matches_serial(self):
+        """Test that frames composited in worker processes come back in order and unchanged"""
+        serial = [self.transform.apply(frame.convert('RGBA'), self.paint) for frame in self.frames]
+        # Workers are used however cheap the edits are
+        with patch('fig.composite.WORKER_START_SECONDS', 0), patch('fig.composite.IPC_COST_FACTOR', 0), \
+                patch('os.cpu_count', return_value=2):
+            parallel = list(composite_frames(range(len(self.frames)), self.frames.__getitem__,
+                                             self.transform, self.paint, max_workers=2))
+        self.assertEqual(len(parallel), len(serial))
+        for expected, image in zip(serial, parallel):
+            self.assertEqual(image.size, expected.size)
+            self.assertEqual(image.tobytes(), expected.tobytes())
+
+    def test_cheap_exports_run_in_process(self):
+        """Test that no worker pool is started when it would not pay off"""
+        with patch('fig.composite.ProcessPoolExecutor') as pool:
+            copied = list(composite_frames(self.frames, lambda frame: frame, Transform(), max_workers=4))
+            edited = list(composite_frames(self.frames, lambda frame: frame, self.transform,
+                                           max_workers=4))
+        pool.assert_not_called()
+        self.assertEqual(len(copied), len(self.frames))
+        self.assertEqual(edited[5].tobytes(), self.transform.apply(self.frames[5].convert('RGBA')).tobytes())
+
+    def test_workers_decode_source_frames(self):
+        """Test that workers decode runs of source frames and match frames loaded here"""
+        frames = [Image.new('RGB', (30, 20), (i * 3, 100, 0)) for i in range(70)]
+        for i, frame in enumerate(frames):
+            frame.paste((255, 255, 255), (i % 30, 0, i % 30 + 1, 20))
+        frames[0].save('composite.gif', save_all=True, append_images=frames[1:], duration=40, loop=0)
+        store = FrameStore('composite.gif', spill_bytes=0)
+        try:
+            store.extend(scan_frames('composite.gif'))
+            # Reversed frames are loaded here, the others decoded by workers
+            entries = store.entries(0, 70) + store.entries(60, 70)[::-1]
+            load = Mock(side_effect=store.entry_frame)
+            with patch('fig.composite.WORKER_START_SECONDS', 0), patch('fig.composite.IPC_COST_FACTOR', 0), \
+                    patch('os.cpu_count', return_value=2):
+                parallel = list(composite_frames(entries, load, self.transform, self.paint,
+                                                 max_workers=2, source=store))
+            self.assertLess(load.call_count, len(entries) - 50)
+            self.assertEqual(len(parallel), len(entries))
+            for entry, image in zip(entries, parallel):
+                expected = self.transform.apply(store.entry_image(entry), self.paint)
+                self.assertEqual(image.tobytes(), expected.tobytes())
+        finally:
+            store.close()
+            os.remove('composite.gif')
+
+    def test_overlay_layer(self):
+        """Test that the overlay is rasterized once and composited onto every frame"""
+        painter = OverlayPainter([([(0, 5), (30, 25)], '#FF0000')], [(2, 8, 'hi'), (38, 30, 'edge')],
+                                 45, 40, (30, 20))
+        rgb = Image.new('RGB', (30, 20), 'blue')
+        rgba = Image.new('RGBA', (30, 20), 'blue')
+        painter(rgb)
+        painter(rgba)
+        self.assertEqual(len(painter._layers), 1)
+        self.assertEqual(rgba.convert('RGB').tobytes(), rgb.tobytes())
+        self.assertIn((255, 0, 0), [color for _, color in rgb.getcolors(1000)])
+        self.assertFalse(OverlayPainter([], [], 0, 40, (30, 20)))
+
+    def test_cancel(self):
+        """Test that a set cancel event stops compositing"""
+        import threading
+        cancel = threading.Event()
+        cancel.set()
+        self.assertEqual(list(composite_frames(self.frames, lambda frame: frame, self.transform,
+                                               cancel=cancel, max_workers=2)), [])
+
+class TestEncoder(unittest.TestCase):
+    def make_frames(self, transparent=()):
+        """A bar moving over a static background, frame 2 repeated"""
+        frames = []
+        for i in range(8):
+            frame = Image.new('RGBA', (60, 40), (30, 30, 30, 255))
+            frame.paste((200, 200, 0, 255), (5, 5, 55, 10))
+            frame.paste((255, 0, 0, 255), (i * 5, 20, i * 5 + 8, 30))
+            if i in transparent:
+                frame.paste((0, 0, 0, 0), (30, 0, 40, 40))
+            frames.append(frame)
+        frames.insert(3, frames[2].copy())
+        return frames
+
+    def encode(self, frames, palette=None):
+        output = io.BytesIO()
+        write_gif(output, frames, [50] * len(frames), loop=0, palette=palette)
+        output.seek(0)
+        return Image.open(output)
+
+    def assert_decodes_to(self, gif, frames):
+        def visible(image):
+            """Pixels with the colors under transparent ones zeroed"""
+            return Image.composite(image, Image.new('RGBA', image.size), image.getchannel('A')).tobytes()
+
+        self.assertEqual(gif.n_frames, len(frames))
+        for i, frame in enumerate(frames):
+            gif.seek(i)
+            self.assertEqual(visible(gif.convert('RGBA')), visible(frame))
+
+    def test_deltas(self):
+        """Test that frames only hold the changed box and repeats extend the duration"""
+        frames = self.make_frames()
+        gif = self.encode(frames)
+        self.assert_decodes_to(gif, frames[:3] + frames[4:])
+        gif.seek(2)
+        self.assertEqual(gif.info['duration'], 100)
+        gif.seek(1)
+        self.assertEqual(gif.dispose_extent, (0, 20, 13, 30))
+
+    def test_transparent_frames(self):
+        """Test that frames with transparent pixels are drawn onto a cleared canvas"""
+        frames = self.make_frames(transparent=(1, 4))
+        self.assert_decodes_to(self.encode(frames), frames[:3] + frames[4:])
+
+    def test_streaming(self):
+        """Test that frames are written while later ones are still being made"""
+        output = io.BytesIO()
+        written = []
+
+        def frames():
+            for frame in self.make_frames():
+                written.append(output.tell())
+                yield frame
+
+        write_gif(output, frames(), [50] * 9)
+        self.assertTrue(0 < written[3] < written[5] < written[-1] < output.tell())
+
+    def test_copy_frames(self):
+        """Test that trimmed, removed and sped up frames are copied bit for bit"""
+        frames = self.make_frames()
+        with open('copy.gif', 'wb') as f:
+            write_gif(f, frames, [50] * len(frames))
+        try:
+            infos = scan_frames('copy.gif')
+            methods = disposal_methods(infos)
+            # Deltas need the frame before them, the first ones are encoded anew
+            self.assertEqual(copy_start(infos[1:], methods, (60, 40)), 1)
+            self.assertEqual(copy_start(infos[:2] + infos[3:], methods, (60, 40)), 3)
+            kept = infos[:5]
+            self.assertEqual(copy_start(kept, methods, (60, 40)), 0)
+
+            output = io.BytesIO()
+            copy_frames(output, 'copy.gif', kept, [20, 30, 40, 50, 60], methods)
+            output.seek(0)
+            gif = Image.open(output)
+            self.assert_decodes_to(gif, frames[:3] + frames[4:6])
+            gif.seek(4)
+            self.assertEqual(gif.info['duration'], 60)
+            with open('copy.gif', 'rb') as f:
+                source = f.read()
+            self.assertIn(source[infos[2].descriptor:infos[2].end], output.getvalue())
+        finally:
+            os.remove('copy.gif')
+
+    def test_copy_keyframes(self):
+        """Test that frames painting the whole canvas can be copied in any order"""
+        frames = [Image.new('RGBA', (20, 10), (i * 50, 255 - i * 50, 0, 255)) for i in range(4)]
+        with open('copy.gif', 'wb') as f:
+            write_gif(f, frames, [50] * 4)
+        try:
+            infos = scan_frames('copy.gif')
+            methods = disposal_methods(infos)
+            order = [infos[3], infos[1], infos[2], infos[1]]
+            self.assertEqual(copy_start(order, methods, (20, 10)), 0)
+            # The first frame declares a transparent index, it only shows right on an empty canvas
+            self.assertIsNone(copy_start([infos[1], infos[0]], methods, (20, 10)))
+            output = io.BytesIO()
+            copy_frames(output, 'copy.gif', order, [50] * 4, methods)
+            output.seek(0)
+            gif = Image.open(output)
+            for i, k in enumerate((3, 1, 2, 1)):
+                gif.seek(i)
+                self.assertEqual(gif.convert('RGB').getpixel((5, 5)), frames[k].getpixel((5, 5))[:3])
+        finally:
+            os.remove('copy.gif')
+
+    def test_durations_round_to_centiseconds(self):
+        """Test that durations are rounded to the GIF's 10ms steps, not cut"""
+        frames = [Image.new('RGBA', (20, 10), (i * 80, 0, 0, 255)) for i in range(3)]
+        output = io.BytesIO()
+        write_gif(output, frames, [66, 34, 14])
+        with open('copy.gif', 'wb') as f:
+            f.write(output.getvalue())
+        try:
+            self.assertEqual(probe('copy.gif').durations, [70, 30, 10])
+            infos = scan_frames('copy.gif')
+            copied = io.BytesIO()
+            copy_frames(copied, 'copy.gif', infos, [133, 49, 4], disposal_methods(infos))
+            copied.seek(0)
+            gif = Image.open(copied)
+            durations = []
+            for i in range(3):
+                gif.seek(i)
+                durations.append(gif.info['duration'])
+            self.assertEqual(durations, [130, 50, 0])
+        finally:
+            os.remove('copy.gif')
+
+    def test_copy_trim_of_deltas(self):
+        """Test that a trim starting on a delta encodes only the frames before the next copyable one"""
+        frames = self.make_frames()
+        with open('copy.gif', 'wb') as f:
+            write_gif(f, frames, [50] * len(frames))
+        try:
+            infos = scan_frames('copy.gif')
+            methods = disposal_methods(infos)
+            kept = infos[3:]
+            self.assertEqual(copy_start(kept, methods, (60, 40)), 1)
+            with Image.open('copy.gif') as gif:
+                gif.seek(3)
+                images = [gif.convert('RGBA')]
+
+            output = io.BytesIO()
+            copy_frames(output, 'copy.gif', kept, [50] * len(kept), methods, images=images)
+            output.seek(0)
+            self.assert_decodes_to(Image.open(output), frames[4:])
+            with open('copy.gif', 'rb') as f:
+                source = f.read()
+            self.assertNotIn(source[infos[3].descriptor:infos[3].end], output.getvalue())
+            for info in infos[4:]:
+                self.assertIn(source[info.descriptor:info.end], output.getvalue())
+        finally:
+            os.remove('copy.gif')
+
+    def test_global_palette(self):
+        """Test that one sampled palette is shared by all frames"""
+        frames = self.make_frames(transparent=(4,))
+        palette = Palette.from_frames(frames, dither=True)
+        self.assertEqual(len(palette), 4)
+        gif = self.encode(frames, palette)
+        self.assertEqual(gif.global_palette.palette[:12], palette.colors)
+        self.assert_decodes_to(gif, frames[:3] + frames[4:])
+
+    def test_palette_from_table(self):
+        """Test that a source color table is reused only with an index left for transparency"""
+        palette = Palette.from_table(bytes([255, 0, 0, 0, 0, 0, 255, 0, 0, 0, 0, 0]))
+        self.assertEqual(palette.colors, bytes([255, 0, 0, 0, 0, 0]))
+        self.assertEqual(palette.transparency, 2)
+        self.assertEqual(len(palette.table()), 12)
+        self.assertIsNone(Palette.from_table(bytes(range(256)) * 3))
+
+    def test_palette_from_table_maps_exactly(self):
+        """Test that colors of a source table keep their index, however close they are"""
+        table = b''.join(bytes((100 + i % 5, 50 + i // 5 % 5, 200 + i // 25)) for i in range(250))
+        image = Image.new('RGB', (25, 10))
+        image.putdata([tuple(table[i * 3:i * 3 + 3]) for i in range(250)])
+        for dither in (False, True):
+            indexed = Palette.from_table(table, dither).map(image)
+            self.assertEqual(list(indexed.tobytes()), list(range(250)))
+
+class TestBudget(unittest.TestCase):
+    def setUp(self):
+        # A square moving over a gradient
+        background = Image.linear_gradient('L').resize((120, 80)).convert('RGBA')
+        self.frames = []
+        for i in range(40):
+            frame = background.copy()
+            frame.paste((255, 0, 0, 255), (i * 2, 30, i * 2 + 16, 46))
+            self.frames.append(frame)
+        self.load = Mock(side_effect=lambda frame: frame)
+        self.fitter = SizeFitter(self.frames, [40] * 40, self.load, Transform())
+
+    def written(self, settings):
+        output = io.BytesIO()
+        self.fitter.write(output, settings)
+        return output
+
+    def test_estimate_close_to_written_size(self):
+        """Test that sampled estimates come close to the size of the whole GIF"""
+        for settings in (SIZE_STEPS[0], SIZE_STEPS[-1]):
+            size = len(self.written(settings).getvalue())
+            self.assertAlmostEqual(self.fitter.estimate(settings) / size, 1, delta=0.15)
+
+    def test_samples_are_reused(self):
+        """Test that other colors only redo the quantizing, not the compositing"""
+        self.fitter.estimate(SizeSettings(0.5, 64, 1))
+        loads = self.load.call_count
+        self.fitter.estimate(SizeSettings(0.5, 16, 1))
+        self.assertEqual(self.load.call_count, loads)
+
+    def test_fit(self):
+        """Test that the best settings within the budget are scaled and decimated as given"""
+        budget = len(self.written(SIZE_STEPS[0]).getvalue()) // 3
+        index = self.fitter.fit(budget)
+        self.assertGreater(index, 0)
+        self.assertGreater(self.fitter.estimate(SIZE_STEPS[index - 1]), budget * ESTIMATE_MARGIN)
+
+        scale, colors, step = settings = SIZE_STEPS[index]
+        output = self.written(settings)
+        self.assertLessEqual(len(output.getvalue()), budget)
+        output.seek(0)
+        gif = Image.open(output)
+        self.assertEqual(gif.size, self.fitter.size(scale))
+        self.assertEqual(gif.size, (round(120 * scale), round(80 * scale)))
+        total = 0
+        for i in range(gif.n_frames):
+            gif.seek(i)
+            total += gif.info['duration']
+        self.assertEqual(total, 40 * 40)
+        self.assertLessEqual(gif.n_frames, -(-40 // step))
+
+
 def main():
     unittest.main()
 